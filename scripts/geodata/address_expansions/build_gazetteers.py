@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+'''
+build_gazetteers.py
+-------------------
+
+Builds the tries and canonical maps for every gazetteer in
+geodata.address_expansions.gazetteers and saves them to
+resources/gazetteers, where they're memory-mapped on first use instead
+of being rebuilt from the dictionaries in every process.
+
+Needs to be re-run after changing resources/dictionaries (gazetteers older
+than the dictionaries are ignored and rebuilt in memory).
+'''
+
+import argparse
+import os
+import sys
+
+this_dir = os.path.realpath(os.path.dirname(__file__))
+sys.path.append(os.path.realpath(os.path.join(os.pardir, os.pardir)))
+
+from geodata.address_expansions.gazetteers import build_gazetteers, GAZETTEERS_DIR
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-o', '--out-dir',
+                        default=GAZETTEERS_DIR,
+                        help='Output directory')
+
+    args = parser.parse_args()
+
+    build_gazetteers(args.out_dir)
@@ -2,9 +2,11 @@ import os
 import six
 
 from collections import defaultdict, OrderedDict
+from six.moves import cPickle as pickle
 
-from geodata.address_expansions.address_dictionaries import address_phrase_dictionaries
+from geodata.address_expansions.address_dictionaries import address_phrase_dictionaries, ADDRESS_EXPANSIONS_DIR
 from geodata.encoding import safe_decode, safe_encode
+from geodata.file_utils import ensure_dir
 from geodata.i18n.unicode_paths import DATA_DIR
 from geodata.text.normalize import normalized_tokens, normalize_string
 from geodata.text.tokenize import tokenize, token_types
@@ -16,6 +18,11 @@ from marisa_trie import BytesTrie
 
 DICTIONARIES_DIR = os.path.join(DATA_DIR, 'dictionaries')
 
+# Prebuilt tries, see build_gazetteers.py
+GAZETTEERS_DIR = os.path.join(DATA_DIR, 'gazetteers')
+TRIE_SUFFIX = '.trie'
+CANONICALS_SUFFIX = '.canonicals'
+
 PREFIX_KEY = u'\x02'
 SUFFIX_KEY = u'\x03'
 
@@ -26,13 +33,46 @@ POSSIBLE_ROMAN_NUMERALS = set(['i', 'ii', 'iii', 'iv', 'v', 'vi', 'vii', 'viii',
                                'm', 'mm', 'mmm', 'mmmm'])
 
 
+_dictionaries_mtime = None
+
+
+def dictionaries_mtime():
+    global _dictionaries_mtime
+    if _dictionaries_mtime is None:
+        _dictionaries_mtime = max([os.path.getmtime(os.path.join(root, filename))
+                                   for root, dirs, files in os.walk(ADDRESS_EXPANSIONS_DIR)
+                                   for filename in files] or [0])
+    return _dictionaries_mtime
+
+
 class DictionaryPhraseFilter(PhraseFilter):
     serialize = safe_encode
     deserialize = safe_decode
 
-    def __init__(self, *dictionaries):
+    def __init__(self, *dictionaries, **kw):
+        '''
+        The trie is built (or loaded from disk if the gazetteer has a name
+        and was saved with build_gazetteers.py) on first use.
+        '''
         self.dictionaries = dictionaries
-        self.canonicals = {}
+        self.name = kw.get('name')
+        self._trie = None
+        self._canonicals = None
+
+    @property
+    def trie(self):
+        if self._trie is None:
+            self.load()
+        return self._trie
+
+    @property
+    def canonicals(self):
+        if self._canonicals is None:
+            self.load()
+        return self._canonicals
+
+    def build(self):
+        canonicals = {}
 
         kvs = defaultdict(OrderedDict)
 
@@ -45,7 +85,7 @@ class DictionaryPhraseFilter(PhraseFilter):
                     canonical = phrases[0]
                     canonical_normalized = normalize_string(canonical)
 
-                    self.canonicals[(canonical, language, dictionary_name)] = phrases[1:]
+                    canonicals[(canonical, language, dictionary_name)] = phrases[1:]
 
                     for i, phrase in enumerate(phrases):
 
@@ -63,7 +103,35 @@ class DictionaryPhraseFilter(PhraseFilter):
 
         kvs = [(k, '|'.join([l, d, str(int(i)), safe_encode(c)])) for k, vals in kvs.iteritems() for (l, d, c), i in vals.iteritems()]
 
-        self.trie = BytesTrie(kvs)
+        return BytesTrie(kvs), canonicals
+
+    def trie_path(self, d=GAZETTEERS_DIR):
+        return os.path.join(d, self.name + TRIE_SUFFIX)
+
+    def canonicals_path(self, d=GAZETTEERS_DIR):
+        return os.path.join(d, self.name + CANONICALS_SUFFIX)
+
+    def is_built(self, d=GAZETTEERS_DIR):
+        if self.name is None or not os.path.exists(self.trie_path(d)) or not os.path.exists(self.canonicals_path(d)):
+            return False
+        return os.path.getmtime(self.trie_path(d)) >= dictionaries_mtime()
+
+    def save(self, d=GAZETTEERS_DIR):
+        ensure_dir(d)
+        self.trie.save(self.trie_path(d))
+        f = open(self.canonicals_path(d), 'wb')
+        pickle.dump(self.canonicals, f, pickle.HIGHEST_PROTOCOL)
+        f.close()
+
+    def load(self, d=GAZETTEERS_DIR):
+        if self.is_built(d):
+            # Memory-mapped, so processes loading the same gazetteer share pages
+            self._trie = BytesTrie().mmap(self.trie_path(d))
+            f = open(self.canonicals_path(d), 'rb')
+            self._canonicals = pickle.load(f)
+            f.close()
+        else:
+            self._trie, self._canonicals = self.build()
 
     def serialize(self, s):
         return s
@@ -71,19 +139,6 @@ class DictionaryPhraseFilter(PhraseFilter):
     def deserialize(self, s):
         return s
 
-    def search_substring(self, s):
-        if len(s) == 0:
-            return None, 0
-
-        for i in xrange(len(s) + 1):
-            if not self.trie.has_keys_with_prefix(s[:i]):
-                i -= 1
-                break
-        if i > 0:
-            return (self.trie.get(s[:i]), i)
-        else:
-            return None, 0
-
     def search_suffix(self, token):
         suffix_search, suffix_len = self.search_substring(SUFFIX_KEY + token[::-1])
         if suffix_len > 0:
@@ -240,21 +295,27 @@ ALL_ABBREVIATION_DICTIONARIES = STREET_TYPES_DICTIONARIES + \
 _gazetteers = []
 
 
-def create_gazetteer(*dictionaries):
-    g = DictionaryPhraseFilter(*dictionaries)
+def create_gazetteer(name, *dictionaries):
+    g = DictionaryPhraseFilter(*dictionaries, name=name)
     _gazetteers.append(g)
     return g
 
 
-street_types_gazetteer = create_gazetteer(*STREET_TYPES_DICTIONARIES)
-street_types_only_gazetteer = create_gazetteer(*STREET_TYPES_ONLY_DICTIONARIES)
-qualifiers_gazetteer = create_gazetteer(QUALIFIERS_DICTIONARY)
-names_gazetteer = create_gazetteer(*NAME_DICTIONARIES)
-chains_gazetteer = create_gazetteer(CHAIN_DICTIONARY)
-unit_types_gazetteer = create_gazetteer(*UNIT_ABBREVIATION_DICTIONARIES)
-street_and_synonyms_gazetteer = create_gazetteer(*(STREET_TYPES_DICTIONARIES + (SYNONYM_DICTIONARY, )))
-abbreviations_gazetteer = create_gazetteer(*ALL_ABBREVIATION_DICTIONARIES)
-toponym_abbreviations_gazetteer = create_gazetteer(*TOPONYM_ABBREVIATION_DICTIONARIES)
-toponym_gazetteer = create_gazetteer(TOPONYMS_DICTIONARY)
-given_name_gazetteer = create_gazetteer(GIVEN_NAME_DICTIONARY)
-venue_names_gazetteer = create_gazetteer(*VENUE_NAME_DICTIONARIES)
+def build_gazetteers(d=GAZETTEERS_DIR):
+    for g in _gazetteers:
+        g._trie, g._canonicals = g.build()
+        g.save(d)
+
+
+street_types_gazetteer = create_gazetteer('street_types', *STREET_TYPES_DICTIONARIES)
+street_types_only_gazetteer = create_gazetteer('street_types_only', *STREET_TYPES_ONLY_DICTIONARIES)
+qualifiers_gazetteer = create_gazetteer('qualifiers', QUALIFIERS_DICTIONARY)
+names_gazetteer = create_gazetteer('names', *NAME_DICTIONARIES)
+chains_gazetteer = create_gazetteer('chains', CHAIN_DICTIONARY)
+unit_types_gazetteer = create_gazetteer('unit_types', *UNIT_ABBREVIATION_DICTIONARIES)
+street_and_synonyms_gazetteer = create_gazetteer('street_and_synonyms', *(STREET_TYPES_DICTIONARIES + (SYNONYM_DICTIONARY, )))
+abbreviations_gazetteer = create_gazetteer('abbreviations', *ALL_ABBREVIATION_DICTIONARIES)
+toponym_abbreviations_gazetteer = create_gazetteer('toponym_abbreviations', *TOPONYM_ABBREVIATION_DICTIONARIES)
+toponym_gazetteer = create_gazetteer('toponyms', TOPONYMS_DICTIONARY)
+given_name_gazetteer = create_gazetteer('given_names', GIVEN_NAME_DICTIONARY)
+venue_names_gazetteer = create_gazetteer('venue_names', *VENUE_NAME_DICTIONARIES)
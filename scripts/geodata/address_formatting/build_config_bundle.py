@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+'''
+build_config_bundle.py
+----------------------
+
+Clones the address-formatting repo, applies libpostal's config
+(resources/formatting/global.yaml) and writes the result to a pickle
+that AddressFormatter loads at startup instead of cloning and parsing
+the YAML itself.
+
+Needs to be re-run whenever global.yaml changes (AddressFormatter falls
+back to cloning if the bundle is stale) or to pick up upstream template
+changes.
+'''
+
+import argparse
+import os
+import sys
+
+this_dir = os.path.realpath(os.path.dirname(__file__))
+sys.path.append(os.path.realpath(os.path.join(os.pardir, os.pardir)))
+
+from geodata.address_formatting.formatter import AddressFormatter, FORMATTER_CONFIG_BUNDLE
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-o', '--out-file',
+                        default=FORMATTER_CONFIG_BUNDLE,
+                        help='Output file')
+
+    parser.add_argument('--scratch-dir',
+                        default='/tmp',
+                        help='Directory to clone the address-formatting repo into')
+
+    args = parser.parse_args()
+
+    formatter = AddressFormatter(scratch_dir=args.scratch_dir, config_bundle=None)
+    formatter.save_config_bundle(args.out_file)
+    print('Wrote config bundle for address-formatting@{} to {}'.format(formatter.formatter_repo_commit, args.out_file))
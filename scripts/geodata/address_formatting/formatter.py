@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import copy
+import hashlib
+import logging
 import os
 import pystache
 import random
@@ -9,9 +11,11 @@ import subprocess
 import yaml
 
 from collections import OrderedDict, defaultdict
-from itertools import ifilter
+from lru import LRU
+from six.moves import cPickle as pickle
 
 from geodata.address_formatting.aliases import Aliases
+from geodata.address_formatting.templates import CompiledTemplate
 from geodata.configs.utils import nested_get, recursive_merge
 from geodata.math.floats import isclose
 from geodata.math.sampling import weighted_choice, cdf
@@ -25,6 +29,15 @@ this_dir = os.path.realpath(os.path.dirname(__file__))
 FORMATTER_CONFIG = os.path.join(this_dir, os.pardir, os.pardir, os.pardir,
                                 'resources', 'formatting', 'global.yaml')
 
+# Prebuilt config, see build_config_bundle.py
+FORMATTER_CONFIG_BUNDLE = os.path.join(this_dir, os.pardir, os.pardir, os.pardir,
+                                       'resources', 'formatting', 'address_formatting.pkl')
+
+# Bump when the bundled attributes or the way they're computed change
+CONFIG_BUNDLE_VERSION = 1
+
+logger = logging.getLogger('address_formatting')
+
 
 class AddressFormatter(object):
     '''
@@ -48,6 +61,9 @@ class AddressFormatter(object):
 
     splitter = ' | '
 
+    # Number of (template, country, language, component set) entries in revised_template's cache
+    template_cache_size = 10000
+
     separator_tag = 'SEP'
     field_separator_tag = 'FSEP'
 
@@ -181,28 +197,110 @@ class AddressFormatter(object):
 
     FIRST, BEFORE, AFTER, LAST = range(4)
 
-    def __init__(self, scratch_dir='/tmp', splitter=None):
+    # Everything computed from the address-formatting repo and global.yaml
+    CONFIG_BUNDLE_ATTRIBUTES = (
+        'config',
+        'language_configs',
+        'country_configs',
+        'country_formats',
+        'country_aliases',
+        'house_number_ordering',
+        'language_code_replacements',
+        'global_insertions',
+        'global_conditionals',
+        'global_invert_probability',
+        'country_insertions',
+        'country_conditionals',
+        'country_invert_probabilities',
+        'language_insertions',
+        'language_conditionals',
+        'templates_no_name',
+        'templates_place_only',
+    )
+
+    def __init__(self, scratch_dir='/tmp', splitter=None, config_bundle=FORMATTER_CONFIG_BUNDLE):
+        '''
+        config_bundle: path to a prebuilt config (see build_config_bundle.py).
+                       If it doesn't exist or is stale, the address-formatting
+                       repo is cloned into scratch_dir and parsed instead.
+        '''
         if splitter is not None:
             self.splitter = splitter
 
         self.formatter_repo_path = os.path.join(scratch_dir, 'address-formatting')
-        self.clone_repo()
+        self.formatter_repo_commit = None
 
-        self.load_config()
-        self.load_country_formats()
+        if not config_bundle or not self.load_config_bundle(config_bundle):
+            self.clone_repo()
 
-        self.language_code_replacements = self.config['language_code_replacements']
+            self.load_config()
+            self.load_country_formats()
 
-        self.setup_insertion_probabilities()
-        self.setup_no_name_templates()
-        self.setup_place_only_templates()
+            self.language_code_replacements = self.config['language_code_replacements']
 
-        self.template_cache = {}
-        self.parsed_cache = {}
+            self.setup_insertion_probabilities()
+            self.setup_no_name_templates()
+            self.setup_place_only_templates()
+
+        self.template_cache = LRU(self.template_cache_size)
+        self.template_cache_hits = 0
+        self.template_cache_misses = 0
+        self.compiled_cache = {}
 
     def clone_repo(self):
         subprocess.check_call(['rm', '-rf', self.formatter_repo_path])
         subprocess.check_call(['git', 'clone', FORMATTER_GIT_REPO, self.formatter_repo_path])
+        self.formatter_repo_commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                                             cwd=self.formatter_repo_path).strip()
+
+    @classmethod
+    def config_hash(cls):
+        return hashlib.sha1(open(FORMATTER_CONFIG, 'rb').read()).hexdigest()
+
+    def save_config_bundle(self, filename):
+        bundle = {
+            'version': CONFIG_BUNDLE_VERSION,
+            'config_hash': self.config_hash(),
+            'formatter_repo_commit': self.formatter_repo_commit,
+            'attributes': {k: getattr(self, k) for k in self.CONFIG_BUNDLE_ATTRIBUTES},
+        }
+        f = open(filename, 'wb')
+        pickle.dump(bundle, f, pickle.HIGHEST_PROTOCOL)
+        f.close()
+
+    def load_config_bundle(self, filename):
+        if not os.path.exists(filename):
+            logger.warning('No config bundle at {}, cloning the address-formatting repo instead. '
+                           'Run address_formatting/build_config_bundle.py to create it'.format(filename))
+            return False
+
+        try:
+            f = open(filename, 'rb')
+            try:
+                bundle = pickle.load(f)
+            finally:
+                f.close()
+        except Exception as e:
+            # Truncated or written by an incompatible version, rebuild from the repo
+            logger.warning('Ignoring config bundle {}, could not be loaded: {!r}'.format(filename, e))
+            return False
+
+        if not isinstance(bundle, dict) or 'attributes' not in bundle:
+            logger.warning('Ignoring config bundle {}, not a config bundle'.format(filename))
+            return False
+
+        if bundle.get('version') != CONFIG_BUNDLE_VERSION:
+            logger.warning('Ignoring config bundle {}, version {} != {}'.format(filename, bundle.get('version'), CONFIG_BUNDLE_VERSION))
+            return False
+
+        if bundle.get('config_hash') != self.config_hash():
+            logger.warning('Ignoring config bundle {}, {} has changed since it was built'.format(filename, FORMATTER_CONFIG))
+            return False
+
+        for k, v in six.iteritems(bundle['attributes']):
+            setattr(self, k, v)
+        self.formatter_repo_commit = bundle.get('formatter_repo_commit')
+        return True
 
     def load_country_formats(self):
         config = yaml.load(open(os.path.join(self.formatter_repo_path,
@@ -304,7 +402,7 @@ class AddressFormatter(object):
         # If the probabilities don't sum to 1, add a "do nothing" action
         if not isclose(sum(probs), 1.0):
             probs.append(1.0 - sum(probs))
-            values.append((None, None, False))
+            values.append((None, None))
 
         return values, cdf(probs)
 
@@ -564,15 +662,20 @@ class AddressFormatter(object):
 
         return template
 
+    def compile_template(self, template, tagged=False):
+        cache_key = (template, tagged)
+        compiled = self.compiled_cache.get(cache_key)
+        if compiled is None:
+            template_text = template if not tagged else self.tag_template_separators(template)
+            compiled = CompiledTemplate(template_text)
+            self.compiled_cache[cache_key] = compiled
+        return compiled
+
     def render_template(self, template, components, tagged=False):
-        def render_first(text):
-            text = pystache.render(text, **components)
-            splits = (e.strip() for e in text.split('||'))
-            selected = next(ifilter(bool, splits), '')
-            return selected
+        if not isinstance(template, CompiledTemplate):
+            template = self.compile_template(template)
 
-        output = pystache.render(template, first=render_first,
-                                 **components).strip()
+        output = template.render(components).strip()
 
         values = self.whitespace_component_regex.split(output)
 
@@ -607,10 +710,7 @@ class AddressFormatter(object):
                 text = re.sub(regex, replacement, text)
         return text
 
-    def revised_template(self, template, components, country, language=None):
-        if not template:
-            return None
-
+    def insertion_plan(self, components, country, language=None):
         country_language = None
         if language:
             country_language = '{}_{}'.format(country, language)
@@ -622,40 +722,28 @@ class AddressFormatter(object):
         else:
             country = alias_country
 
-        cache_keys = []
-
         invert_probability = self.country_invert_probabilities.get(country, self.global_invert_probability)
-        if random.random() < invert_probability:
-            cache_keys.append('inverted')
-            cache_key = tuple(sorted(cache_keys))
-            if cache_key in self.template_cache:
-                template = self.template_cache[cache_key]
-            else:
-                template = self.inverted(template)
-                self.template_cache[cache_key] = template
+
+        insertions_by_component = []
 
         for component in sorted(components, key=self.component_order.get):
-            scope = country
             insertions = nested_get(self.country_insertions, (country, component), default=None)
             conditionals = nested_get(self.country_conditionals, (country, component), default=None)
 
             if insertions is None and language:
                 insertions = nested_get(self.country_insertions, (country_language, component), default=None)
-                scope = country_language
 
             if conditionals is None and language:
                 conditionals = nested_get(self.country_conditionals, (country_language, component), default=None)
 
             if insertions is None and language:
                 insertions = nested_get(self.language_insertions, (language, component), default=None)
-                scope = 'lang:{}'.format(language)
 
             if conditionals is None and language:
                 conditionals = nested_get(self.language_conditionals, (language, component), default=None)
 
             if insertions is None:
                 insertions = nested_get(self.global_insertions, (component,), default=None)
-                scope = None
 
             if conditionals is None:
                 conditionals = nested_get(self.global_conditionals, (component,), default=None)
@@ -668,78 +756,113 @@ class AddressFormatter(object):
                             conditional_insertions = v
                             break
 
-                order, other = None, None
+                insertions_by_component.append((component, conditional_insertions, insertions))
+
+        return invert_probability, insertions_by_component
+
+    def insert_components(self, template, invert, insertions):
+        if invert:
+            template = self.inverted(template)
+
+        for component, order, other in insertions:
+            other_token = self.tag_token(other)
+
+            # Don't allow insertions between road and house_number
+            # This can happen if e.g. "level" is supposed to be inserted
+            # after house number assuming that it's a continental European
+            # address where house number comes after road. If in a previous
+            # insertion we were to swap house_number and road to create an
+            # English-style address, the final ordering would be
+            # house_number, unit, road, which we don't want. So effectively
+            # treat house_number and road as an atomic unit.
+
+            if other == self.HOUSE_NUMBER and component != self.ROAD:
+                road_tag = self.tag_token(self.ROAD)
+                house_number_tag = other_token
+
+                if house_number_tag in template and road_tag in template:
+                    road_after_house_number = template.index(road_tag) > template.index(house_number_tag)
+
+                    if road_after_house_number and order == self.AFTER:
+                        other = self.ROAD
+                    elif not road_after_house_number and order == self.BEFORE:
+                        other = self.ROAD
+            elif other == self.ROAD and component != self.HOUSE_NUMBER:
+                house_number_tag = self.tag_token(self.HOUSE_NUMBER)
+                road_tag = other_token
+
+                if house_number_tag in template and road_tag in template:
+                    road_before_house_number = template.index(road_tag) < template.index(house_number_tag)
+
+                    if road_before_house_number and order == self.AFTER:
+                        other = self.HOUSE_NUMBER
+                    elif not road_before_house_number and order == self.BEFORE:
+                        other = self.HOUSE_NUMBER
+
+            if order == self.BEFORE and other_token in template:
+                template = self.insert_component(template, component, before=other)
+            elif order == self.AFTER and other_token in template:
+                template = self.insert_component(template, component, after=other)
+            elif order == self.LAST:
+                template = self.insert_component(template, component, last=True)
+            elif order == self.FIRST:
+                template = self.insert_component(template, component, first=True)
 
-                # Check the conditional probabilities first
-                if conditional_insertions is not None:
-                    values, probs = conditional_insertions
-                    order, other = weighted_choice(values, probs)
+        return template
 
-                # If there are no conditional probabilites or the "default" value was chosen, sample from the marginals
-                if other is None:
-                    values, probs = insertions
-                    order, other = weighted_choice(values, probs)
+    def revised_template(self, template, components, country, language=None):
+        if not template:
+            return None
 
-                # Even though we may change the value of "other" below, use
-                # the original cache key because changes from here on are
-                # deterministic and should be cached.
-                insertion_id = (scope, component, order, other)
-                cache_keys.append(insertion_id)
+        # The insertion probabilities only depend on which components are
+        # present, so the lookups are done once per component set and each
+        # combination of draws maps to a template which is only built once
+        cache_key = (template, country, language, frozenset(components))
+        plan = self.template_cache.get(cache_key)
+        if plan is None:
+            self.template_cache_misses += 1
+            invert_probability, insertions_by_component = self.insertion_plan(components, country, language=language)
+            plan = (invert_probability, insertions_by_component, {})
+            self.template_cache[cache_key] = plan
+        else:
+            self.template_cache_hits += 1
 
-                cache_key = tuple(sorted(cache_keys))
+        invert_probability, insertions_by_component, revised_templates = plan
 
-                if cache_key in self.template_cache:
-                    template = self.template_cache[cache_key]
-                    continue
+        invert = random.random() < invert_probability
 
-                other_token = self.tag_token(other)
-
-                # Don't allow insertions between road and house_number
-                # This can happen if e.g. "level" is supposed to be inserted
-                # after house number assuming that it's a continental European
-                # address where house number comes after road. If in a previous
-                # insertion we were to swap house_number and road to create an
-                # English-style address, the final ordering would be
-                # house_number, unit, road, which we don't want. So effectively
-                # treat house_number and road as an atomic unit.
-
-                if other == self.HOUSE_NUMBER and component != self.ROAD:
-                    road_tag = self.tag_token(self.ROAD)
-                    house_number_tag = other_token
-
-                    if house_number_tag in template and road_tag in template:
-                        road_after_house_number = template.index(road_tag) > template.index(house_number_tag)
-
-                        if road_after_house_number and order == self.AFTER:
-                            other = self.ROAD
-                        elif not road_after_house_number and order == self.BEFORE:
-                            other = self.ROAD
-                elif other == self.ROAD and component != self.HOUSE_NUMBER:
-                    house_number_tag = self.tag_token(self.HOUSE_NUMBER)
-                    road_tag = other_token
-
-                    if house_number_tag in template and road_tag in template:
-                        road_before_house_number = template.index(road_tag) < template.index(house_number_tag)
-
-                        if road_before_house_number and order == self.AFTER:
-                            other = self.HOUSE_NUMBER
-                        elif not road_before_house_number and order == self.BEFORE:
-                            other = self.HOUSE_NUMBER
-
-                if order == self.BEFORE and other_token in template:
-                    template = self.insert_component(template, component, before=other)
-                elif order == self.AFTER and other_token in template:
-                    template = self.insert_component(template, component, after=other)
-                elif order == self.LAST:
-                    template = self.insert_component(template, component, last=True)
-                elif order == self.FIRST:
-                    template = self.insert_component(template, component, first=True)
-                else:
-                    continue
+        insertions = []
+        for component, conditional_insertions, marginal_insertions in insertions_by_component:
+            order, other = None, None
 
-                self.template_cache[cache_key] = template
+            # Check the conditional probabilities first
+            if conditional_insertions is not None:
+                values, probs = conditional_insertions
+                order, other = weighted_choice(values, probs)
 
-        return template
+            # If there are no conditional probabilites or the "default" value was chosen, sample from the marginals
+            if other is None:
+                values, probs = marginal_insertions
+                order, other = weighted_choice(values, probs)
+
+            insertions.append((component, order, other))
+
+        draw = (invert, tuple(insertions))
+        revised = revised_templates.get(draw)
+        if revised is None:
+            revised = self.insert_components(template, invert, insertions)
+            revised_templates[draw] = revised
+
+        return revised
+
+    def template_cache_stats(self):
+        lookups = self.template_cache_hits + self.template_cache_misses
+        return {
+            'size': len(self.template_cache),
+            'hits': self.template_cache_hits,
+            'misses': self.template_cache_misses,
+            'hit_rate': float(self.template_cache_hits) / lookups if lookups else 0.0,
+        }
 
     def remove_repeat_template_separators(self, template):
         return re.sub('(?:[\s]*([,;\-]/{})[\s]*){{2,}}'.format(self.separator_tag), r' \1 ', template)
@@ -902,14 +1025,7 @@ class AddressFormatter(object):
         if template_text is None:
             return None
 
-        if tag_components:
-            template_text = self.tag_template_separators(template_text)
-
-        if template_text in self.parsed_cache:
-            template = self.parsed_cache[template_text]
-        else:
-            template = pystache.parse(template_text)
-            self.parsed_cache[template_text] = template
+        template = self.compile_template(template_text, tagged=tag_components)
 
         if replace_aliases:
             self.aliases.replace(components)
@@ -0,0 +1,154 @@
+'''
+geodata.address_formatting.templates
+------------------------------------
+
+Compiled renderer for the subset of Mustache used by address-formatting
+templates, i.e. variables like {{{road}}} and {{road}}, sections and
+inverted sections on component values ({{#house}}...{{/house}},
+{{^house}}...{{/house}}) and the "first" lambda section:
+{{#first}} {{{city}}} || {{{town}}} {{/first}}, which renders to the first
+non-empty alternative.
+
+pystache re-parses the body of every "first" section on every render,
+which makes it the bottleneck in format_address. Here each template is
+parsed once into a nested list of parts and rendering is just a join.
+
+Output is the same as rendering with pystache and a "first" lambda (see
+tests/test_address_templates.py), including standalone section tags
+consuming their line, with these differences which don't occur for
+address components:
+
+- component values are plain strings, so a section is rendered once if
+  its value is non-empty and is not iterated over or used as a context
+- the output of the "first" section is not re-rendered as a template
+- partials and delimiter changes are not supported
+'''
+
+import re
+import six
+
+FIRST_SECTION = 'first'
+FIRST_SEPARATOR = '||'
+
+LITERAL, VARIABLE, ESCAPED_VARIABLE, FIRST, SECTION, INVERTED_SECTION = range(6)
+
+# Same tag syntax as pystache, including the whitespace before the tag so
+# standalone tags can be removed along with their line
+tag_regex = re.compile(six.u(r'([ \t]*)\{\{\s*(?:\{\s*(.+?)\s*\}|([#/&!^>=]?)\s*([\s\S]+?))\s*\}\}'), re.UNICODE)
+
+END_OF_LINE_CHARACTERS = (u'\r', u'\n')
+
+
+def escape_html(value):
+    return value.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(u'>', u'&gt;').replace(u'"', u'&quot;')
+
+
+def parse_template(template):
+    '''
+    Parse a template into a list of (part_type, value) tuples where value
+    is a literal string or a component key, for FIRST a list of parts and
+    for SECTION/INVERTED_SECTION a (key, parts) tuple
+    '''
+    stack = [[]]
+    sections = []
+
+    pos = 0
+    for match in tag_regex.finditer(template):
+        whitespace, triple_key, sigil, key = match.groups()
+        start, end = match.start(), match.end()
+
+        if triple_key is not None:
+            sigil, key = '&', triple_key
+
+        # Standalone section and comment tags consume the whole line
+        begins_line = start == 0 or template[start - 1] in END_OF_LINE_CHARACTERS
+        ends_line = end == len(template) or template[end] in END_OF_LINE_CHARACTERS
+        if begins_line and ends_line and sigil not in ('', '&'):
+            if template[end:end + 1] == u'\r':
+                end += 1
+            if template[end:end + 1] == u'\n':
+                end += 1
+        else:
+            start += len(whitespace)
+
+        if start > pos:
+            stack[-1].append((LITERAL, template[pos:start]))
+        pos = end
+
+        if sigil == '&':
+            stack[-1].append((VARIABLE, key))
+        elif sigil == '!':
+            continue
+        elif sigil in ('#', '^'):
+            sections.append((sigil, key))
+            stack.append([])
+        elif sigil == '/':
+            if not sections or sections[-1][1] != key:
+                raise ValueError(six.u('Unmatched section end {} in template: {}').format(key, template))
+            section_sigil, key = sections.pop()
+            parts = stack.pop()
+            if section_sigil == '^':
+                stack[-1].append((INVERTED_SECTION, (key, parts)))
+            elif key == FIRST_SECTION:
+                stack[-1].append((FIRST, parts))
+            else:
+                stack[-1].append((SECTION, (key, parts)))
+        elif sigil in ('>', '='):
+            raise ValueError(six.u('Partials and delimiter changes are not supported in template: {}').format(template))
+        else:
+            stack[-1].append((ESCAPED_VARIABLE, key))
+
+    if sections:
+        raise ValueError(six.u('Unclosed section {} in template: {}').format(sections[-1][1], template))
+
+    if pos < len(template):
+        stack[-1].append((LITERAL, template[pos:]))
+
+    return stack[0]
+
+
+def component_value(components, key):
+    value = components.get(key)
+    if value is None:
+        return u''
+    elif not isinstance(value, six.string_types):
+        return six.text_type(value)
+    return value
+
+
+def render_parts(parts, components):
+    out = []
+    for part_type, value in parts:
+        if part_type == LITERAL:
+            out.append(value)
+        elif part_type == VARIABLE:
+            out.append(component_value(components, value))
+        elif part_type == ESCAPED_VARIABLE:
+            out.append(escape_html(component_value(components, value)))
+        elif part_type == SECTION:
+            key, section_parts = value
+            if components.get(key):
+                out.append(render_parts(section_parts, components))
+        elif part_type == INVERTED_SECTION:
+            key, section_parts = value
+            if not components.get(key):
+                out.append(render_parts(section_parts, components))
+        else:
+            text = render_parts(value, components)
+            for alternative in text.split(FIRST_SEPARATOR):
+                alternative = alternative.strip()
+                if alternative:
+                    out.append(alternative)
+                    break
+    return u''.join(out)
+
+
+class CompiledTemplate(object):
+    def __init__(self, template):
+        self.template = template
+        self.parts = parse_template(template)
+
+    def render(self, components):
+        return render_parts(self.parts, components)
+
+    __call__ = render
@@ -30,6 +30,7 @@ from geodata.addresses.metro_stations import MetroStation
 from geodata.addresses.numbering import Digits
 from geodata.addresses.po_boxes import POBox
 from geodata.addresses.postcodes import PostCode
+from geodata.addresses.reverse_geocode_context import ReverseGeocodeContext
 from geodata.addresses.staircases import Staircase
 from geodata.addresses.units import Unit
 from geodata.boundaries.names import boundary_names
@@ -265,6 +266,17 @@ class AddressComponents(object):
     def osm_reverse_geocoded_components(self, latitude, longitude):
         return self.osm_admin_rtree.point_in_poly(latitude, longitude, return_all=True)
 
+    def reverse_geocode_context(self, latitude, longitude, **indices):
+        '''
+        ReverseGeocodeContext for a coordinate using this instance's indices,
+        plus any others (country_rtree, buildings_rtree, etc.) passed in
+        '''
+        return ReverseGeocodeContext(latitude, longitude,
+                                     osm_admin_rtree=self.osm_admin_rtree,
+                                     neighborhoods_rtree=self.neighborhoods_rtree,
+                                     places_index=self.places_index,
+                                     **indices)
+
     @classmethod
     def osm_country_and_languages(cls, osm_components):
         return OSMCountryReverseGeocoder.country_and_languages_from_components(osm_components)
@@ -1060,7 +1072,7 @@ class AddressComponents(object):
                     val = cls.name_hyphens(val)
             address_components[component] = val
 
-    def add_city_and_equivalent_points(self, grouped_components, containing_components, country, latitude, longitude):
+    def add_city_and_equivalent_points(self, grouped_components, containing_components, country, latitude, longitude, context=None):
         city_replacements = place_config.city_replacements(country)
 
         is_japan = country == Countries.JAPAN
@@ -1068,7 +1080,12 @@ class AddressComponents(object):
 
         first_village = None
 
-        for props, lat, lon, dist in self.places_index.nearest_points(latitude, longitude):
+        if context is not None:
+            nearby_places = context.nearby_places
+        else:
+            nearby_places = self.places_index.nearest_points(latitude, longitude)
+
+        for props, lat, lon, dist in nearby_places:
             component = self.categorize_osm_component(country, props, containing_components)
             if component is None:
                 continue
@@ -1112,6 +1129,7 @@ class AddressComponents(object):
                              random_key=True,
                              add_city_points=True,
                              drop_duplicate_city_names=True,
+                             context=None,
                              ):
         '''
         OSM boundaries
@@ -1166,7 +1184,7 @@ class AddressComponents(object):
             existing_city_name = address_components.get(AddressFormatter.CITY)
 
             if add_city_points and not existing_city_name and AddressFormatter.CITY not in grouped_osm_components:
-                self.add_city_and_equivalent_points(grouped_osm_components, osm_components, country, latitude, longitude)
+                self.add_city_and_equivalent_points(grouped_osm_components, osm_components, country, latitude, longitude, context=context)
 
             city_replacements = place_config.city_replacements(country)
             have_city = AddressFormatter.CITY in grouped_osm_components or set(grouped_osm_components) & set(city_replacements)
@@ -1823,7 +1841,7 @@ class AddressComponents(object):
                  population_from_city=False, check_city_wikipedia=False,
                  add_sub_building_components=True, hyphenation=True,
                  num_floors=None, num_basements=None, zone=None,
-                 osm_components=None, neighborhoods=None):
+                 osm_components=None, neighborhoods=None, context=None):
         '''
         Expanded components
         -------------------
@@ -1835,16 +1853,23 @@ class AddressComponents(object):
         Namely, it calls all the methods above to reverse geocode to a few of the
         R-tree + point-in-polygon indices passed in at initialization and adds things
         like admin boundaries, neighborhoods,
+
+        If a ReverseGeocodeContext for the coordinate is given, the layers are
+        taken from it so they aren't looked up again.
         '''
         try:
             latitude, longitude = latlon_to_decimal(latitude, longitude)
         except Exception:
             return None, None, None
 
-        if osm_components is None:
-            osm_components = self.osm_reverse_geocoded_components(latitude, longitude)
+        if osm_components is None and context is not None:
+            osm_components = context.osm_components
+            country, candidate_languages = context.osm_country_and_languages()
+        else:
+            if osm_components is None:
+                osm_components = self.osm_reverse_geocoded_components(latitude, longitude)
+            country, candidate_languages = self.osm_country_and_languages(osm_components)
 
-        country, candidate_languages = self.osm_country_and_languages(osm_components)
         if not (country and candidate_languages):
             return None, None, None
 
@@ -1853,7 +1878,9 @@ class AddressComponents(object):
         non_local_language = None
         language_suffix = ''
 
-        if neighborhoods is None:
+        if neighborhoods is None and context is not None:
+            neighborhoods = context.neighborhoods
+        elif neighborhoods is None:
             neighborhoods = self.neighborhood_components(latitude, longitude)
 
         all_osm_components = osm_components + neighborhoods
@@ -1886,7 +1913,8 @@ class AddressComponents(object):
                                   latitude, longitude,
                                   non_local_language=non_local_language,
                                   normalize_languages=all_languages,
-                                  language_suffix=language_suffix)
+                                  language_suffix=language_suffix,
+                                  context=context)
 
         self.add_neighborhoods(address_components, neighborhoods, country, language, non_local_language=non_local_language,
                                language_suffix=language_suffix)
@@ -0,0 +1,105 @@
+'''
+geodata.addresses.reverse_geocode_context
+-----------------------------------------
+
+Building one training example for an OSM element reverse geocodes its
+coordinate against several indices: OSM admin boundaries (and the
+country derived from them), neighborhoods, nearby places, subdivisions,
+buildings and the nearest metro station. These used to be looked up
+independently by each stage of OSMAddressFormatter and AddressComponents,
+with some layers queried more than once for the same point.
+
+A ReverseGeocodeContext is created once per record and passed through the
+stages instead. Each layer is resolved the first time it's asked for and
+memoized on the context, and resolve() fills in every available layer in
+one call.
+'''
+
+from geodata.polygons.reverse_geocode import OSMCountryReverseGeocoder
+
+
+class ReverseGeocodeContext(object):
+    LAYERS = ('osm_components', 'neighborhoods', 'nearby_places',
+              'subdivisions', 'buildings', 'nearest_metro_station')
+
+    def __init__(self, latitude, longitude,
+                 osm_admin_rtree=None,
+                 neighborhoods_rtree=None,
+                 places_index=None,
+                 country_rtree=None,
+                 subdivisions_rtree=None,
+                 buildings_rtree=None,
+                 metro_stations_index=None):
+        self.latitude = latitude
+        self.longitude = longitude
+
+        self.osm_admin_rtree = osm_admin_rtree
+        self.neighborhoods_rtree = neighborhoods_rtree
+        self.places_index = places_index
+        self.country_rtree = country_rtree
+        self.subdivisions_rtree = subdivisions_rtree
+        self.buildings_rtree = buildings_rtree
+        self.metro_stations_index = metro_stations_index
+
+        self.cache = {}
+
+    def memoized(self, name, index, lookup):
+        try:
+            return self.cache[name]
+        except KeyError:
+            value = self.cache[name] = lookup(index) if index is not None else None
+            return value
+
+    def polygons(self, name, index):
+        return self.memoized(name, index, lambda idx: idx.point_in_poly(self.latitude, self.longitude, return_all=True)) or []
+
+    @property
+    def osm_components(self):
+        return self.polygons('osm_components', self.osm_admin_rtree)
+
+    @property
+    def neighborhoods(self):
+        return self.polygons('neighborhoods', self.neighborhoods_rtree)
+
+    @property
+    def subdivisions(self):
+        return self.polygons('subdivisions', self.subdivisions_rtree)
+
+    @property
+    def buildings(self):
+        return self.polygons('buildings', self.buildings_rtree)
+
+    @property
+    def nearby_places(self):
+        return self.memoized('nearby_places', self.places_index,
+                             lambda idx: idx.nearest_points(self.latitude, self.longitude)) or []
+
+    @property
+    def nearest_metro_station(self):
+        return self.memoized('nearest_metro_station', self.metro_stations_index,
+                             lambda idx: idx.nearest_point(self.latitude, self.longitude))
+
+    def osm_country_and_languages(self):
+        '''
+        Country and candidate languages from the OSM admin boundaries
+        '''
+        try:
+            return self.cache['osm_country_and_languages']
+        except KeyError:
+            value = self.cache['osm_country_and_languages'] = OSMCountryReverseGeocoder.country_and_languages_from_components(self.osm_components)
+            return value
+
+    def country_and_languages(self):
+        '''
+        Country and candidate languages from the country index if there is
+        one, otherwise from the OSM admin boundaries
+        '''
+        if self.country_rtree is None:
+            return self.osm_country_and_languages()
+        return self.memoized('country_and_languages', self.country_rtree,
+                             lambda idx: idx.country_and_languages(self.latitude, self.longitude))
+
+    def resolve(self):
+        for name in self.LAYERS:
+            getattr(self, name)
+        return self
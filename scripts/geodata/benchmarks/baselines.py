@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+'''
+baselines.py
+------------
+
+Comparison-only copies of implementations which have since been replaced.
+Nothing in geodata uses these. They're kept so the benchmark harness can
+report the old and new implementations side by side, and so the tests can
+check that the replacements give the same output.
+'''
+
+import pystache
+
+from collections import defaultdict, deque, OrderedDict
+from itertools import combinations, ifilter
+
+from geodata.graph.scc import strongly_connected_components
+
+SENTINEL = None
+
+
+def scc_create_polygons(reader, ways):
+    '''
+    OSMPolygonReader.create_polygons before endpoint chaining (geodata.osm.rings):
+    builds a graph of every pair of ways sharing an end node, finds its strongly
+    connected components and walks each one copying and reversing coordinates
+    '''
+    end_nodes = defaultdict(list)
+    polys = []
+
+    way_indices = {}
+    start_end_nodes = {}
+
+    for way_id in ways:
+        try:
+            way_index = reader.binary_search(reader.way_ids, way_id)
+        except ValueError:
+            continue
+
+        way_indices[way_id] = way_index
+
+        start_node_id = reader.way_deps[reader.way_indptr[way_index]]
+        end_node_id = reader.way_deps[reader.way_indptr[way_index + 1] - 1]
+
+        start_end_nodes[way_id] = (start_node_id, end_node_id)
+
+        if start_node_id == end_node_id:
+            way_node_points = reader.way_node_coordinates(way_index)
+            polys.append(way_node_points)
+            continue
+
+        end_nodes[start_node_id].append(way_id)
+        end_nodes[end_node_id].append(way_id)
+
+    way_graph = defaultdict(OrderedDict)
+
+    for node_id, ways in end_nodes.iteritems():
+        for w1, w2 in combinations(ways, 2):
+            way_graph[w1][w2] = None
+            way_graph[w2][w1] = None
+
+    way_graph = {v: w.keys() for v, w in way_graph.iteritems()}
+
+    for component in strongly_connected_components(way_graph):
+        poly_nodes = []
+
+        seen = set()
+
+        if not component:
+            continue
+
+        q = [(c, False) for c in component[:1]]
+        while q:
+            way_id, reverse = q.pop()
+            way_index = way_indices[way_id]
+
+            node_coords = reader.way_node_coordinates(way_index)
+
+            head, tail = start_end_nodes[way_id]
+
+            if reverse:
+                node_coords = node_coords[::-1]
+                head, tail = tail, head
+
+            for neighbor in way_graph[way_id]:
+                if neighbor in seen:
+                    continue
+                neighbor_head, neighbor_tail = start_end_nodes[neighbor]
+                neighbor_reverse = neighbor_head == head or neighbor_tail == tail
+                q.append((neighbor, neighbor_reverse))
+
+            way_start = 0 if q else 1
+            poly_nodes.extend(node_coords[way_start:-1])
+
+            seen.add(way_id)
+
+        polys.append(poly_nodes)
+
+    return polys
+
+
+def backtracking_filter(phrase_filter, tokens):
+    '''
+    PhraseFilter.filter before it was changed to a single forward pass:
+    re-joins the entity tokens on every step and backtracks through a deque
+    on failed matches
+    '''
+    def return_item(item):
+        return False, item, []
+
+    if not tokens:
+        return
+
+    ent = []
+    ent_tokens = []
+
+    queue = deque(tokens + [(SENTINEL,) * 2])
+
+    trie = phrase_filter.trie
+
+    while queue:
+        item = queue.popleft()
+        t, c = item
+
+        if t is not SENTINEL and trie.has_keys_with_prefix(u' '.join(ent_tokens + [t])):
+            ent.append(item)
+            ent_tokens.append(item[0])
+        elif ent_tokens:
+            res = trie.get(u' '.join(ent_tokens)) or None
+            if res is not None:
+                yield (True, ent, map(phrase_filter.deserialize, res))
+                queue.appendleft(item)
+                ent = []
+                ent_tokens = []
+            elif len(ent_tokens) == 1:
+                yield return_item(ent[0])
+                ent = []
+                ent_tokens = []
+                queue.appendleft(item)
+            else:
+                have_phrase = False
+
+                for i in xrange(len(ent) - 1, 0, -1):
+                    remainder = ent[i:]
+                    res = trie.get(u' '.join([e[0] for e in ent[:i]])) or None
+                    if res is not None:
+                        yield (True, ent[:i], map(phrase_filter.deserialize, res))
+                        have_phrase = True
+                        break
+
+                if not have_phrase:
+                    yield return_item(ent[0])
+
+                todos = list(remainder)
+                todos.append(item)
+                queue.extendleft(reversed(todos))
+
+                ent = []
+                ent_tokens = []
+        elif t is not SENTINEL:
+            yield return_item(item)
+
+
+def pystache_render(template, components):
+    '''
+    AddressFormatter.render_template before templates were compiled: renders
+    with pystache on every call, with a "first" lambda
+    '''
+    def render_first(text):
+        text = pystache.render(text, **components)
+        splits = (e.strip() for e in text.split('||'))
+        selected = next(ifilter(bool, splits), '')
+        return selected
+
+    return pystache.render(template, first=render_first, **components)
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+'''
+fixtures.py
+-----------
+
+Small synthetic, reproducible fixtures for the benchmark harness, generated
+offline from a seed:
+
+polygons.geojson:      OSM-style admin boundaries, one country split into a
+                       grid of states, each split into a grid of cities, with
+                       jittered edges so contains tests do some work
+neighborhoods.geojson: small neighborhood polygons inside the cities
+places.geojson:        place nodes (city, town, village, suburb) as Points
+addresses.osm:         OSM XML with addr:* tagged nodes and a few ways
+addresses.csv:         OpenAddresses-style CSV
+
+relation_ways builds a large synthetic boundary relation in memory for the
+ring assembly benchmark, it isn't written to the fixtures directory.
+
+All coordinates fall inside a bounding box in the US, so country and
+language lookups from the real config work on the synthetic data.
+
+Usage:
+
+python fixtures.py -o $(FIXTURES_DIR) [--seed 0]
+'''
+
+import argparse
+import csv
+import hashlib
+import math
+import os
+import random
+import six
+import sys
+import ujson as json
+
+from lxml import etree
+
+this_dir = os.path.realpath(os.path.dirname(__file__))
+sys.path.append(os.path.realpath(os.path.join(os.pardir, os.pardir)))
+
+from geodata.encoding import safe_encode
+from geodata.file_utils import ensure_dir
+
+POLYGONS_FILENAME = 'polygons.geojson'
+NEIGHBORHOODS_FILENAME = 'neighborhoods.geojson'
+PLACES_FILENAME = 'places.geojson'
+OSM_FILENAME = 'addresses.osm'
+OPENADDRESSES_FILENAME = 'addresses.csv'
+
+FIXTURE_FILENAMES = (POLYGONS_FILENAME, NEIGHBORHOODS_FILENAME, PLACES_FILENAME,
+                     OSM_FILENAME, OPENADDRESSES_FILENAME)
+
+OPENADDRESSES_FIELDS = ('LON', 'LAT', 'NUMBER', 'STREET', 'UNIT', 'CITY',
+                        'DISTRICT', 'REGION', 'POSTCODE', 'ID', 'HASH')
+
+# min_lon, min_lat, max_lon, max_lat
+BOUNDS = (-100.0, 37.0, -94.0, 41.0)
+
+COUNTRY_CODE = 'US'
+
+STATES_PER_SIDE = 3
+CITIES_PER_SIDE = 4
+NEIGHBORHOODS_PER_CITY = 3
+POINTS_PER_EDGE = 12
+
+NAME_PREFIXES = [u'Oak', u'Maple', u'Cedar', u'Pine', u'Elm', u'Willow', u'Lake', u'River',
+                 u'Hill', u'Spring', u'Fair', u'Green', u'Rock', u'Clear', u'Red', u'Stone']
+NAME_SUFFIXES = [u'field', u'ville', u'wood', u'ton', u'dale', u'view', u'ford', u'port',
+                 u'brook', u'haven', u'ridge', u'mont']
+
+STREET_NAMES = [u'Main', u'Washington', u'Lincoln', u'Park', u'Jefferson', u'Highland',
+                u'Martin Luther King Jr', u'Saint Clair', u'1st', u'2nd', u'3rd', u'14th']
+STREET_TYPES = [u'Street', u'St', u'Avenue', u'Ave', u'Boulevard', u'Blvd', u'Road', u'Rd',
+                u'Drive', u'Dr', u'Lane', u'Court']
+DIRECTIONALS = [u'', u'', u'', u'N', u'S', u'East', u'West', u'NW']
+
+PLACE_TYPES = [('city', 0.1), ('town', 0.2), ('village', 0.4), ('suburb', 0.3)]
+
+RELATION_WAYS = 2000
+RELATION_NODES_PER_WAY = 20
+RELATION_ISLANDS = 10
+RELATION_ISLAND_WAYS = 4
+
+
+def place_name(rand):
+    return rand.choice(NAME_PREFIXES) + rand.choice(NAME_SUFFIXES)
+
+
+def street_name(rand):
+    directional = rand.choice(DIRECTIONALS)
+    name = u'{} {}'.format(rand.choice(STREET_NAMES), rand.choice(STREET_TYPES))
+    return u'{} {}'.format(directional, name) if directional else name
+
+
+def random_point(rand, bounds):
+    min_lon, min_lat, max_lon, max_lat = bounds
+    return rand.uniform(min_lat, max_lat), rand.uniform(min_lon, max_lon)
+
+
+def grid_cells(bounds, n):
+    min_lon, min_lat, max_lon, max_lat = bounds
+    width = (max_lon - min_lon) / n
+    height = (max_lat - min_lat) / n
+    for i in xrange(n):
+        for j in xrange(n):
+            yield i, j, (min_lon + i * width, min_lat + j * height,
+                         min_lon + (i + 1) * width, min_lat + (j + 1) * height)
+
+
+def jittered_ring(rand, bounds, points_per_edge, jitter=0.1):
+    '''
+    Closed ring around bounds with points_per_edge vertices per side, each
+    interior vertex moved inward by up to jitter * the side length, tapering
+    off towards the corners so the ring doesn't self-intersect
+    '''
+    min_lon, min_lat, max_lon, max_lat = bounds
+    dx = (max_lon - min_lon) * jitter
+    dy = (max_lat - min_lat) * jitter
+
+    corners = [(min_lon, min_lat), (max_lon, min_lat), (max_lon, max_lat), (min_lon, max_lat)]
+    inward = [(0.0, dy), (-dx, 0.0), (0.0, -dy), (dx, 0.0)]
+
+    ring = []
+    for side in xrange(4):
+        (x0, y0), (x1, y1) = corners[side], corners[(side + 1) % 4]
+        ix, iy = inward[side]
+        ring.append([x0, y0])
+        for k in xrange(1, points_per_edge):
+            t = float(k) / points_per_edge
+            r = rand.random() * 2.0 * min(t, 1.0 - t)
+            ring.append([x0 + (x1 - x0) * t + ix * r, y0 + (y1 - y0) * t + iy * r])
+    ring.append(list(ring[0]))
+    return ring
+
+
+def polygon_feature(ring, properties):
+    return {'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+            'properties': properties}
+
+
+def point_feature(lat, lon, properties):
+    return {'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': properties}
+
+
+def feature_collection(features):
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def admin_polygons(rand):
+    features = []
+    relation_id = 1
+
+    features.append(polygon_feature(jittered_ring(rand, BOUNDS, POINTS_PER_EDGE, jitter=0.0), {
+        'type': 'relation', 'id': str(relation_id), 'boundary': 'administrative', 'admin_level': '2',
+        'name': u'United States', 'name:en': u'United States', 'ISO3166-1:alpha2': COUNTRY_CODE,
+    }))
+
+    cities = []
+    for i, j, state_bounds in grid_cells(BOUNDS, STATES_PER_SIDE):
+        relation_id += 1
+        state_code = 'X{}'.format(chr(ord('A') + i * STATES_PER_SIDE + j))
+        features.append(polygon_feature(jittered_ring(rand, state_bounds, POINTS_PER_EDGE, jitter=0.02), {
+            'type': 'relation', 'id': str(relation_id), 'boundary': 'administrative', 'admin_level': '4',
+            'name': u'{} State'.format(place_name(rand)), 'ISO3166-2': 'US-{}'.format(state_code),
+        }))
+
+        for _, _, city_bounds in grid_cells(state_bounds, CITIES_PER_SIDE):
+            relation_id += 1
+            name = place_name(rand)
+            features.append(polygon_feature(jittered_ring(rand, city_bounds, POINTS_PER_EDGE), {
+                'type': 'relation', 'id': str(relation_id), 'boundary': 'administrative', 'admin_level': '8',
+                'name': name,
+            }))
+            cities.append((name, state_code, city_bounds))
+
+    return features, cities
+
+
+def neighborhood_polygons(rand, cities):
+    features = []
+    way_id = 0
+    for name, state_code, (min_lon, min_lat, max_lon, max_lat) in cities:
+        width = (max_lon - min_lon) / 4.0
+        height = (max_lat - min_lat) / 4.0
+        for k in xrange(NEIGHBORHOODS_PER_CITY):
+            lon = rand.uniform(min_lon, max_lon - width)
+            lat = rand.uniform(min_lat, max_lat - height)
+            way_id += 1
+            features.append(polygon_feature(jittered_ring(rand, (lon, lat, lon + width, lat + height), POINTS_PER_EDGE // 2), {
+                'type': 'way', 'id': str(way_id), 'place': 'neighbourhood', 'name': u'{} Heights'.format(place_name(rand)),
+            }))
+    return features
+
+
+def place_points(rand, num_places):
+    features = []
+    for node_id in xrange(1, num_places + 1):
+        lat, lon = random_point(rand, BOUNDS)
+        r = rand.random()
+        for place, p in PLACE_TYPES:
+            r -= p
+            if r <= 0.0:
+                break
+        features.append(point_feature(lat, lon, {'type': 'node', 'id': str(node_id), 'place': place,
+                                                  'name': place_name(rand)}))
+    return features
+
+
+def random_addresses(rand, cities, num_addresses):
+    addresses = []
+    for k in xrange(num_addresses):
+        city, state_code, city_bounds = rand.choice(cities)
+        lat, lon = random_point(rand, city_bounds)
+        addresses.append({
+            'lat': lat,
+            'lon': lon,
+            'house_number': str(rand.randint(1, 9999)),
+            'street': street_name(rand),
+            'unit': u'Apt {}'.format(rand.randint(1, 40)) if rand.random() < 0.2 else u'',
+            'city': city,
+            'state': state_code,
+            'postcode': '{:05d}'.format(rand.randint(66000, 67999)),
+        })
+    return addresses
+
+
+def relation_ways(rand, num_ways=RELATION_WAYS, nodes_per_way=RELATION_NODES_PER_WAY,
+                  num_islands=RELATION_ISLANDS, island_ways=RELATION_ISLAND_WAYS):
+    '''
+    Member ways of a relation with one large ring (think coastline or country
+    border) and a number of small islands, as lists of (node_id, lon, lat).
+    Half of the ways run against the ring direction.
+    '''
+    rings = [(num_ways, 0.0, 0.0, 10.0)]
+    rings.extend([(island_ways, rand.uniform(-20, 20), rand.uniform(-20, 20), 0.1)
+                  for i in xrange(num_islands)])
+
+    ways = []
+    node_id = 1
+    for ring_ways, center_x, center_y, radius in rings:
+        n = ring_ways * (nodes_per_way - 1)
+        first_node_id = node_id
+        for w in xrange(ring_ways):
+            way_nodes = []
+            for j in xrange(nodes_per_way):
+                k = w * (nodes_per_way - 1) + j
+                theta = 2.0 * math.pi * k / n
+                way_nodes.append((first_node_id + k % n,
+                                  center_x + radius * math.cos(theta),
+                                  center_y + radius * math.sin(theta)))
+            if rand.random() < 0.5:
+                way_nodes.reverse()
+            ways.append(way_nodes)
+        node_id += n
+
+    return ways
+
+
+def write_osm(addresses, filename, rand):
+    root = etree.Element('osm', version='0.6', generator='geodata.benchmarks.fixtures')
+    for node_id, address in enumerate(addresses, 1):
+        node = etree.SubElement(root, 'node', id=str(node_id),
+                                lat='{:.7f}'.format(address['lat']), lon='{:.7f}'.format(address['lon']))
+        for k, v in (('addr:housenumber', address['house_number']),
+                     ('addr:street', address['street']),
+                     ('addr:city', address['city']),
+                     ('addr:postcode', address['postcode']),
+                     ('addr:unit', address['unit'])):
+            if v:
+                etree.SubElement(node, 'tag', k=k, v=v)
+
+    # A few buildings with addresses as ways over the address nodes
+    num_nodes = len(addresses)
+    for way_id in xrange(1, num_nodes // 10 + 1):
+        way = etree.SubElement(root, 'way', id=str(way_id))
+        start = rand.randint(1, max(num_nodes - 4, 1))
+        refs = range(start, min(start + 4, num_nodes + 1))
+        for ref in refs + refs[:1]:
+            etree.SubElement(way, 'nd', ref=str(ref))
+        address = addresses[start - 1]
+        etree.SubElement(way, 'tag', k='building', v='yes')
+        etree.SubElement(way, 'tag', k='addr:housenumber', v=address['house_number'])
+        etree.SubElement(way, 'tag', k='addr:street', v=address['street'])
+
+    etree.ElementTree(root).write(filename, encoding='utf-8', xml_declaration=True, pretty_print=True)
+
+
+def write_openaddresses(addresses, filename):
+    f = open(filename, 'w')
+    writer = csv.writer(f)
+    writer.writerow(OPENADDRESSES_FIELDS)
+    for i, address in enumerate(addresses):
+        writer.writerow([safe_encode(v) for v in (
+            '{:.7f}'.format(address['lon']), '{:.7f}'.format(address['lat']), address['house_number'],
+            address['street'], address['unit'], address['city'], u'', address['state'],
+            address['postcode'], str(i), hashlib.md5('{:.7f},{:.7f}'.format(address['lat'], address['lon'])).hexdigest()[:16],
+        )])
+    f.close()
+
+
+def write_json(value, filename):
+    f = open(filename, 'w')
+    json.dump(value, f)
+    f.close()
+
+
+def fixtures_exist(out_dir):
+    return all((os.path.exists(os.path.join(out_dir, filename)) for filename in FIXTURE_FILENAMES))
+
+
+def generate_fixtures(out_dir, seed=0, num_places=2000, num_addresses=2000):
+    ensure_dir(out_dir)
+    rand = random.Random(seed)
+
+    polygons, cities = admin_polygons(rand)
+    write_json(feature_collection(polygons), os.path.join(out_dir, POLYGONS_FILENAME))
+    write_json(feature_collection(neighborhood_polygons(rand, cities)), os.path.join(out_dir, NEIGHBORHOODS_FILENAME))
+    write_json(feature_collection(place_points(rand, num_places)), os.path.join(out_dir, PLACES_FILENAME))
+
+    addresses = random_addresses(rand, cities, num_addresses)
+    write_osm(addresses, os.path.join(out_dir, OSM_FILENAME), rand)
+    write_openaddresses(addresses, os.path.join(out_dir, OPENADDRESSES_FILENAME))
+
+
+def read_openaddresses(filename):
+    '''
+    List of (lat, lon, components) from an OpenAddresses-style CSV
+    '''
+    field_components = {'NUMBER': 'house_number', 'STREET': 'road', 'UNIT': 'unit', 'CITY': 'city',
+                        'DISTRICT': 'state_district', 'REGION': 'state', 'POSTCODE': 'postcode'}
+    reader = csv.DictReader(open(filename))
+    rows = []
+    for row in reader:
+        components = {field_components[k]: v.decode('utf-8') for k, v in six.iteritems(row)
+                      if k in field_components and v}
+        rows.append((float(row['LAT']), float(row['LON']), components))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-o', '--out-dir',
+                        required=True,
+                        help='Directory to write the fixtures to')
+
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed')
+
+    parser.add_argument('--num-places',
+                        type=int,
+                        default=2000,
+                        help='Number of place points')
+
+    parser.add_argument('--num-addresses',
+                        type=int,
+                        default=2000,
+                        help='Number of addresses in the OSM and OpenAddresses samples')
+
+    args = parser.parse_args()
+
+    generate_fixtures(args.out_dir, seed=args.seed, num_places=args.num_places, num_addresses=args.num_addresses)
@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+'''
+harness.py
+----------
+
+Benchmark harness for the geodata hot paths, run against the synthetic
+fixtures from fixtures.py (generated into --fixtures-dir if missing):
+
+point_in_poly:      admin polygon index built from polygons.geojson
+nearest_points:     place index built from places.geojson
+phrase_filter:      DictionaryPhraseFilter.filter (street types gazetteer) on street names
+phrase_match:       the PhraseFilter.filter matching step alone on the same names
+format_address:     AddressFormatter.format_address on OpenAddresses rows
+expanded:           AddressComponents.expanded on OpenAddresses rows
+parse_osm:          iterating over the OSM XML sample
+normalized_tokens:  normalized_tokens on full address strings
+render_template:    compiled address templates on OpenAddresses rows
+ring_assembly:      OSMPolygonReader.create_polygons on a large synthetic
+                    relation, per member way
+
+Benchmarks ending in _baseline time the implementation the one before it
+replaced (see baselines.py), so the speedup is in the same report.
+
+Each benchmark is run once to warm up and then --repeats times. The best
+time per operation is written to a JSON report along with the commit, so
+reports from different commits can be compared with --compare, which flags
+benchmarks that got slower by more than --threshold.
+
+Usage:
+
+python harness.py --fixtures-dir $(FIXTURES_DIR) -o report.json
+python harness.py --fixtures-dir $(FIXTURES_DIR) -o new.json --compare old.json
+'''
+
+import argparse
+import gc
+import os
+import platform
+import random
+import shutil
+import six
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import ujson as json
+
+from collections import OrderedDict
+
+this_dir = os.path.realpath(os.path.dirname(__file__))
+sys.path.append(os.path.realpath(os.path.join(os.pardir, os.pardir)))
+
+from geodata.benchmarks.fixtures import *
+from geodata.file_utils import ensure_dir
+
+REPORT_VERSION = 1
+
+
+class BenchmarkFixtures(object):
+    '''
+    Fixture data and indices built from it, each created the first time
+    a benchmark needs it
+    '''
+    def __init__(self, fixtures_dir, work_dir, scratch_dir=None, seed=0):
+        self.fixtures_dir = fixtures_dir
+        self.work_dir = work_dir
+        self.scratch_dir = scratch_dir
+        self.seed = seed
+        self.cache = {}
+
+    def memoized(self, name, func):
+        try:
+            return self.cache[name]
+        except KeyError:
+            value = self.cache[name] = func()
+            return value
+
+    def path(self, filename):
+        return os.path.join(self.fixtures_dir, filename)
+
+    def polygon_index(self, filename):
+        from geodata.polygons.index import RTreePolygonIndex
+
+        d = os.path.join(self.work_dir, os.path.splitext(filename)[0])
+        ensure_dir(d)
+        index = RTreePolygonIndex.create_from_geojson_files([self.path(filename)], d)
+        index.save()
+        # Release the builder's LevelDB lock before loading from the same dir
+        del index
+        gc.collect()
+        return RTreePolygonIndex.load(d)
+
+    def build_place_index(self):
+        from geodata.places.reverse_geocode import PlaceReverseGeocoder
+
+        d = os.path.join(self.work_dir, 'places')
+        ensure_dir(d)
+        index = PlaceReverseGeocoder(save_dir=d)
+        for feature in json.load(open(self.path(PLACES_FILENAME)))['features']:
+            lon, lat = feature['geometry']['coordinates']
+            index.add_point(lat, lon, feature['properties'])
+        index.save()
+        # Release the builder's LevelDB lock before loading from the same dir
+        del index
+        gc.collect()
+        return PlaceReverseGeocoder.load(d)
+
+    @property
+    def admin_index(self):
+        return self.memoized('admin_index', lambda: self.polygon_index(POLYGONS_FILENAME))
+
+    @property
+    def neighborhoods_index(self):
+        return self.memoized('neighborhoods_index', lambda: self.polygon_index(NEIGHBORHOODS_FILENAME))
+
+    @property
+    def places_index(self):
+        return self.memoized('places_index', self.build_place_index)
+
+    @property
+    def addresses(self):
+        return self.memoized('addresses', lambda: read_openaddresses(self.path(OPENADDRESSES_FILENAME)))
+
+    @property
+    def address_formatter(self):
+        from geodata.address_formatting.formatter import AddressFormatter
+        return self.memoized('address_formatter', lambda: AddressFormatter(scratch_dir=self.scratch_dir))
+
+    @property
+    def street_name_tokens(self):
+        from geodata.text.normalize import normalized_tokens, NORMALIZE_STRING_LOWERCASE, TOKEN_OPTIONS_DROP_PERIODS
+        return self.memoized('street_name_tokens', lambda: [
+            normalized_tokens(components['road'], string_options=NORMALIZE_STRING_LOWERCASE,
+                              token_options=TOKEN_OPTIONS_DROP_PERIODS)
+            for lat, lon, components in self.addresses if components.get('road')
+        ])
+
+    def build_template_inputs(self):
+        '''
+        (tagged template text, tagged components) as format_address renders
+        them, for each address
+        '''
+        formatter = self.address_formatter
+        country = COUNTRY_CODE.lower()
+        random.seed(self.seed)
+        inputs = []
+        for lat, lon, components in self.addresses:
+            template = formatter.get_template(country, language='en')
+            template_text = formatter.revised_template(template['address_template'], components, country, language='en')
+            template_text = formatter.tag_template_separators(template_text)
+            inputs.append((template_text, {k: formatter.tagged_tokens(v, k) for k, v in six.iteritems(components)}))
+        return inputs
+
+    @property
+    def template_inputs(self):
+        return self.memoized('template_inputs', self.build_template_inputs)
+
+    def build_relation(self):
+        '''
+        OSMPolygonReader holding the ways of a synthetic relation and the
+        member way ids in (shuffled) relation order
+        '''
+        from geodata.osm.admin_boundaries import OSMPolygonReader
+
+        rand = random.Random(self.seed)
+        reader = OSMPolygonReader(None)
+        # way_ids need to be sorted for binary search
+        for way_id, way_nodes in enumerate(relation_ways(rand), 1):
+            reader.way_ids.append(way_id)
+            for node_id, lon, lat in way_nodes:
+                reader.way_deps.append(node_id)
+                reader.way_coords.extend((lon, lat))
+            reader.way_indptr.append(len(reader.way_deps))
+
+        member_ways = list(reader.way_ids)
+        rand.shuffle(member_ways)
+        return reader, member_ways
+
+    @property
+    def relation(self):
+        return self.memoized('relation', self.build_relation)
+
+    @property
+    def address_components(self):
+        from geodata.addresses.components import AddressComponents
+        return self.memoized('address_components', lambda: AddressComponents(self.admin_index,
+                                                                             self.neighborhoods_index,
+                                                                             self.places_index))
+
+
+# Each setup function takes a BenchmarkFixtures and returns (run, ops),
+# where run is a function of no arguments doing ops operations
+
+def setup_point_in_poly(fixtures):
+    index = fixtures.admin_index
+    points = [(lat, lon) for lat, lon, components in fixtures.addresses]
+
+    def run():
+        for lat, lon in points:
+            index.point_in_poly(lat, lon, return_all=True)
+    return run, len(points)
+
+
+def setup_nearest_points(fixtures):
+    index = fixtures.places_index
+    points = [(lat, lon) for lat, lon, components in fixtures.addresses]
+
+    def run():
+        for lat, lon in points:
+            index.nearest_points(lat, lon)
+    return run, len(points)
+
+
+def setup_phrase_filter(fixtures):
+    from geodata.address_expansions.gazetteers import street_types_gazetteer
+
+    all_tokens = fixtures.street_name_tokens
+
+    def run():
+        for tokens in all_tokens:
+            for item in street_types_gazetteer.filter(tokens):
+                pass
+    return run, len(all_tokens)
+
+
+def setup_phrase_match(fixtures):
+    from geodata.address_expansions.gazetteers import street_types_gazetteer
+
+    all_tokens = fixtures.street_name_tokens
+
+    def run():
+        for tokens in all_tokens:
+            for item in street_types_gazetteer.basic_filter(tokens):
+                pass
+    return run, len(all_tokens)
+
+
+def setup_phrase_match_baseline(fixtures):
+    from geodata.address_expansions.gazetteers import street_types_gazetteer
+    from geodata.benchmarks.baselines import backtracking_filter
+
+    all_tokens = fixtures.street_name_tokens
+
+    def run():
+        for tokens in all_tokens:
+            for item in backtracking_filter(street_types_gazetteer, tokens):
+                pass
+    return run, len(all_tokens)
+
+
+def setup_format_address(fixtures):
+    formatter = fixtures.address_formatter
+    addresses = [components for lat, lon, components in fixtures.addresses]
+
+    def run():
+        random.seed(fixtures.seed)
+        for components in addresses:
+            formatter.format_address(dict(components), COUNTRY_CODE.lower(), 'en', minimal_only=False)
+    return run, len(addresses)
+
+
+def setup_expanded(fixtures):
+    address_components = fixtures.address_components
+    addresses = fixtures.addresses
+
+    def run():
+        random.seed(fixtures.seed)
+        for lat, lon, components in addresses:
+            address_components.expanded(dict(components), lat, lon)
+    return run, len(addresses)
+
+
+def setup_parse_osm(fixtures):
+    from geodata.osm.extract import parse_osm
+
+    filename = fixtures.path(OSM_FILENAME)
+    num_elements = sum((1 for item in parse_osm(filename)))
+
+    def run():
+        for item in parse_osm(filename):
+            pass
+    return run, num_elements
+
+
+def setup_normalized_tokens(fixtures):
+    from geodata.text.normalize import normalized_tokens
+
+    strings = [u' '.join([components[k] for k in ('house_number', 'road', 'city', 'state', 'postcode') if k in components])
+               for lat, lon, components in fixtures.addresses]
+
+    def run():
+        for s in strings:
+            normalized_tokens(s)
+    return run, len(strings)
+
+
+def setup_render_template(fixtures):
+    formatter = fixtures.address_formatter
+    compiled = [(formatter.compile_template(template_text), components)
+                for template_text, components in fixtures.template_inputs]
+
+    def run():
+        for template, components in compiled:
+            template.render(components)
+    return run, len(compiled)
+
+
+def setup_render_template_baseline(fixtures):
+    from geodata.benchmarks.baselines import pystache_render
+
+    inputs = fixtures.template_inputs
+
+    def run():
+        for template_text, components in inputs:
+            pystache_render(template_text, components)
+    return run, len(inputs)
+
+
+def setup_ring_assembly(fixtures):
+    reader, ways = fixtures.relation
+
+    def run():
+        reader.create_polygons(ways)
+    return run, len(ways)
+
+
+def setup_ring_assembly_baseline(fixtures):
+    from geodata.benchmarks.baselines import scc_create_polygons
+
+    reader, ways = fixtures.relation
+
+    def run():
+        scc_create_polygons(reader, ways)
+    return run, len(ways)
+
+
+BENCHMARKS = OrderedDict([
+    ('point_in_poly', setup_point_in_poly),
+    ('nearest_points', setup_nearest_points),
+    ('phrase_filter', setup_phrase_filter),
+    ('phrase_match', setup_phrase_match),
+    ('phrase_match_baseline', setup_phrase_match_baseline),
+    ('format_address', setup_format_address),
+    ('expanded', setup_expanded),
+    ('parse_osm', setup_parse_osm),
+    ('normalized_tokens', setup_normalized_tokens),
+    ('render_template', setup_render_template),
+    ('render_template_baseline', setup_render_template_baseline),
+    ('ring_assembly', setup_ring_assembly),
+    ('ring_assembly_baseline', setup_ring_assembly_baseline),
+])
+
+
+def time_benchmark(run, ops, repeats=5):
+    run()
+    times = []
+    for i in xrange(repeats):
+        start = time.time()
+        run()
+        times.append(time.time() - start)
+    best = min(times)
+    return {
+        'ops': ops,
+        'repeats': repeats,
+        'best_s': best,
+        'mean_s': sum(times) / len(times),
+        'us_per_op': best * 1e6 / ops if ops else 0.0,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=this_dir,
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(fixtures, names=None, repeats=5):
+    results = OrderedDict()
+    for name, setup in six.iteritems(BENCHMARKS):
+        if names and name not in names:
+            continue
+        try:
+            run, ops = setup(fixtures)
+            result = time_benchmark(run, ops, repeats=repeats)
+            print('{}: {:.1f} us/op ({} ops, best of {})'.format(name, result['us_per_op'], ops, repeats))
+        except Exception:
+            # Keep going so one missing dependency (e.g. address formatting
+            # config) doesn't lose the rest of the report
+            result = {'error': traceback.format_exc()}
+            print('{}: error\n{}'.format(name, result['error']))
+        results[name] = result
+
+    return {
+        'version': REPORT_VERSION,
+        'commit': current_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': fixtures.seed,
+        'benchmarks': results,
+    }
+
+
+def compare_reports(old, new, threshold=0.1, names=None):
+    '''
+    Print the change in time per operation for each benchmark in both
+    reports, returns the names of those which are slower by more than
+    threshold (as a fraction). Benchmarks which ran in the old report but
+    errored or are missing in the new one also count as regressions, names
+    restricts the comparison to the benchmarks which were run.
+    '''
+    regressions = []
+    print('comparing {} -> {}'.format(old.get('commit'), new.get('commit')))
+    for name, old_result in six.iteritems(old['benchmarks']):
+        if (names and name not in names) or 'us_per_op' not in old_result:
+            continue
+        result = new['benchmarks'].get(name)
+        if result is None or 'us_per_op' not in result:
+            regressions.append(name)
+            print('{}: {:.1f} us/op -> {} REGRESSION'.format(name, old_result['us_per_op'],
+                                                             'error' if result is not None else 'missing'))
+            continue
+        old_time, new_time = old_result['us_per_op'], result['us_per_op']
+        if not old_time:
+            continue
+        change = (new_time - old_time) / old_time
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print('{}: {:.1f} -> {:.1f} us/op ({:+.1%}){}'.format(name, old_time, new_time, change,
+                                                              ' REGRESSION' if regressed else ''))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('benchmarks', nargs='*',
+                        help='Benchmarks to run (default all): {}'.format(', '.join(BENCHMARKS)))
+
+    parser.add_argument('--fixtures-dir',
+                        required=True,
+                        help='Fixtures directory, generated with fixtures.py if missing')
+
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed for generating fixtures and for the benchmarks')
+
+    parser.add_argument('-r', '--repeats',
+                        type=int,
+                        default=5,
+                        help='Timed runs per benchmark, the best is reported')
+
+    parser.add_argument('--scratch-dir',
+                        default='/tmp',
+                        help='Directory for the address-formatting repo')
+
+    parser.add_argument('-o', '--output',
+                        help='Path of the JSON report')
+
+    parser.add_argument('--compare',
+                        help='Previous JSON report to compare against')
+
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=0.1,
+                        help='Slowdown (as a fraction) reported as a regression by --compare')
+
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('Unknown benchmarks: {}'.format(', '.join(sorted(unknown))))
+
+    if not fixtures_exist(args.fixtures_dir):
+        print('generating fixtures in {}'.format(args.fixtures_dir))
+        generate_fixtures(args.fixtures_dir, seed=args.seed)
+
+    work_dir = tempfile.mkdtemp(prefix='geodata_benchmarks')
+    try:
+        fixtures = BenchmarkFixtures(args.fixtures_dir, work_dir, scratch_dir=args.scratch_dir, seed=args.seed)
+        report = run_benchmarks(fixtures, names=set(args.benchmarks), repeats=args.repeats)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        f = open(args.output, 'w')
+        json.dump(report, f, indent=2)
+        f.close()
+
+    if args.compare:
+        regressions = compare_reports(json.load(open(args.compare)), report, threshold=args.threshold,
+                                      names=set(args.benchmarks))
+        if regressions:
+            sys.exit(1)
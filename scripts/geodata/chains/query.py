@@ -8,7 +8,7 @@ from geodata.address_expansions.gazetteers import chains_gazetteer
 from geodata.categories.config import category_config
 from geodata.categories.preposition import CategoryPreposition
 from geodata.math.sampling import weighted_choice, cdf
-from geodata.text.normalize import normalized_tokens
+from geodata.text.normalize import normalized_tokens, normalized_tokens_many
 from geodata.text.tokenize import tokenize, token_types
 from geodata.encoding import safe_decode
 
@@ -25,6 +25,12 @@ class Chain(object):
         tokens = normalized_tokens(name)
         return tokens
 
+    @classmethod
+    def tokenize_names(cls, names):
+        '''Batch version of tokenize_name'''
+        tokens = iter(normalized_tokens_many([name for name in names if name]))
+        return [next(tokens) if name else [] for name in names]
+
     @classmethod
     def possible_chain(cls, name):
         '''
@@ -38,7 +44,15 @@ class Chain(object):
         decision making (i.e. if the tokens have a low IDF in the local area we might
         want to consider it a chain).
         '''
-        tokens = cls.tokenize_name(name)
+        return cls.possible_chain_tokens(cls.tokenize_name(name))
+
+    @classmethod
+    def possible_chains(cls, names):
+        '''Batch version of possible_chain'''
+        return [cls.possible_chain_tokens(tokens) for tokens in cls.tokenize_names(names)]
+
+    @classmethod
+    def possible_chain_tokens(cls, tokens):
         if not tokens:
             return False, [], []
         matches = chains_gazetteer.filter(tokens)
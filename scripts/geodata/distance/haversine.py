@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import math
+import numpy
 
 EARTH_RADIUS_KM = 6373
 
@@ -31,3 +32,19 @@ def haversine_distance(lat1, lon1, lat2, lon2, radius=EARTH_RADIUS_KM):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     d = radius * c
     return d
+
+
+def haversine_distances(lat1, lon1, lats2, lons2, radius=EARTH_RADIUS_KM):
+    """Vectorized haversine_distance, lat1/lon1 and lats2/lons2 can be
+    scalars or NumPy arrays and are broadcast against each other.
+    """
+    lat1 = numpy.radians(lat1)
+    lat2 = numpy.radians(lats2)
+    lon1 = numpy.radians(lon1)
+    lon2 = numpy.radians(lons2)
+
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = numpy.sin(dlat / 2.0) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin(dlon / 2.0) ** 2
+    c = 2 * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))
+    return radius * c
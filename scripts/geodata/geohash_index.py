@@ -0,0 +1,130 @@
+'''
+geodata.geohash_index
+---------------------
+
+Read-only binary format for geohash -> [ids] indices, used by PointIndex
+and GeohashPolygonIndex in place of a JSON dictionary. The index is stored
+in compressed sparse row (CSR) form:
+
+    keys.bin:    sorted geohash keys, fixed width and NUL-padded
+    offsets.bin: key i -> [offsets[i], offsets[i + 1]) in ids.bin
+    ids.bin:     uint32 ids, grouped by key
+
+plus a small meta.json recording the key width and counts. On load all
+three arrays are memory-mapped read-only and lookups are a binary search
+over the keys, so nothing is parsed or materialized up front and several
+worker processes using the same index share one copy via the page cache.
+'''
+
+import itertools
+import numpy
+import os
+import six
+import ujson as json
+
+from geodata.encoding import safe_encode
+from geodata.file_utils import ensure_dir
+
+
+def mmap_array(filename, dtype):
+    if os.path.getsize(filename) == 0:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.memmap(filename, dtype=dtype, mode='r')
+
+
+class GeohashIndex(object):
+    KEYS_FILENAME = 'keys.bin'
+    OFFSETS_FILENAME = 'offsets.bin'
+    IDS_FILENAME = 'ids.bin'
+    META_FILENAME = 'meta.json'
+
+    OFFSET_DTYPE = numpy.int64
+    ID_DTYPE = numpy.uint32
+
+    def __init__(self, keys, offsets, ids, key_length):
+        self.keys = keys
+        self.offsets = offsets
+        self.ids = ids
+        self.key_length = key_length
+
+    @classmethod
+    def key_dtype(cls, key_length):
+        return numpy.dtype('S{}'.format(max(key_length, 1)))
+
+    @classmethod
+    def from_dict(cls, index):
+        items = sorted((safe_encode(k), v) for k, v in six.iteritems(index))
+        keys = [k for k, v in items]
+        key_length = max([len(k) for k in keys] or [0])
+
+        offsets = numpy.zeros(len(keys) + 1, dtype=cls.OFFSET_DTYPE)
+        numpy.cumsum([len(v) for k, v in items], out=offsets[1:])
+
+        ids = numpy.fromiter(itertools.chain.from_iterable(v for k, v in items),
+                             dtype=cls.ID_DTYPE, count=int(offsets[-1]))
+
+        return cls(numpy.array(keys, dtype=cls.key_dtype(key_length)), offsets, ids, key_length)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def key_position(self, key):
+        key = safe_encode(key)
+        if len(key) > self.key_length:
+            return None
+        i = int(numpy.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return None
+
+    def __contains__(self, key):
+        return self.key_position(key) is not None
+
+    def get_array(self, key):
+        '''
+        ids for key as a (read-only) view into the id array, empty if missing
+        '''
+        i = self.key_position(key)
+        if i is None:
+            return self.ids[:0]
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def get(self, key, default=None):
+        i = self.key_position(key)
+        if i is None:
+            return default
+        return self.ids[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def save(self, d):
+        ensure_dir(d)
+        for filename, values in ((self.KEYS_FILENAME, self.keys),
+                                 (self.OFFSETS_FILENAME, self.offsets),
+                                 (self.IDS_FILENAME, self.ids)):
+            f = open(os.path.join(d, filename), 'wb')
+            numpy.asarray(values).tofile(f)
+            f.close()
+
+        f = open(os.path.join(d, self.META_FILENAME), 'w')
+        json.dump({'key_length': self.key_length,
+                   'num_keys': len(self.keys),
+                   'num_ids': len(self.ids)}, f)
+        f.close()
+
+    @classmethod
+    def exists(cls, d):
+        return os.path.exists(os.path.join(d, cls.META_FILENAME))
+
+    @classmethod
+    def load(cls, d):
+        meta = json.load(open(os.path.join(d, cls.META_FILENAME)))
+        key_length = int(meta['key_length'])
+        return cls(mmap_array(os.path.join(d, cls.KEYS_FILENAME), cls.key_dtype(key_length)),
+                   mmap_array(os.path.join(d, cls.OFFSETS_FILENAME), cls.OFFSET_DTYPE),
+                   mmap_array(os.path.join(d, cls.IDS_FILENAME), cls.ID_DTYPE),
+                   key_length)
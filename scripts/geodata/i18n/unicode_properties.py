@@ -6,6 +6,7 @@ to generate a C file (and header) defining which script every character
 belongs to.
 '''
 
+import array
 import csv
 import os
 import requests
@@ -43,6 +44,7 @@ SRC_DIR = os.path.join(this_dir, os.pardir, os.pardir, os.pardir, 'src')
 
 SCRIPTS_DATA_DIR = os.path.join(UNICODE_DATA_DIR, 'scripts')
 LOCAL_SCRIPTS_FILE = os.path.join(SCRIPTS_DATA_DIR, 'Scripts.txt')
+LOCAL_SCRIPT_INDEX_FILE = os.path.join(SCRIPTS_DATA_DIR, 'scripts_index.bin')
 LOCAL_ISO_15924_FILE = os.path.join(SCRIPTS_DATA_DIR, 'iso15924.txt')
 
 BLOCKS_DATA_DIR = os.path.join(UNICODE_DATA_DIR, 'blocks')
@@ -138,6 +140,146 @@ def get_chars_by_script():
     return scripts
 
 
+def get_script_ranges():
+    scripts_file = open(LOCAL_SCRIPTS_FILE)
+
+    for char_range, script, char_class in script_regex.findall(scripts_file.read()):
+        script_range = parse_char_range(char_range)
+        if len(script_range) == 2:
+            yield script_range[0], script_range[1], script
+        elif script_range:
+            yield script_range[0], script_range[0], script
+
+
+class ScriptIndex(object):
+    '''
+    Compact replacement for the list returned by get_chars_by_script.
+
+    Code points are split into pages of 256, each page is an array of
+    one-byte script ids and identical pages (most of them, since large
+    parts of the code space are unassigned or in a single script) are
+    stored once, so the whole table is about 50KB instead of a 1.1M-element
+    Python list.
+
+    Lookups return the script name or None for characters not in
+    Scripts.txt, same as indexing the list. For per-character loops,
+    script_ids() gives a flat array of script ids into scripts, which
+    avoids a method call per character.
+    '''
+
+    PAGE_BITS = 8
+    PAGE_SIZE = 1 << PAGE_BITS
+    PAGE_MASK = PAGE_SIZE - 1
+    NUM_PAGES = NUM_CODEPOINTS >> PAGE_BITS
+
+    def __init__(self, scripts, page_indices, pages):
+        # scripts[0] is None for characters without a script
+        self.scripts = scripts
+        self.page_indices = page_indices
+        self.pages = pages
+        self._script_ids = None
+
+    def __getitem__(self, codepoint):
+        return self.scripts[self.pages[(self.page_indices[codepoint >> self.PAGE_BITS] << self.PAGE_BITS) | (codepoint & self.PAGE_MASK)]]
+
+    def __len__(self):
+        return NUM_CODEPOINTS
+
+    def script_ids(self):
+        '''
+        array('B') of the script id (an index into scripts) of every code
+        point, 1.1MB, built from the pages on first use
+        '''
+        if self._script_ids is None:
+            pages = self.pages.tostring()
+            self._script_ids = array.array('B', b''.join([pages[i << self.PAGE_BITS:(i + 1) << self.PAGE_BITS]
+                                                          for i in self.page_indices]))
+        return self._script_ids
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        scripts = [None]
+        script_ids = {}
+
+        values = array.array('B', [0]) * NUM_CODEPOINTS
+        for start, end, script in ranges:
+            script_id = script_ids.get(script)
+            if script_id is None:
+                script_id = script_ids[script] = len(scripts)
+                scripts.append(script)
+            values[start:end + 1] = array.array('B', [script_id]) * (end - start + 1)
+
+        page_ids = {}
+        page_indices = array.array('H')
+        pages = array.array('B')
+
+        for i in xrange(cls.NUM_PAGES):
+            page = values[i * cls.PAGE_SIZE:(i + 1) * cls.PAGE_SIZE].tostring()
+            page_id = page_ids.get(page)
+            if page_id is None:
+                page_id = page_ids[page] = len(page_ids)
+                pages.fromstring(page)
+            page_indices.append(page_id)
+
+        return cls(scripts, page_indices, pages)
+
+    def save(self, filename):
+        # Native byte order, the file is a local cache built from Scripts.txt.
+        # Written to a temporary file and renamed into place so processes
+        # loading the index concurrently never see a partial file
+        fd, temp_filename = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.scripts_index')
+        try:
+            f = os.fdopen(fd, 'wb')
+            f.write(safe_encode(u'\t'.join(self.scripts[1:])) + '\n')
+            self.page_indices.tofile(f)
+            self.pages.tofile(f)
+            f.close()
+            os.chmod(temp_filename, 0o644)
+            os.rename(temp_filename, filename)
+        except:
+            if os.path.exists(temp_filename):
+                os.unlink(temp_filename)
+            raise
+
+    @classmethod
+    def load(cls, filename):
+        f = open(filename, 'rb')
+        scripts = [None] + safe_decode(f.readline().rstrip('\n')).split(u'\t')
+        page_indices = array.array('H')
+        page_indices.fromfile(f, cls.NUM_PAGES)
+        pages = array.array('B', f.read())
+        f.close()
+        if len(pages) % cls.PAGE_SIZE or max(page_indices) >= len(pages) // cls.PAGE_SIZE:
+            raise ValueError('Invalid script index: {}'.format(filename))
+        return cls(scripts, page_indices, pages)
+
+
+def build_script_index(filename=LOCAL_SCRIPT_INDEX_FILE):
+    '''
+    Build the script index from Scripts.txt and cache it in filename. If
+    the cache can't be written (e.g. read-only resources directory), the
+    index is only built in memory.
+    '''
+    index = ScriptIndex.from_ranges(get_script_ranges())
+    if filename is not None:
+        try:
+            index.save(filename)
+        except (IOError, OSError):
+            pass
+    return index
+
+
+def get_script_index():
+    # A shipped index may come without Scripts.txt, only rebuild if it's older
+    if os.path.exists(LOCAL_SCRIPT_INDEX_FILE) and (not os.path.exists(LOCAL_SCRIPTS_FILE) or
+                                                    os.path.getmtime(LOCAL_SCRIPT_INDEX_FILE) >= os.path.getmtime(LOCAL_SCRIPTS_FILE)):
+        try:
+            return ScriptIndex.load(LOCAL_SCRIPT_INDEX_FILE)
+        except (IOError, EOFError, ValueError):
+            pass
+    return build_script_index()
+
+
 COMMENT_CHAR = '#'
 DELIMITER_CHAR = ';'
 
@@ -414,6 +556,8 @@ def main(out_dir=SRC_DIR):
     if not os.path.exists(CLDR_SUPPLEMENTAL_DATA):
         download_cldr()
 
+    build_script_index()
+
     chars = get_chars_by_script()
     all_scripts = build_master_scripts_list(chars)
     script_codes = get_script_codes(all_scripts)
@@ -0,0 +1,200 @@
+'''
+geodata.instrumentation
+-----------------------
+
+Opt-in counters and latency histograms for the reverse geocoding indices
+(PolygonIndex and PointIndex, see their instrument flag). Each stage of a
+lookup (candidate retrieval, contains tests, LevelDB reads, JSON decoding,
+etc.) is timed separately, per index, so cache sizes can be chosen and
+slow polygons found from the data.
+
+Instrumentation works by replacing methods on the index instance with
+timed wrappers, so indices which aren't instrumented pay nothing. During
+long builds a summary of each instrumented index is logged (through the
+standard logging module, see geodata.log) every log_interval seconds.
+'''
+
+import logging
+import six
+import time
+
+logger = logging.getLogger('geodata.instrumentation')
+
+
+class LatencyHistogram(object):
+    '''
+    Histogram of latencies in power-of-two buckets of microseconds, i.e.
+    bucket b counts latencies in [2^(b-1), 2^b) us, bucket 0 is < 1us
+    '''
+    NUM_BUCKETS = 40
+
+    def __init__(self):
+        self.buckets = [0] * self.NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        micros = seconds * 1e6
+        # int(log2(micros)) + 1, without math, which is geodata.math here
+        b = min(int(micros).bit_length(), self.NUM_BUCKETS - 1)
+        self.buckets[b] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        '''
+        Upper bound (in seconds) of the bucket containing the pth percentile
+        '''
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for b, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min((2 ** b) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total_s': self.total,
+            'mean_ms': self.total / self.count * 1e3 if self.count else 0.0,
+            'min_ms': (self.min or 0.0) * 1e3,
+            'max_ms': (self.max or 0.0) * 1e3,
+            'p50_ms': self.percentile(50) * 1e3,
+            'p90_ms': self.percentile(90) * 1e3,
+            'p99_ms': self.percentile(99) * 1e3,
+        }
+
+
+class TimedDB(object):
+    '''
+    Wraps a LevelDB handle so Get calls are timed as stage
+    '''
+    def __init__(self, db, instrumentation, stage):
+        self.db = db
+        self.Get = instrumentation.timed(stage, db.Get)
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+class Instrumentation(object):
+    # Seconds between the periodic log summaries, None to disable
+    log_interval = 60.0
+    # Number of slowest items (e.g. polygon ids) to keep per stage
+    max_slow_items = 20
+
+    def __init__(self, name, counters=None):
+        '''
+        counters: optional function returning a dict of counters kept
+                  elsewhere (e.g. cache hits/misses) to include in summaries
+        '''
+        self.name = name
+        self.external_counters = counters
+        self.counters = {}
+        self.histograms = {}
+        self.slowest = {}
+        self.start_time = self.last_log_time = time.time()
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def observe(self, stage, seconds, item=None):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = LatencyHistogram()
+        histogram.add(seconds)
+
+        if item is not None:
+            slowest = self.slowest.setdefault(stage, {})
+            if len(slowest) < self.max_slow_items:
+                if seconds > slowest.get(item, 0.0):
+                    slowest[item] = seconds
+            elif item in slowest:
+                slowest[item] = max(seconds, slowest[item])
+            else:
+                fastest = min(slowest, key=slowest.get)
+                if seconds > slowest[fastest]:
+                    del slowest[fastest]
+                    slowest[item] = seconds
+
+    def timed(self, stage, func, item_arg=None, count_results=False, periodic=False):
+        '''
+        Wrap func so each call is recorded under stage. If item_arg is given,
+        positional argument item_arg identifies the item (e.g. polygon id)
+        for the slowest items list. If count_results is set, the number of
+        results returned is added to the counter <stage>_results. Wrappers
+        for top-level lookups should set periodic so summaries are logged
+        during long runs.
+        '''
+        results_counter = '{}_results'.format(stage)
+
+        def timed_func(*args, **kw):
+            start = time.time()
+            try:
+                result = func(*args, **kw)
+                if count_results and result is not None:
+                    self.count(results_counter, len(result))
+                return result
+            finally:
+                now = time.time()
+                self.observe(stage, now - start, item=args[item_arg] if item_arg is not None else None)
+                if periodic:
+                    self.maybe_log(now)
+        return timed_func
+
+    def instrument_methods(self, obj, stages, periodic=()):
+        '''
+        Replace obj's methods with timed wrappers. stages maps method name to
+        (stage, item_arg, count_results), periodic is a sequence of top-level
+        method names.
+        '''
+        for method_name, (stage, item_arg, count_results) in six.iteritems(stages):
+            setattr(obj, method_name, self.timed(stage, getattr(obj, method_name),
+                                                 item_arg=item_arg, count_results=count_results))
+        for method_name in periodic:
+            setattr(obj, method_name, self.timed(method_name, getattr(obj, method_name), periodic=True))
+
+    def maybe_log(self, now=None):
+        if self.log_interval is None:
+            return
+        now = now or time.time()
+        if now - self.last_log_time >= self.log_interval:
+            self.last_log_time = now
+            self.log_summary()
+
+    def log_summary(self):
+        logger.info('{}: {}'.format(self.name, self.summary_string()))
+
+    def summary_string(self):
+        parts = []
+        for stage, histogram in sorted(six.iteritems(self.histograms)):
+            s = histogram.summary()
+            parts.append('{} n={} mean={:.3f}ms p99={:.3f}ms max={:.3f}ms'.format(
+                         stage, s['count'], s['mean_ms'], s['p99_ms'], s['max_ms']))
+        for counter, value in sorted(six.iteritems(self.all_counters())):
+            parts.append('{}={}'.format(counter, value))
+        return ', '.join(parts)
+
+    def all_counters(self):
+        counters = dict(self.counters)
+        if self.external_counters is not None:
+            counters.update(self.external_counters())
+        return counters
+
+    def stats(self):
+        return {
+            'elapsed_s': time.time() - self.start_time,
+            'counters': self.all_counters(),
+            'stages': {stage: histogram.summary() for stage, histogram in six.iteritems(self.histograms)},
+            'slowest': {stage: sorted(six.iteritems(items), key=lambda item: item[1], reverse=True)
+                        for stage, items in six.iteritems(self.slowest)},
+        }
@@ -12,7 +12,7 @@ sys.path.append(os.path.realpath(os.path.join(os.pardir, os.pardir, os.pardir, '
 from geodata.address_expansions.gazetteers import *
 from geodata.encoding import safe_decode, safe_encode
 from geodata.string_utils import wide_iter, wide_ord
-from geodata.i18n.unicode_properties import get_chars_by_script, get_script_languages
+from geodata.i18n.unicode_properties import get_script_index, get_script_languages
 from geodata.text.normalize import normalized_tokens, normalize_string
 from geodata.text.tokenize import tokenize
 from geodata.text.token_types import token_types
@@ -33,7 +33,10 @@ WELL_REPRESENTED_LANGUAGE_COUNTRIES = {
     'pt': set(['pt', 'br']),
 }
 
-char_scripts = get_chars_by_script()
+char_scripts = get_script_index()
+# Flat script id per code point, indexed directly in the per-character loops
+script_ids = char_scripts.script_ids()
+script_names = char_scripts.scripts
 script_languages = {script: set(langs) for script, langs in six.iteritems(get_script_languages())}
 lang_scripts = defaultdict(set)
 
@@ -48,29 +51,60 @@ COMMON_SCRIPT = 'Common'
 MAX_ASCII = 127
 
 
-def get_string_script(s):
-    s = safe_decode(s)
-    str_len = len(s)
+def string_codepoints(s):
+    if sys.maxunicode > 0xFFFF:
+        return [ord(c) for c in s]
+    return [wide_ord(c) for c in wide_iter(s)]
+
+
+def script_run(codepoints):
+    '''
+    (script, length, is_ascii) of the first run of a single script in codepoints
+    '''
+    # Locals for the per-character lookups
+    ids = script_ids
+    names = script_names
     script = last_script = UNKNOWN_SCRIPT
     is_ascii = True
     script_len = 0
-    for c in wide_iter(s):
-        script = char_scripts[wide_ord(c)]
+    for c in codepoints:
+        script = names[ids[c]]
 
         if script == COMMON_SCRIPT and last_script != UNKNOWN_SCRIPT:
             script = last_script
         if last_script != script and last_script != UNKNOWN_SCRIPT and last_script != COMMON_SCRIPT:
-            if (script_len < str_len):
-                for c in reversed(list(wide_iter(s[:script_len]))):
-                    if char_scripts[wide_ord(c)] == COMMON_SCRIPT:
+            if (script_len < len(codepoints)):
+                for c in reversed(codepoints[:script_len]):
+                    if names[ids[c]] == COMMON_SCRIPT:
                         script_len -= 1
             break
-        is_ascii = is_ascii and ord(c) <= MAX_ASCII
+        is_ascii = is_ascii and c <= MAX_ASCII
         script_len += 1
         if script != UNKNOWN_SCRIPT:
             last_script = script
     return (last_script, script_len, is_ascii)
 
+
+def get_string_script(s):
+    return script_run(string_codepoints(safe_decode(s)))
+
+
+def get_string_scripts(strings):
+    '''
+    Batch version of get_string_script. The batch is joined and converted
+    to code points once, and each string's run is read from its slice
+    '''
+    strings = [safe_decode(s) for s in strings]
+    codepoints = string_codepoints(u''.join(strings))
+
+    results = []
+    start = 0
+    for s in strings:
+        end = start + (len(s) if sys.maxunicode > 0xFFFF else len(string_codepoints(s)))
+        results.append(script_run(codepoints[start:end]))
+        start = end
+    return results
+
 LATIN_SCRIPT = 'Latin'
 UNKNOWN_LANGUAGE = 'unk'
 AMBIGUOUS_LANGUAGE = 'xxx'
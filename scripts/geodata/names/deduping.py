@@ -42,8 +42,17 @@ class NameDeduper(object):
         return normalized_tokens(s)
 
     @classmethod
-    def content_tokens(cls, s):
-        tokens = cls.tokenize(s)
+    def tokenize_many(cls, strings):
+        '''
+        Batch version of tokenize. Subclasses which override tokenize but
+        not tokenize_many get a loop over their tokenize.
+        '''
+        if cls.tokenize.__func__ is not NameDeduper.tokenize.__func__:
+            return [cls.tokenize(s) for s in strings]
+        return normalized_tokens_many(strings)
+
+    @classmethod
+    def filter_content_tokens(cls, tokens):
         if cls.ignore_parentheticals:
             tokens = remove_parens(tokens)
         return [(cls.replacements.get(t, t), c)
@@ -51,6 +60,14 @@ class NameDeduper(object):
                 if c in cls.content_categories and
                 t not in cls.stopwords]
 
+    @classmethod
+    def content_tokens(cls, s):
+        return cls.filter_content_tokens(cls.tokenize(s))
+
+    @classmethod
+    def content_tokens_many(cls, strings):
+        return [cls.filter_content_tokens(tokens) for tokens in cls.tokenize_many(strings)]
+
     @classmethod
     def possible_match(cls, tokens1, tokens2):
         if not cls.discriminative_categories and not cls.discriminative_words:
@@ -65,8 +82,7 @@ class NameDeduper(object):
 
     @classmethod
     def compare_ideographs(cls, s1, s2):
-        tokens1 = cls.content_tokens(s1)
-        tokens2 = cls.content_tokens(s2)
+        tokens1, tokens2 = cls.content_tokens_many([s1, s2])
 
         if not cls.possible_match(tokens1, tokens2):
             return 0.0
@@ -82,8 +98,7 @@ class NameDeduper(object):
 
     @classmethod
     def compare(cls, s1, s2, idf):
-        tokens1 = cls.content_tokens(s1)
-        tokens2 = cls.content_tokens(s2)
+        tokens1, tokens2 = cls.content_tokens_many([s1, s2])
 
         if not cls.possible_match(tokens1, tokens2):
             return 0.0
@@ -16,7 +16,7 @@ from geodata.address_formatting.formatter import AddressFormatter
 from geodata.coordinates.conversion import latlon_to_decimal
 from geodata.encoding import safe_decode
 from geodata.file_utils import ensure_dir, download_file
-from geodata.i18n.unicode_properties import get_chars_by_script
+from geodata.i18n.unicode_properties import get_script_index
 from geodata.i18n.word_breaks import ideographic_scripts
 from geodata.names.deduping import NameDeduper
 from geodata.osm.admin_boundaries import OSMNeighborhoodPolygonReader
@@ -290,7 +290,7 @@ class NeighborhoodReverseGeocoder(RTreePolygonIndex):
         logger.info('Creating IDF index')
         idf = IDFIndex()
 
-        char_scripts = get_chars_by_script()
+        char_scripts = get_script_index()
 
         for idx in (cth, qs, osmn):
             for i in xrange(idx.i):
@@ -307,7 +307,8 @@ class NeighborhoodReverseGeocoder(RTreePolygonIndex):
                     idf.update(doc)
 
         for i in six.moves.xrange(osmn.i):
-            props = osmn.get_properties(i)
+            # Copied since the properties may be shared (see geodata.properties_store)
+            props = osmn.get_properties(i).copy()
             poly = osmn.get_polygon(i)
 
             props['source'] = 'osm'
@@ -469,10 +470,10 @@ class NeighborhoodReverseGeocoder(RTreePolygonIndex):
 
         for idx, source in ((cth, 'clickthathood'), (qs, 'quattroshapes')):
             for i in xrange(idx.i):
-                props = idx.get_properties(i)
-                poly = idx.get_polygon(i)
                 if idx.matched[i]:
                     continue
+                props = idx.get_properties(i).copy()
+                poly = idx.get_polygon(i)
                 props['source'] = source
                 if idx is cth:
                     component = props['component']
@@ -22,19 +22,6 @@ class OrdinalSuffixTrie(PhraseFilter):
         self.trie = BytesTrie([(safe_decode(k)[::-1], safe_decode('|').join(v).encode('utf-8')) for k, v in six.iteritems(ordinal_rules)])
         self.configured = True
 
-    def search_substring(self, s):
-        if len(s) == 0:
-            return None, 0
-
-        for i in xrange(len(s) + 1):
-            if not self.trie.has_keys_with_prefix(s[:i]):
-                i -= 1
-                break
-        if i > 0:
-            return (self.trie.get(s[:i]), i)
-        else:
-            return None, 0
-
     def search_suffix(self, token):
         suffix_search, suffix_len = self.search_substring(safe_decode(token[::-1]))
         if suffix_search:
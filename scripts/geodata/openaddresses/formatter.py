@@ -6,8 +6,11 @@ import itertools
 import os
 import random
 import re
+import shutil
 import six
+import time
 import yaml
+import zlib
 
 from geodata.addresses.units import Unit
 from geodata.address_expansions.abbreviations import abbreviate
@@ -18,6 +21,7 @@ from geodata.addresses.components import AddressComponents
 from geodata.countries.constants import Countries
 from geodata.countries.names import country_names
 from geodata.encoding import safe_decode, safe_encode
+from geodata.file_utils import ensure_dir
 from geodata.i18n.languages import get_country_languages
 from geodata.i18n.word_breaks import ideographic_scripts
 from geodata.language_id.disambiguation import UNKNOWN_LANGUAGE, get_string_script
@@ -25,6 +29,7 @@ from geodata.math.sampling import cdf, weighted_choice
 from geodata.openaddresses.config import openaddresses_config
 from geodata.places.config import place_config
 from geodata.postal_codes.phrases import PostalCodes
+from geodata.spatial_sort import spatially_sorted
 from geodata.text.tokenize import tokenize
 from geodata.text.token_types import token_types
 from geodata.text.utils import is_numeric, is_numeric_strict
@@ -86,11 +91,17 @@ class OpenAddressesFormatter(object):
                                  re.I | re.UNICODE)
             unit_type_regexes[lang] = pattern
 
-    def __init__(self, components, country_rtree, debug=False):
+    def __init__(self, components, country_rtree, debug=False, spatial_order=None, spatial_sort_dir=None):
         self.components = components
         self.country_rtree = country_rtree
 
         self.debug = debug
+        self.clear_polygon_caches = True
+
+        # Sort each source's rows along a space-filling curve before formatting
+        # (see geodata.spatial_sort), keeps the polygon caches warm
+        self.spatial_order = spatial_order
+        self.spatial_sort_dir = spatial_sort_dir
 
         self.formatter = AddressFormatter()
 
@@ -344,9 +355,14 @@ class OpenAddressesFormatter(object):
         latitude_index = headers.index('LAT')
         longitude_index = headers.index('LON')
 
+        if self.spatial_order:
+            reader = spatially_sorted(reader, lambda row: (float(row[latitude_index]), float(row[longitude_index])),
+                                      order=self.spatial_order, temp_dir=self.spatial_sort_dir)
+
         # Clear cached polygons
-        self.components.osm_admin_rtree.clear_cache()
-        self.components.neighborhoods_rtree.clear_cache()
+        if self.clear_polygon_caches:
+            self.components.osm_admin_rtree.clear_cache()
+            self.components.neighborhoods_rtree.clear_cache()
 
         for row in reader:
             try:
@@ -605,7 +621,12 @@ class OpenAddressesFormatter(object):
                                                                   minimal_only=False, tag_components=tag_components)
                         yield (language, country, formatted)
 
-    def build_training_data(self, base_dir, out_dir, tag_components=True, sources_only=None):
+    def sources(self, base_dir, sources_only=None):
+        '''
+        Generator of (country_dir, subdir, filename, path, configs) for each
+        configured source, in a stable order. subdir is None for files at
+        the top level of a country directory.
+        '''
         all_sources_valid = sources_only is None
         valid_sources = set()
         if not all_sources_valid:
@@ -618,19 +639,8 @@ class OpenAddressesFormatter(object):
                     raise AssertionError('Sources may only have at maximum 3 parts')
                 valid_sources.add(tuple(parts))
 
-        if tag_components:
-            formatted_tagged_file = open(os.path.join(out_dir, OPENADDRESSES_FORMAT_DATA_TAGGED_FILENAME), 'w')
-            writer = csv.writer(formatted_tagged_file, 'tsv_no_quote')
-        else:
-            formatted_tagged_file = open(os.path.join(out_dir, OPENADDRESSES_FORMAT_DATA_FILENAME), 'w')
-            writer = csv.writer(formatted_tagged_file, 'tsv_no_quote')
-
-        i = 0
-
         for country_dir in sorted(openaddresses_config.country_configs.keys()):
             country_config = openaddresses_config.country_configs[country_dir]
-            # Clear country cache for each new country
-            self.country_rtree.clear_cache()
 
             for file_config in country_config.get('files', []):
                 filename = file_config['filename']
@@ -638,29 +648,9 @@ class OpenAddressesFormatter(object):
                 if not all_sources_valid and not ((country_dir, filename) in valid_sources or (country_dir,) in valid_sources):
                     continue
 
-                print(six.u('doing {}/{}').format(country_dir, filename))
-
                 path = os.path.join(base_dir, country_dir, filename)
                 configs = (file_config, country_config, openaddresses_config.config)
-                for language, country, formatted_address in self.formatted_addresses(country_dir, path, configs, tag_components=tag_components):
-                    if not formatted_address or not formatted_address.strip():
-                        continue
-
-                    formatted_address = tsv_string(formatted_address)
-                    if not formatted_address or not formatted_address.strip():
-                        continue
-
-                    if tag_components:
-                        row = (language, country, formatted_address)
-                    else:
-                        row = (formatted_address,)
-
-                    writer.writerow(row)
-                    i += 1
-                    if i % 1000 == 0 and i > 0:
-                        print('did {} formatted addresses'.format(i))
-                        if self.debug:
-                            break
+                yield country_dir, None, filename, path, configs
 
             for subdir in sorted(country_config.get('subdirs', {}).keys()):
                 subdir_config = country_config['subdirs'][subdir]
@@ -671,28 +661,144 @@ class OpenAddressesFormatter(object):
                     if not all_sources_valid and not ((country_dir, subdir, filename) in valid_sources or (country_dir, subdir) in valid_sources or (country_dir,) in valid_sources):
                         continue
 
-                    print(six.u('doing {}/{}/{}').format(country_dir, subdir, filename))
-
                     path = os.path.join(base_dir, country_dir, subdir, filename)
-
                     configs = (file_config, subdir_config, country_config, openaddresses_config.config)
-                    for language, country, formatted_address in self.formatted_addresses(country_dir, path, configs, tag_components=tag_components):
-                        if not formatted_address or not formatted_address.strip():
-                            continue
-
-                        formatted_address = tsv_string(formatted_address)
-                        if not formatted_address or not formatted_address.strip():
-                            continue
-
-                        if tag_components:
-                            row = (language, country, formatted_address)
-                        else:
-                            row = (formatted_address,)
-
-                        writer.writerow(row)
-
-                        i += 1
-                        if i % 1000 == 0 and i > 0:
-                            print('did {} formatted addresses'.format(i))
-                            if self.debug:
-                                break
+                    yield country_dir, subdir, filename, path, configs
+
+    @classmethod
+    def source_name(cls, country_dir, subdir, filename):
+        return six.u('/').join([safe_decode(p) for p in (country_dir, subdir, filename) if p])
+
+    @classmethod
+    def source_seed(cls, seed, source_name):
+        '''
+        Per-source random seed so the output for a given source doesn't depend
+        on the order in which sources are processed (or on which worker does them)
+        '''
+        return zlib.crc32(safe_encode(six.u('{}:{}').format(seed, source_name))) & 0xffffffff
+
+    @classmethod
+    def training_data_filename(cls, tag_components=True):
+        return OPENADDRESSES_FORMAT_DATA_TAGGED_FILENAME if tag_components else OPENADDRESSES_FORMAT_DATA_FILENAME
+
+    def write_source(self, writer, country_dir, subdir, filename, path, configs, tag_components=True, seed=None):
+        '''
+        Write the formatted addresses for a single source, returns the number of rows
+        '''
+        if seed is not None:
+            random.seed(self.source_seed(seed, self.source_name(country_dir, subdir, filename)))
+
+        i = 0
+        for language, country, formatted_address in self.formatted_addresses(country_dir, path, configs, tag_components=tag_components):
+            if not formatted_address or not formatted_address.strip():
+                continue
+
+            formatted_address = tsv_string(formatted_address)
+            if not formatted_address or not formatted_address.strip():
+                continue
+
+            if tag_components:
+                row = (language, country, formatted_address)
+            else:
+                row = (formatted_address,)
+
+            writer.writerow(row)
+            i += 1
+            if i % 1000 == 0 and i > 0:
+                print('did {} formatted addresses'.format(i))
+                if self.debug:
+                    break
+        return i
+
+    def build_training_data(self, base_dir, out_dir, tag_components=True, sources_only=None, seed=None):
+        formatted_file = open(os.path.join(out_dir, self.training_data_filename(tag_components)), 'w')
+        writer = csv.writer(formatted_file, 'tsv_no_quote')
+
+        last_country_dir = None
+
+        for country_dir, subdir, filename, path, configs in self.sources(base_dir, sources_only=sources_only):
+            if country_dir != last_country_dir:
+                # Clear country cache for each new country
+                self.country_rtree.clear_cache()
+                last_country_dir = country_dir
+
+            print(six.u('doing {}').format(self.source_name(country_dir, subdir, filename)))
+
+            self.write_source(writer, country_dir, subdir, filename, path, configs,
+                              tag_components=tag_components, seed=seed)
+
+        formatted_file.close()
+
+    def build_training_data_parallel(self, base_dir, out_dir, service, num_workers=None,
+                                     tag_components=True, sources_only=None, seed=None):
+        '''
+        Fan the sources out across a process pool connected to a
+        ReverseGeocodeService (self.components and self.country_rtree should
+        be proxies from that service). Each source is written to its own
+        shard, and the shards are concatenated in source order at the end,
+        so given a seed the output is the same as build_training_data.
+        '''
+        shard_dir = os.path.join(out_dir, 'shards')
+        ensure_dir(shard_dir)
+
+        tasks = [(shard_index, country_dir, subdir, filename, path, configs,
+                  os.path.join(shard_dir, '{:06d}.tsv'.format(shard_index)),
+                  tag_components, seed)
+                 for shard_index, (country_dir, subdir, filename, path, configs)
+                 in enumerate(self.sources(base_dir, sources_only=sources_only))]
+
+        # The polygon caches live in the service and are shared by all the
+        # workers, so one worker starting a new file shouldn't clear them
+        self.clear_polygon_caches = False
+
+        pool = service.pool(num_workers, initializer=init_formatter_worker, initargs=(self,))
+
+        start = time.time()
+        total_rows = 0
+
+        for num_done, (shard_index, rows, elapsed) in enumerate(pool.imap_unordered(build_source_shard, tasks), 1):
+            total_rows += rows
+            _, country_dir, subdir, filename = tasks[shard_index][:4]
+            print(six.u('did {} ({}/{}): {} rows in {:.1f}s ({:.1f} rows/s), {} rows total ({:.1f} rows/s)').format(
+                  self.source_name(country_dir, subdir, filename), num_done, len(tasks),
+                  rows, elapsed, rows / elapsed if elapsed > 0 else 0.0,
+                  total_rows, total_rows / (time.time() - start)))
+
+        pool.close()
+        pool.join()
+
+        formatted_file = open(os.path.join(out_dir, self.training_data_filename(tag_components)), 'w')
+        for task in tasks:
+            shard_path = task[6]
+            shard = open(shard_path)
+            shutil.copyfileobj(shard, formatted_file)
+            shard.close()
+            os.unlink(shard_path)
+        formatted_file.close()
+        os.rmdir(shard_dir)
+
+
+worker_formatter = None
+
+
+def init_formatter_worker(formatter):
+    global worker_formatter
+    worker_formatter = formatter
+    # Forked workers inherit the parent's random state, so without a seed
+    # (which write_source applies per source) they'd all draw the same
+    # sequence. Reseed each one from os.urandom
+    random.seed()
+
+
+def build_source_shard(task):
+    shard_index, country_dir, subdir, filename, path, configs, shard_path, tag_components, seed = task
+    start = time.time()
+
+    print(six.u('doing {}').format(worker_formatter.source_name(country_dir, subdir, filename)))
+
+    f = open(shard_path, 'w')
+    writer = csv.writer(f, 'tsv_no_quote')
+    rows = worker_formatter.write_source(writer, country_dir, subdir, filename, path, configs,
+                                         tag_components=tag_components, seed=seed)
+    f.close()
+    return shard_index, rows, time.time() - start
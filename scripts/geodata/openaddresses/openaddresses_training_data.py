@@ -10,6 +10,8 @@ import argparse
 import logging
 import os
 import sys
+import tempfile
+import ujson as json
 
 from shapely.geos import LOG as shapely_geos_logger
 shapely_geos_logger.setLevel(logging.CRITICAL)
@@ -20,10 +22,15 @@ sys.path.append(os.path.realpath(os.path.join(os.pardir, os.pardir)))
 from geodata.openaddresses.formatter import OpenAddressesFormatter
 
 from geodata.addresses.components import AddressComponents
+from geodata.instrumentation import Instrumentation
+from geodata.points.index import PointIndex
+from geodata.polygons.index import PolygonIndex
 from geodata.polygons.language_polys import LanguagePolygonIndex
 from geodata.neighborhoods.reverse_geocode import NeighborhoodReverseGeocoder
 from geodata.places.reverse_geocode import PlaceReverseGeocoder
 from geodata.polygons.reverse_geocode import OSMReverseGeocoder, OSMCountryReverseGeocoder
+from geodata.service.reverse_geocode import ReverseGeocodeService
+from geodata.spatial_sort import SPATIAL_ORDERS
 
 
 if __name__ == '__main__':
@@ -66,28 +73,94 @@ if __name__ == '__main__':
                         default=False,
                         help='Test on a sample of each file to debug config')
 
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=1,
+                        help='Number of worker processes, each source file is written to its own shard')
+
+    parser.add_argument('--seed',
+                        type=int,
+                        default=None,
+                        help='Random seed, makes the output deterministic')
+
+    parser.add_argument('--sort-by-location',
+                        choices=SPATIAL_ORDERS,
+                        default=None,
+                        help='Sort the rows of each source along a space-filling curve (in --temp-dir) before formatting')
+
+    parser.add_argument('-t', '--temp-dir',
+                        default=tempfile.gettempdir(),
+                        help='Temp directory to use')
+
+    parser.add_argument('--instrument',
+                        action='store_true',
+                        default=False,
+                        help='Record per-stage counters and latencies for the reverse geocoding indices')
+
+    parser.add_argument('--instrument-log-interval',
+                        type=float,
+                        default=Instrumentation.log_interval,
+                        help='Seconds between instrumentation summaries in the log')
+
     parser.add_argument('-o', '--out-dir',
                         default=os.getcwd(),
                         help='Output directory')
 
     args = parser.parse_args()
 
-    country_rtree = OSMCountryReverseGeocoder.load(args.country_rtree_dir)
-
-    osm_rtree = None
-    if args.rtree_dir:
-        osm_rtree = OSMReverseGeocoder.load(args.rtree_dir)
-
-    neighborhoods_rtree = None
-    if args.neighborhoods_rtree_dir:
-        neighborhoods_rtree = NeighborhoodReverseGeocoder.load(args.neighborhoods_rtree_dir)
-
-    places_index = None
-    if args.places_index_dir:
-        places_index = PlaceReverseGeocoder.load(args.places_index_dir)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.instrument:
+        PolygonIndex.instrument = True
+        PointIndex.instrument = True
+        Instrumentation.log_interval = args.instrument_log_interval
+
+    index_dirs = {
+        'country_rtree': (OSMCountryReverseGeocoder, args.country_rtree_dir),
+        'osm_rtree': (OSMReverseGeocoder, args.rtree_dir),
+        'neighborhoods_rtree': (NeighborhoodReverseGeocoder, args.neighborhoods_rtree_dir),
+        'places_index': (PlaceReverseGeocoder, args.places_index_dir),
+    }
+    index_dirs = {name: (cls, d) for name, (cls, d) in index_dirs.iteritems() if d}
+
+    service = None
+    if args.workers > 1:
+        # Indexes are loaded once in the service process and shared by the workers
+        service = ReverseGeocodeService(index_dirs)
+        service.start()
+        indexes = service.reverse_geocoders()
+    else:
+        indexes = {name: cls.load(d) for name, (cls, d) in index_dirs.iteritems()}
 
     if args.openaddresses_dir and args.format:
-        components = AddressComponents(osm_rtree, neighborhoods_rtree, places_index)
-
-        oa_formatter = OpenAddressesFormatter(components, country_rtree, debug=args.debug)
-        oa_formatter.build_training_data(args.openaddresses_dir, args.out_dir, tag_components=not args.untagged, sources_only=args.sources or None)
+        components = AddressComponents(indexes.get('osm_rtree'), indexes.get('neighborhoods_rtree'), indexes.get('places_index'))
+
+        oa_formatter = OpenAddressesFormatter(components, indexes['country_rtree'], debug=args.debug,
+                                              spatial_order=args.sort_by_location,
+                                              spatial_sort_dir=args.temp_dir)
+        if service is not None:
+            oa_formatter.build_training_data_parallel(args.openaddresses_dir, args.out_dir, service,
+                                                      num_workers=args.workers,
+                                                      tag_components=not args.untagged,
+                                                      sources_only=args.sources or None,
+                                                      seed=args.seed)
+        else:
+            oa_formatter.build_training_data(args.openaddresses_dir, args.out_dir, tag_components=not args.untagged,
+                                             sources_only=args.sources or None, seed=args.seed)
+
+        # With workers, indexes are proxies and the stats come from the
+        # service process, where all of the lookups were done
+        for name in ('country_rtree', 'osm_rtree', 'neighborhoods_rtree'):
+            index = indexes.get(name)
+            if index is None:
+                continue
+            cache_stats = index.cache_stats()
+            if cache_stats is not None:
+                print('{} polygon cache ({}): {}'.format(name, args.sort_by_location or 'input order', cache_stats))
+
+        if args.instrument:
+            for name, index in sorted(indexes.iteritems()):
+                print('{} stats: {}'.format(name, json.dumps(index.stats())))
+
+    if service is not None:
+        service.shutdown()
@@ -10,17 +10,16 @@ import logging
 import six
 
 from bisect import bisect_left
-from collections import defaultdict, OrderedDict
-from itertools import izip, combinations
+from itertools import chain, izip
 
 from geodata.coordinates.conversion import latlon_to_decimal
 from geodata.encoding import safe_encode, safe_decode
 from geodata.file_utils import ensure_dir
-from geodata.graph.scc import strongly_connected_components
 from geodata.i18n.languages import osm_admin1_ids
 from geodata.math.floats import isclose
 from geodata.osm.definitions import osm_definitions
 from geodata.osm.extract import *
+from geodata.osm.rings import chain_ways, ring_coordinates
 
 
 class OSMPolygonReader(object):
@@ -43,10 +42,16 @@ class OSMPolygonReader(object):
     One nice property of the .osm files generated by osmfilter is that
     nodes/ways/relations are stored in sorted order, so we don't have to
     pre-sort the lookup arrays before performing binary search.
+
+    For planet-sized inputs, pass a node location store from
+    geodata.osm.node_locations. Ways then only store their node ids and
+    coordinates are resolved lazily through the store when polygons are
+    assembled, instead of being copied into way_coords.
     '''
 
-    def __init__(self, filename):
+    def __init__(self, filename, node_locations=None):
         self.filename = filename
+        self.node_locations = node_locations
 
         self.node_ids = array.array('l')
         self.way_ids = array.array('l')
@@ -74,32 +79,38 @@ class OSMPolygonReader(object):
         node_coords = coords[start_index:end_index]
         return zip(node_coords[::2], node_coords[1::2])
 
+    def way_node_coordinates(self, way_index):
+        if self.node_locations is not None:
+            return self.node_locations.coordinates(self.sparse_deps(self.way_deps, self.way_indptr, way_index))
+        return self.node_coordinates(self.way_coords, self.way_indptr, way_index)
+
     def sparse_deps(self, data, indptr, idx):
         return [data[i] for i in xrange(indptr[idx], indptr[idx + 1])]
 
+    def way_flat_coordinates(self, way_index):
+        '''
+        (coords, start, end) where the way's nodes are the coordinate
+        pairs [start, end) of the flat array coords
+        '''
+        if self.node_locations is not None:
+            node_coords = self.way_node_coordinates(way_index)
+            return array.array('d', chain.from_iterable(node_coords)), 0, len(node_coords)
+        return self.way_coords, self.way_indptr[way_index], self.way_indptr[way_index + 1]
+
     def create_polygons(self, ways):
         '''
         Polygons (relations) are effectively stored as lists of
         line segments (ways) and there may be more than one polygon
         (island chains, overseas territories).
 
-        If we view the line segments as a graph (any two ways which
-        share a terminal node are connected), then the process of
-        constructing polygons reduces to finding strongly connected
-        components in a graph.
-
-        https://en.wikipedia.org/wiki/Strongly_connected_component
-
-        Note that even though there may be hundreds of thousands of
-        points in a complex polygon like a country boundary, we only
-        need to build a graph of connected ways, which will be many
-        times smaller and take much less time to traverse.
+        Any two ways which share a terminal node are adjacent in a ring,
+        so rings are assembled by chaining ways through a hash table of
+        their end nodes (see geodata.osm.rings), which is linear in the
+        number of ways. Only the end nodes are needed for that, the
+        coordinates are copied once per ring into a flat array.
         '''
-        end_nodes = defaultdict(list)
-        polys = []
-
-        way_indices = {}
-        start_end_nodes = {}
+        way_indices = []
+        endpoints = []
 
         for way_id in ways:
             # Find the way position via binary search
@@ -108,69 +119,28 @@ class OSMPolygonReader(object):
             except ValueError:
                 continue
 
-            # Cache the way index
-            way_indices[way_id] = way_index
-
             # way_indptr is a compressed index into way_deps/way_coords
             # way_index i is stored at indices way_indptr[i]:way_indptr[i+1]
             # in way_deps
             start_node_id = self.way_deps[self.way_indptr[way_index]]
             end_node_id = self.way_deps[self.way_indptr[way_index + 1] - 1]
 
-            start_end_nodes[way_id] = (start_node_id, end_node_id)
-
-            if start_node_id == end_node_id:
-                way_node_points = self.node_coordinates(self.way_coords, self.way_indptr, way_index)
-                polys.append(way_node_points)
-                continue
-
-            end_nodes[start_node_id].append(way_id)
-            end_nodes[end_node_id].append(way_id)
+            way_indices.append(way_index)
+            endpoints.append((start_node_id, end_node_id))
 
-        # Way graph for a single polygon, don't need to be as concerned about storage
-        way_graph = defaultdict(OrderedDict)
+        def way_coordinates(k):
+            return self.way_flat_coordinates(way_indices[k])
 
-        for node_id, ways in end_nodes.iteritems():
-            for w1, w2 in combinations(ways, 2):
-                way_graph[w1][w2] = None
-                way_graph[w2][w1] = None
-
-        way_graph = {v: w.keys() for v, w in way_graph.iteritems()}
-
-        for component in strongly_connected_components(way_graph):
-            poly_nodes = []
-
-            seen = set()
+        polys = []
 
-            if not component:
+        for closed, ways_chain in chain_ways(endpoints):
+            if not closed:
+                self.logger.debug('Unclosed ring of {} ways'.format(len(ways_chain)))
+            coords = ring_coordinates(ways_chain, way_coordinates, closed=closed)
+            # Chains made up only of one-node ways have no coordinates
+            if not coords:
                 continue
-
-            q = [(c, False) for c in component[:1]]
-            while q:
-                way_id, reverse = q.pop()
-                way_index = way_indices[way_id]
-
-                node_coords = self.node_coordinates(self.way_coords, self.way_indptr, way_index)
-
-                head, tail = start_end_nodes[way_id]
-
-                if reverse:
-                    node_coords = node_coords[::-1]
-                    head, tail = tail, head
-
-                for neighbor in way_graph[way_id]:
-                    if neighbor in seen:
-                        continue
-                    neighbor_head, neighbor_tail = start_end_nodes[neighbor]
-                    neighbor_reverse = neighbor_head == head or neighbor_tail == tail
-                    q.append((neighbor, neighbor_reverse))
-
-                way_start = 0 if q else 1
-                poly_nodes.extend(node_coords[way_start:-1])
-
-                seen.add(way_id)
-
-            polys.append(poly_nodes)
+            polys.append(zip(coords[::2], coords[1::2]))
 
         return polys
 
@@ -215,6 +185,10 @@ class OSMPolygonReader(object):
                 if 'name' in props and 'place' in props:
                     self.nodes[node_id] = props
 
+                if self.node_locations is not None:
+                    self.node_locations.add(node_id, lon, lat)
+                    continue
+
                 # Nodes are stored in a sorted array, coordinate indices are simply
                 # [lon, lat, lon, lat ...] so the index can be calculated as 2 * i
                 # Note that the pairs are lon, lat instead of lat, lon for geometry purposes
@@ -224,21 +198,29 @@ class OSMPolygonReader(object):
             elif element_id.startswith('way'):
                 way_id = long(element_id.split(':')[-1])
 
-                # Get node indices by binary search
-                try:
-                    node_indices = [self.binary_search(self.node_ids, node_id) for node_id in deps]
-                except ValueError:
-                    continue
+                if self.node_locations is not None:
+                    if not self.node_locations.has_nodes(deps):
+                        continue
+
+                    self.way_ids.append(way_id)
+                    # Coordinates are looked up in the node store when needed
+                    self.way_deps.extend(deps)
+                else:
+                    # Get node indices by binary search
+                    try:
+                        node_indices = [self.binary_search(self.node_ids, node_id) for node_id in deps]
+                    except ValueError:
+                        continue
 
-                # Way ids stored in a sorted array
-                self.way_ids.append(way_id)
+                    # Way ids stored in a sorted array
+                    self.way_ids.append(way_id)
 
-                # way_deps is the list of dependent node ids
-                # way_coords is a copy of coords indexed by way ids
-                for node_id, node_index in izip(deps, node_indices):
-                    self.way_deps.append(node_id)
-                    self.way_coords.append(self.coords[node_index * 2])
-                    self.way_coords.append(self.coords[node_index * 2 + 1])
+                    # way_deps is the list of dependent node ids
+                    # way_coords is a copy of coords indexed by way ids
+                    for node_id, node_index in izip(deps, node_indices):
+                        self.way_deps.append(node_id)
+                        self.way_coords.append(self.coords[node_index * 2])
+                        self.way_coords.append(self.coords[node_index * 2 + 1])
 
                 self.way_indptr.append(len(self.way_deps))
 
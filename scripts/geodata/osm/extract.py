@@ -49,7 +49,22 @@ OSM_BASE_NAME_TAGS = (
 )
 
 
+PBF_EXTENSION = '.pbf'
+
+
 def parse_osm(filename, allowed_types=ALL_OSM_TAGS, dependencies=False):
+    '''
+    Parse an OSM file iteratively, using the streaming PBF reader for .pbf
+    files and XML otherwise. See parse_osm_xml for the output format.
+    '''
+    if filename.endswith(PBF_EXTENSION):
+        # Imported here since geodata.osm.pbf uses the constants in this module
+        from geodata.osm.pbf import parse_pbf
+        return parse_pbf(filename, allowed_types=allowed_types, dependencies=dependencies)
+    return parse_osm_xml(filename, allowed_types=allowed_types, dependencies=dependencies)
+
+
+def parse_osm_xml(filename, allowed_types=ALL_OSM_TAGS, dependencies=False):
     '''
     Parse a file in .osm format iteratively, generating tuples like:
     ('node:1', OrderedDict([('lat', '12.34'), ('lon', '23.45')])),
@@ -45,6 +45,7 @@ from geodata.places.config import place_config
 from geodata.polygons.language_polys import *
 from geodata.polygons.reverse_geocode import *
 from geodata.postal_codes.phrases import PostalCodes
+from geodata.spatial_sort import spatially_sorted
 from geodata.i18n.unicode_paths import DATA_DIR
 from geodata.text.tokenize import tokenize, token_types
 from geodata.text.utils import is_numeric
@@ -155,6 +156,12 @@ class OSMAddressFormatter(object):
 
     boundary_component_priorities = {k: i for i, k in enumerate(AddressFormatter.BOUNDARY_COMPONENTS_ORDERED)}
 
+    # Set to HILBERT or GEOHASH (from geodata.spatial_sort) to process the
+    # input of the build_*_training_data methods in space-filling curve
+    # order, which keeps the reverse geocoders' polygon caches warm
+    spatial_order = None
+    spatial_sort_dir = None
+
     def __init__(self, components, country_rtree, subdivisions_rtree=None, buildings_rtree=None, metro_stations_index=None):
         # Instance of AddressComponents, contains structures for reverse geocoding, etc.
         self.components = components
@@ -168,6 +175,30 @@ class OSMAddressFormatter(object):
         self.config = yaml.load(open(OSM_PARSER_DATA_DEFAULT_CONFIG))
         self.formatter = AddressFormatter()
 
+    def reverse_geocode_context(self, latitude, longitude):
+        return self.components.reverse_geocode_context(latitude, longitude,
+                                                       country_rtree=self.country_rtree,
+                                                       subdivisions_rtree=self.subdivisions_rtree,
+                                                       buildings_rtree=self.buildings_rtree,
+                                                       metro_stations_index=self.metro_stations_index)
+
+    @classmethod
+    def record_coordinates(cls, record):
+        try:
+            return latlon_to_decimal(record[1]['lat'], record[1]['lon'])
+        except Exception:
+            return None
+
+    def input_records(self, records):
+        '''
+        records, optionally sorted by location (see spatial_order)
+        '''
+        if not self.spatial_order:
+            return records
+        return spatially_sorted(records, self.record_coordinates,
+                                order=self.spatial_order,
+                                temp_dir=self.spatial_sort_dir)
+
     def namespaced_language(self, tags, candidate_languages):
         language = None
 
@@ -299,7 +330,9 @@ class OSMAddressFormatter(object):
 
         return True
 
-    def subdivision_components(self, latitude, longitude):
+    def subdivision_components(self, latitude, longitude, context=None):
+        if context is not None:
+            return context.subdivisions
         return self.subdivisions_rtree.point_in_poly(latitude, longitude, return_all=True)
 
     def zone(self, subdivisions):
@@ -310,7 +343,9 @@ class OSMAddressFormatter(object):
                     return zone
         return None
 
-    def building_components(self, latitude, longitude):
+    def building_components(self, latitude, longitude, context=None):
+        if context is not None:
+            return context.buildings
         return self.buildings_rtree.point_in_poly(latitude, longitude, return_all=True)
 
     def num_floors(self, buildings, key='building:levels'):
@@ -472,7 +507,7 @@ class OSMAddressFormatter(object):
 
         return None
 
-    def add_metro_station(self, address_components, latitude, longitude, language=None, default_language=None):
+    def add_metro_station(self, address_components, latitude, longitude, language=None, default_language=None, context=None):
         '''
         Metro stations
         --------------
@@ -492,7 +527,10 @@ class OSMAddressFormatter(object):
         '''
         if self.metro_stations_index is None:
             return False
-        nearest_metro = self.metro_stations_index.nearest_point(latitude, longitude)
+        if context is not None:
+            nearest_metro = context.nearest_metro_station
+        else:
+            nearest_metro = self.metro_stations_index.nearest_point(latitude, longitude)
         if nearest_metro:
             props, lat, lon, distance = nearest_metro
             name = None
@@ -1021,7 +1059,7 @@ class OSMAddressFormatter(object):
                             formatted_addresses.append(formatted_address)
         return formatted_addresses
 
-    def formatted_addresses(self, tags, tag_components=True):
+    def formatted_addresses(self, tags, tag_components=True, context=None):
         '''
         Formatted addresses
         -------------------
@@ -1040,6 +1078,9 @@ class OSMAddressFormatter(object):
         If there is more than one venue name (say name and alt_name),
         addresses using both names and the selected components are
         returned.
+
+        All of the reverse geocoding for the element's coordinate goes
+        through one ReverseGeocodeContext (created here if not passed in).
         '''
 
         try:
@@ -1047,9 +1088,12 @@ class OSMAddressFormatter(object):
         except Exception:
             return None, None, None
 
-        osm_components = self.components.osm_reverse_geocoded_components(latitude, longitude)
+        if context is None:
+            context = self.reverse_geocode_context(latitude, longitude)
+
+        osm_components = context.osm_components
 
-        country, candidate_languages = self.components.osm_country_and_languages(osm_components)
+        country, candidate_languages = context.osm_country_and_languages()
         if not (country and candidate_languages):
             return None, None, None
 
@@ -1087,7 +1131,7 @@ class OSMAddressFormatter(object):
         # Only including nearest metro station in Japan
         if country == Countries.JAPAN:
             if random.random() < float(nested_get(self.config, ('countries', 'jp', 'add_metro_probability'), default=0.0)):
-                if self.add_metro_station(revised_tags, latitude, longitude, japanese_variant, default_language=JAPANESE):
+                if self.add_metro_station(revised_tags, latitude, longitude, japanese_variant, default_language=JAPANESE, context=context):
                     language = japanese_variant
 
         num_floors = None
@@ -1108,7 +1152,7 @@ class OSMAddressFormatter(object):
 
         building_venue_names = []
 
-        building_components = self.building_components(latitude, longitude)
+        building_components = self.building_components(latitude, longitude, context=context)
 
         building_is_generic_place = False
         building_is_known_venue_type = False
@@ -1135,7 +1179,7 @@ class OSMAddressFormatter(object):
                     elif k == AddressFormatter.HOUSE:
                         building_venue_names.append((v, building_is_generic_place, building_is_known_venue_type))
 
-        subdivision_components = self.subdivision_components(latitude, longitude)
+        subdivision_components = self.subdivision_components(latitude, longitude, context=context)
         if subdivision_components:
             zone = self.zone(subdivision_components)
 
@@ -1147,7 +1191,8 @@ class OSMAddressFormatter(object):
         address_components, country, language = self.components.expanded(revised_tags, latitude, longitude, language=language or namespaced_language,
                                                                          num_floors=num_floors, num_basements=num_basements,
                                                                          zone=zone, add_sub_building_components=add_sub_building_components,
-                                                                         population_from_city=True, check_city_wikipedia=True, osm_components=osm_components)
+                                                                         population_from_city=True, check_city_wikipedia=True, osm_components=osm_components,
+                                                                         context=context)
 
         languages = list(country_languages[country])
         venue_names = self.venue_names(tags, languages) or []
@@ -1342,7 +1387,7 @@ class OSMAddressFormatter(object):
             formatted_file = open(os.path.join(out_dir, FORMATTED_ADDRESS_DATA_FILENAME), 'w')
             writer = csv.writer(formatted_file, 'tsv_no_quote')
 
-        for node_id, value, deps in parse_osm(infile):
+        for node_id, value, deps in self.input_records(parse_osm(infile)):
             formatted_addresses, country, language = self.formatted_addresses(value, tag_components=tag_components)
             if not formatted_addresses:
                 continue
@@ -1374,7 +1419,7 @@ class OSMAddressFormatter(object):
             formatted_tagged_file = open(os.path.join(out_dir, FORMATTED_PLACE_DATA_FILENAME), 'w')
             writer = csv.writer(formatted_file, 'tsv_no_quote')
 
-        for node_id, tags, deps in parse_osm(infile):
+        for node_id, tags, deps in self.input_records(parse_osm(infile)):
             tags['type'], tags['id'] = node_id.split(':')
             place_tags, country = self.node_place_tags(tags)
 
@@ -1521,7 +1566,7 @@ class OSMAddressFormatter(object):
         all_name_tags = set(OSM_NAME_TAGS)
         all_base_name_tags = set(OSM_BASE_NAME_TAGS)
 
-        for node_id, node_props, ways in OSMIntersectionReader.read_intersections(infile):
+        for node_id, node_props, ways in self.input_records(OSMIntersectionReader.read_intersections(infile)):
             distinct_ways = set()
             valid_ways = []
             for way in ways:
@@ -1634,7 +1679,7 @@ class OSMAddressFormatter(object):
         all_name_tags = set(OSM_NAME_TAGS)
         all_base_name_tags = set(OSM_BASE_NAME_TAGS)
 
-        for key, value, deps in parse_osm(infile, allowed_types=WAYS_RELATIONS):
+        for key, value, deps in self.input_records(parse_osm(infile, allowed_types=WAYS_RELATIONS)):
             latitude = value['lat']
             longitude = value['lon']
 
@@ -1643,7 +1688,9 @@ class OSMAddressFormatter(object):
             except Exception:
                 continue
 
-            country, candidate_languages = self.country_rtree.country_and_languages(latitude, longitude)
+            context = self.reverse_geocode_context(latitude, longitude)
+
+            country, candidate_languages = context.country_and_languages()
             if not (country and candidate_languages):
                 continue
 
@@ -1652,7 +1699,7 @@ class OSMAddressFormatter(object):
             if not names:
                 continue
 
-            osm_components = self.components.osm_reverse_geocoded_components(latitude, longitude)
+            osm_components = context.osm_components
 
             containing_ids = [(b['type'], b['id']) for b in osm_components]
 
@@ -1666,7 +1713,8 @@ class OSMAddressFormatter(object):
 
                             self.components.add_admin_boundaries(address_components, osm_components,
                                                                  country, lang,
-                                                                 latitude, longitude)
+                                                                 latitude, longitude,
+                                                                 context=context)
 
                             revised_address_components = self.cleanup_place_components(address_components, osm_components, country, lang, containing_ids, population_from_city=True)
 
@@ -1708,7 +1756,7 @@ class OSMAddressFormatter(object):
         f = open(os.path.join(out_dir, FORMATTED_ADDRESS_DATA_LANGUAGE_FILENAME), 'w')
         writer = csv.writer(f, 'tsv_no_quote')
 
-        for node_id, value, deps in parse_osm(infile):
+        for node_id, value, deps in self.input_records(parse_osm(infile)):
             formatted_address, country, language = self.formatted_address_limited(value)
             if not formatted_address:
                 continue
@@ -32,6 +32,7 @@ class OSMIntersectionReader(object):
 
         # Store these in a LevelDB
         ensure_dir(db_dir)
+        self.db_dir = db_dir
         ways_dir = os.path.join(db_dir, 'ways')
         ensure_dir(ways_dir)
         nodes_dir = os.path.join(db_dir, 'nodes')
@@ -130,14 +131,7 @@ class OSMIntersectionReader(object):
             node_props = json.loads(self.node_props.Get(safe_encode(node_id)))
 
             way_indices = self.intersection_edges_ways[idx:idx + group_len]
-            all_ways = [json.loads(self.way_props.Get(safe_encode(w))) for w in way_indices]
-            way_names = set()
-            ways = []
-            for way in all_ways:
-                if way['name'] in way_names:
-                    continue
-                ways.append(way)
-                way_names.add(way['name'])
+            ways = self.distinct_ways(way_indices)
 
             idx += group_len
 
@@ -149,9 +143,158 @@ class OSMIntersectionReader(object):
                 node_index = self.binary_search(self.node_ids, node_id)
                 yield self.node_ids[node_index], node_props, ways
 
-    def create_intersections(self, outfile):
+    def distinct_ways(self, way_ids):
+        all_ways = [json.loads(self.way_props.Get(safe_encode(w))) for w in way_ids]
+        way_names = set()
+        ways = []
+        for way in all_ways:
+            if way['name'] in way_names:
+                continue
+            ways.append(way)
+            way_names.add(way['name'])
+        return ways
+
+    def intersections_single_pass(self):
+        '''
+        Same output as intersections, but reads the OSM file only once.
+
+        Since nodes come before ways in the file, the node ids are final by
+        the time the first way is seen. Node properties are appended to a
+        spill file as they're read, indexed by node position, so only the
+        properties of intersection nodes are ever decoded. Way node ids are
+        mapped to node indices with a vectorized binary search, degrees are
+        accumulated in a memory-mapped counting table, and the
+        (node index, way id) edges are streamed to disk. Way properties are
+        written once per way rather than once per intersection node. At the
+        end only the edges whose node has degree > 1 are read back, so the
+        second parse isn't needed. The temporary files in db_dir are removed
+        when done.
+        '''
+        node_props_path = os.path.join(self.db_dir, 'node_props')
+        edges_nodes_path = os.path.join(self.db_dir, 'edges_nodes')
+        edges_ways_path = os.path.join(self.db_dir, 'edges_ways')
+        node_counts_path = os.path.join(self.db_dir, 'node_counts')
+
+        temp_paths = (node_props_path, edges_nodes_path, edges_ways_path, node_counts_path)
+
+        try:
+            for intersection in self.single_pass_intersections(node_props_path, edges_nodes_path,
+                                                               edges_ways_path, node_counts_path):
+                yield intersection
+        finally:
+            for path in temp_paths:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def single_pass_intersections(self, node_props_path, edges_nodes_path, edges_ways_path, node_counts_path):
+        node_ids = array.array('l')
+        node_ids_array = None
+        node_counts = None
+
+        # Node i's JSON properties are at node_props_offsets[i]:node_props_offsets[i + 1] in the spill file
+        node_props_offsets = array.array('l', [0])
+
+        node_props_file = open(node_props_path, 'wb')
+        edges_nodes_file = open(edges_nodes_path, 'wb')
+        edges_ways_file = open(edges_ways_path, 'wb')
+
+        i = 0
+
+        for element_id, props, deps in parse_osm(self.filename, dependencies=True):
+            if element_id.startswith('node'):
+                props = {safe_decode(k): safe_decode(v) for k, v in six.iteritems(props)}
+                node_id = long(element_id.split(':')[-1])
+                if node_counts is not None:
+                    raise ValueError('Nodes in {} must come before ways'.format(self.filename))
+                node_ids.append(node_id)
+                data = json.dumps(props)
+                node_props_file.write(data)
+                node_props_offsets.append(node_props_offsets[-1] + len(data))
+            elif element_id.startswith('way'):
+                if node_counts is None:
+                    if not node_ids:
+                        break
+                    node_ids_array = numpy.frombuffer(node_ids, dtype=numpy.int64)
+                    if numpy.any(node_ids_array[1:] < node_ids_array[:-1]):
+                        raise ValueError('Nodes in {} must be sorted by id'.format(self.filename))
+                    node_counts = numpy.memmap(node_counts_path, dtype=numpy.uint16, mode='w+', shape=(len(node_ids_array),))
+
+                # Don't care about the ordering of the nodes, and want uniques e.g. for circular roads
+                way_nodes = numpy.unique(numpy.array(deps, dtype=numpy.int64))
+                node_indices = numpy.searchsorted(node_ids_array, way_nodes)
+                in_bounds = node_indices < len(node_ids_array)
+                node_indices = node_indices[in_bounds]
+                node_indices = node_indices[node_ids_array[node_indices] == way_nodes[in_bounds]]
+                if not len(node_indices):
+                    continue
+
+                # Indices are unique, so fancy-indexed increment is safe here
+                node_counts[node_indices] += 1
+
+                way_id = long(element_id.split(':')[-1])
+                node_indices.astype(numpy.int64).tofile(edges_nodes_file)
+                numpy.full(len(node_indices), way_id, dtype=numpy.int64).tofile(edges_ways_file)
+
+                props = {safe_decode(k): safe_decode(v) for k, v in six.iteritems(props)}
+                props['id'] = way_id
+                self.way_props.Put(safe_encode(way_id), json.dumps(props))
+
+            if i % 1000 == 0 and i > 0:
+                self.logger.info('doing {}s, at {}'.format(element_id.split(':')[0], i))
+            i += 1
+
+        node_props_file.close()
+        edges_nodes_file.close()
+        edges_ways_file.close()
+
+        if node_counts is None or os.path.getsize(edges_nodes_path) == 0:
+            return
+
+        edges_nodes = numpy.memmap(edges_nodes_path, dtype=numpy.int64, mode='r')
+        edges_ways = numpy.memmap(edges_ways_path, dtype=numpy.int64, mode='r')
+
+        intersection_edges = node_counts[edges_nodes] > 1
+        edges_nodes = edges_nodes[intersection_edges]
+        edges_ways = edges_ways[intersection_edges]
+        del intersection_edges
+
+        # Stable sort keeps the ways for each node in file order
+        indices = numpy.argsort(edges_nodes, kind='mergesort')
+        edges_nodes = edges_nodes[indices]
+        edges_ways = edges_ways[indices]
+        del indices
+
+        if not len(edges_nodes):
+            return
+
+        node_props = open(node_props_path, 'rb')
+
+        group_starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(edges_nodes)) + 1, [len(edges_nodes)]))
+
+        for i in xrange(len(group_starts) - 1):
+            start, end = group_starts[i], group_starts[i + 1]
+            node_index = edges_nodes[start]
+            node_id = node_ids[node_index]
+
+            # Only the properties of intersection candidates are read back
+            props_start = node_props_offsets[node_index]
+            node_props.seek(props_start)
+            props = json.loads(node_props.read(node_props_offsets[node_index + 1] - props_start))
+
+            ways = self.distinct_ways(edges_ways[start:end])
+
+            if i % 1000 == 0 and i > 0:
+                self.logger.info('checking intersections, did {}'.format(i))
+
+            if len(ways) > 1:
+                yield node_id, props, ways
+
+        node_props.close()
+
+    def create_intersections(self, outfile, single_pass=False):
         out = open(outfile, 'w')
-        for node_id, node_props, ways in self.intersections():
+        intersections = self.intersections_single_pass() if single_pass else self.intersections()
+        for node_id, node_props, ways in intersections:
             d = {'id': safe_encode(node_id),
                  'node': node_props,
                  'ways': ways}
@@ -181,9 +324,14 @@ if __name__ == '__main__':
                         required=True,
                         help='Output directory')
 
+    parser.add_argument('--single-pass',
+                        action='store_true',
+                        default=False,
+                        help='Read the input only once, counting node degrees on disk')
+
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
 
     reader = OSMIntersectionReader(args.input, args.db_dir)
-    reader.create_intersections(os.path.join(args.out_dir, DEFAULT_INTERSECTIONS_FILENAME))
+    reader.create_intersections(os.path.join(args.out_dir, DEFAULT_INTERSECTIONS_FILENAME), single_pass=args.single_pass)
@@ -0,0 +1,182 @@
+'''
+geodata.osm.node_locations
+--------------------------
+
+Node location stores for building polygons from ways on large OSM extracts.
+
+OSMPolygonReader by default keeps node ids and coordinates in typed arrays
+in RAM and copies the coordinates again for every way. With a node location
+store, ways only keep their node ids and coordinates are looked up lazily
+when the polygons are assembled, so each coordinate is stored once and
+(for the disk-backed stores) lives in the page cache rather than on the heap.
+
+SortedNodeLocations: sorted id array + coordinate array, binary search.
+                     Best for sparse extracts (admin boundaries, postal codes)
+                     where only a small fraction of planet node ids are used.
+                     Optionally streams to disk and memory-maps on lookup.
+
+DenseNodeLocations:  memory-mapped file indexed directly by node id with
+                     fixed-point int32 coordinates (8 bytes per id). The file
+                     is sparse on disk so only pages with nodes take up space.
+                     Best for dense extracts like buildings on planet.
+'''
+
+import array
+import numpy
+import os
+
+# OSM stores coordinates with 7 decimal places
+COORDINATE_PRECISION = 10 ** 7
+# Latitudes are stored shifted by this amount so they're never 0 (max 1.9e9 fits
+# in an int32), which means zeroed pages in the sparse file read as missing nodes
+LATITUDE_SHIFT = 10 ** 9
+
+
+class NodeLocations(object):
+    def add(self, node_id, lon, lat):
+        raise NotImplementedError('Children must implement')
+
+    def has_nodes(self, node_ids):
+        raise NotImplementedError('Children must implement')
+
+    def coordinates(self, node_ids):
+        '''
+        List of (lon, lat) tuples for node_ids, all of which must exist
+        '''
+        raise NotImplementedError('Children must implement')
+
+    def close(self):
+        pass
+
+
+class SortedNodeLocations(NodeLocations):
+    IDS_SUFFIX = '.ids'
+    COORDS_SUFFIX = '.coords'
+
+    # Flush to disk in chunks when file-backed
+    chunk_size = 1000000
+
+    def __init__(self, path=None):
+        '''
+        path: optional file prefix. If given, ids and coordinates are written
+              to disk as they're added and memory-mapped for lookups.
+        '''
+        self.path = path
+        self.ids = array.array('l')
+        self.coords = array.array('d')
+
+        self.node_ids = None
+        self.node_coords = None
+
+        if path is not None:
+            self.ids_file = open(path + self.IDS_SUFFIX, 'wb')
+            self.coords_file = open(path + self.COORDS_SUFFIX, 'wb')
+
+    def add(self, node_id, lon, lat):
+        if self.node_ids is not None:
+            raise ValueError('Nodes must be added in sorted order before any lookups')
+        self.ids.append(node_id)
+        self.coords.append(lon)
+        self.coords.append(lat)
+        if self.path is not None and len(self.ids) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.ids.tofile(self.ids_file)
+        self.coords.tofile(self.coords_file)
+        self.ids = array.array('l')
+        self.coords = array.array('d')
+
+    def finalize(self):
+        if self.path is None:
+            self.node_ids = numpy.frombuffer(self.ids, dtype=numpy.int64)
+            self.node_coords = numpy.frombuffer(self.coords, dtype=numpy.float64).reshape(-1, 2)
+            return
+
+        self.flush()
+        self.ids_file.close()
+        self.coords_file.close()
+
+        if os.path.getsize(self.path + self.IDS_SUFFIX) == 0:
+            self.node_ids = numpy.zeros(0, dtype=numpy.int64)
+            self.node_coords = numpy.zeros((0, 2), dtype=numpy.float64)
+        else:
+            self.node_ids = numpy.memmap(self.path + self.IDS_SUFFIX, dtype=numpy.int64, mode='r')
+            self.node_coords = numpy.memmap(self.path + self.COORDS_SUFFIX, dtype=numpy.float64, mode='r').reshape(-1, 2)
+
+    def indices(self, node_ids):
+        if self.node_ids is None:
+            self.finalize()
+        node_ids = numpy.asarray(node_ids, dtype=numpy.int64)
+        indices = numpy.searchsorted(self.node_ids, node_ids)
+        indices[indices >= len(self.node_ids)] = 0
+        found = len(self.node_ids) > 0 and self.node_ids[indices] == node_ids
+        return indices, found
+
+    def has_nodes(self, node_ids):
+        indices, found = self.indices(node_ids)
+        return bool(numpy.all(found))
+
+    def coordinates(self, node_ids):
+        indices, found = self.indices(node_ids)
+        coords = self.node_coords[indices]
+        return zip(coords[:, 0].tolist(), coords[:, 1].tolist())
+
+    def close(self):
+        self.node_ids = None
+        self.node_coords = None
+
+
+class DenseNodeLocations(NodeLocations):
+    # Node ids in the planet are currently around 10 billion
+    initial_size = 2 ** 24
+
+    def __init__(self, filename):
+        self.filename = filename
+        open(filename, 'wb').close()
+        self.size = 0
+        self.locations = None
+        self.resize(self.initial_size)
+
+    def resize(self, size):
+        # Extending the file with truncate leaves a hole, so unused ids take no disk space
+        f = open(self.filename, 'r+b')
+        f.truncate(size * 2 * numpy.dtype(numpy.int32).itemsize)
+        f.close()
+
+        if self.locations is not None:
+            self.locations.flush()
+            del self.locations
+
+        self.locations = numpy.memmap(self.filename, dtype=numpy.int32, mode='r+', shape=(size, 2))
+        self.size = size
+
+    def add(self, node_id, lon, lat):
+        if node_id >= self.size:
+            size = self.size
+            while node_id >= size:
+                size *= 2
+            self.resize(size)
+        self.locations[node_id] = (int(round(lon * COORDINATE_PRECISION)),
+                                   int(round(lat * COORDINATE_PRECISION)) + LATITUDE_SHIFT)
+
+    def lookup(self, node_ids):
+        node_ids = numpy.asarray(node_ids, dtype=numpy.int64)
+        if not len(node_ids) or node_ids.max() >= self.size or node_ids.min() < 0:
+            return None
+        return self.locations[node_ids]
+
+    def has_nodes(self, node_ids):
+        locations = self.lookup(node_ids)
+        return locations is not None and not numpy.any(locations[:, 1] == 0)
+
+    def coordinates(self, node_ids):
+        locations = self.lookup(node_ids)
+        lons = locations[:, 0].astype(numpy.float64) / COORDINATE_PRECISION
+        lats = (locations[:, 1] - LATITUDE_SHIFT).astype(numpy.float64) / COORDINATE_PRECISION
+        return zip(lons.tolist(), lats.tolist())
+
+    def close(self):
+        if self.locations is not None:
+            self.locations.flush()
+            self.locations = None
@@ -63,11 +63,16 @@ from geodata.coordinates.conversion import *
 from geodata.language_id.disambiguation import *
 from geodata.language_id.sample import sample_random_language
 from geodata.i18n.languages import *
+from geodata.instrumentation import Instrumentation
+from geodata.log import log_to_file
 from geodata.metro_stations.reverse_geocode import MetroStationReverseGeocoder
 from geodata.neighborhoods.reverse_geocode import NeighborhoodReverseGeocoder
 from geodata.osm.extract import *
 from geodata.osm.formatter import OSMAddressFormatter
 from geodata.places.reverse_geocode import PlaceReverseGeocoder
+from geodata.points.index import PointIndex
+from geodata.polygons.index import PolygonIndex
+from geodata.spatial_sort import SPATIAL_ORDERS
 from geodata.polygons.language_polys import *
 from geodata.polygons.reverse_geocode import *
 from geodata.i18n.unicode_paths import DATA_DIR
@@ -462,6 +467,21 @@ if __name__ == '__main__':
     parser.add_argument('-x', '--intersections-file',
                         help='Path to planet-ways-latlons.osm')
 
+    parser.add_argument('--sort-by-location',
+                        choices=SPATIAL_ORDERS,
+                        default=None,
+                        help='Sort formatted address inputs along a space-filling curve (in --temp-dir) before processing')
+
+    parser.add_argument('--instrument',
+                        action='store_true',
+                        default=False,
+                        help='Record per-stage counters and latencies for the reverse geocoding indices')
+
+    parser.add_argument('--instrument-log-interval',
+                        type=float,
+                        default=Instrumentation.log_interval,
+                        help='Seconds between instrumentation summaries in the log')
+
     parser.add_argument('--country-rtree-dir',
                         required=True,
                         help='Country RTree directory')
@@ -496,6 +516,12 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
+    if args.instrument:
+        log_to_file(sys.stderr)
+        PolygonIndex.instrument = True
+        PointIndex.instrument = True
+        Instrumentation.log_interval = args.instrument_log_interval
+
     country_rtree = OSMCountryReverseGeocoder.load(args.country_rtree_dir)
 
     osm_rtree = None
@@ -522,6 +548,9 @@ if __name__ == '__main__':
     if args.buildings_rtree_dir:
         buildings_rtree = OSMBuildingReverseGeocoder.load(args.buildings_rtree_dir)
 
+    OSMAddressFormatter.spatial_order = args.sort_by_location
+    OSMAddressFormatter.spatial_sort_dir = args.temp_dir
+
     # Can parallelize
     if args.streets_file and not args.format:
         build_ways_training_data(country_rtree, args.streets_file, args.out_dir, abbreviate_streets=not args.unabbreviated)
@@ -561,3 +590,18 @@ if __name__ == '__main__':
         components = AddressComponents(osm_rtree, neighborhoods_rtree, places_index)
         osm_formatter = OSMAddressFormatter(components, country_rtree, subdivisions_rtree, buildings_rtree, metro_stations_index)
         osm_formatter.build_ways_training_data(args.streets_file, args.out_dir, tag_components=not args.untagged)
+
+    for name, rtree in (('country', country_rtree), ('admin', osm_rtree), ('neighborhoods', neighborhoods_rtree), ('subdivisions', subdivisions_rtree), ('buildings', buildings_rtree)):
+        if rtree is not None and rtree.cache_stats() is not None:
+            print('{} polygon cache ({}): {}'.format(name, args.sort_by_location or 'input order', rtree.cache_stats()))
+        if rtree is not None and rtree.interior_cells is not None:
+            print('{} containment cells: {}'.format(name, rtree.containment_cache_stats()))
+        if rtree is not None and rtree.properties_store is not None:
+            print('{} properties cache: {}'.format(name, rtree.properties_store.cache_stats()))
+
+    if args.instrument:
+        for name, index in (('country', country_rtree), ('admin', osm_rtree), ('neighborhoods', neighborhoods_rtree),
+                            ('subdivisions', subdivisions_rtree), ('buildings', buildings_rtree),
+                            ('places', places_index), ('metro_stations', metro_stations_index)):
+            if index is not None:
+                print('{} stats: {}'.format(name, json.dumps(index.stats())))
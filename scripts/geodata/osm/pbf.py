@@ -0,0 +1,416 @@
+'''
+geodata.osm.pbf
+---------------
+
+Streaming reader for OSM .pbf files with the same output as parse_osm on
+.osm XML, i.e. tuples of (element_id, props, deps).
+
+The protobuf wire format is decoded directly (no generated classes needed),
+and the zlib-compressed data blocks are decompressed and decoded in a pool
+of worker processes while the main process reads the file. Elements of
+disallowed types are dropped inside the workers before anything is sent
+back.
+
+For files produced with osmconvert --all-to-nodes, ways and relations are
+stored as nodes with ids offset by WAY_OFFSET/RELATION_OFFSET, and those are
+converted back to ways/relations the same way as in parse_osm.
+
+Reference: https://wiki.openstreetmap.org/wiki/PBF_Format
+'''
+
+import multiprocessing
+import six
+import struct
+import zlib
+
+from collections import OrderedDict, deque
+
+from geodata.encoding import safe_encode
+from geodata.osm.extract import NODE, WAY, RELATION, ALL_OSM_TAGS, osm_type_and_id
+
+OSM_DATA_BLOB = b'OSMData'
+
+MEMBER_TYPES = (NODE, WAY, RELATION)
+
+# Blocks in flight per worker
+PENDING_BLOCKS_PER_WORKER = 4
+
+# Field numbers from osmformat.proto / fileformat.proto
+BLOB_HEADER_TYPE = 1
+BLOB_HEADER_DATASIZE = 3
+
+BLOB_RAW = 1
+BLOB_ZLIB_DATA = 3
+
+PRIMITIVE_BLOCK_STRINGTABLE = 1
+PRIMITIVE_BLOCK_GROUP = 2
+PRIMITIVE_BLOCK_GRANULARITY = 17
+PRIMITIVE_BLOCK_LAT_OFFSET = 19
+PRIMITIVE_BLOCK_LON_OFFSET = 20
+
+STRINGTABLE_S = 1
+
+GROUP_NODES = 1
+GROUP_DENSE = 2
+GROUP_WAYS = 3
+GROUP_RELATIONS = 4
+
+ELEMENT_ID = 1
+ELEMENT_KEYS = 2
+ELEMENT_VALS = 3
+NODE_LAT = 8
+NODE_LON = 9
+
+DENSE_ID = 1
+DENSE_LAT = 8
+DENSE_LON = 9
+DENSE_KEYS_VALS = 10
+
+WAY_REFS = 8
+
+RELATION_ROLES_SID = 8
+RELATION_MEMIDS = 9
+RELATION_TYPES = 10
+
+DEFAULT_GRANULARITY = 100
+
+
+def read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def signed64(n):
+    return n - (1 << 64) if n >= (1 << 63) else n
+
+
+def iter_fields(buf, pos, end):
+    '''
+    Iterate over the fields of a protobuf message in buf[pos:end], yielding
+    (field_number, wire_type, value) where value is an int for varints and
+    a (start, end) tuple for length-delimited fields.
+    '''
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = read_varint(buf, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire_type == 1:
+            value = (pos, pos + 8)
+            pos += 8
+        elif wire_type == 5:
+            value = (pos, pos + 4)
+            pos += 4
+        else:
+            raise ValueError('Unsupported protobuf wire type: {}'.format(wire_type))
+        yield field, wire_type, value
+
+
+def read_packed(buf, wire_type, value):
+    '''
+    Packed repeated varints, also accepts the unpacked encoding
+    '''
+    if wire_type == 0:
+        return [value]
+    pos, end = value
+    values = []
+    while pos < end:
+        v, pos = read_varint(buf, pos)
+        values.append(v)
+    return values
+
+
+def delta_decode(values):
+    total = 0
+    decoded = []
+    for v in values:
+        total += zigzag(v)
+        decoded.append(total)
+    return decoded
+
+
+def read_blobs(f):
+    '''
+    Generator of the raw (still compressed) OSMData blobs in a .pbf file
+    '''
+    while True:
+        header_size = f.read(4)
+        if len(header_size) < 4:
+            return
+        header_size = struct.unpack('!i', header_size)[0]
+        header = bytearray(f.read(header_size))
+
+        blob_type = None
+        data_size = 0
+
+        for field, wire_type, value in iter_fields(header, 0, len(header)):
+            if field == BLOB_HEADER_TYPE:
+                blob_type = bytes(header[value[0]:value[1]])
+            elif field == BLOB_HEADER_DATASIZE:
+                data_size = value
+
+        data = f.read(data_size)
+        if blob_type == OSM_DATA_BLOB:
+            yield data
+
+
+def blob_data(blob):
+    buf = bytearray(blob)
+    for field, wire_type, value in iter_fields(buf, 0, len(buf)):
+        if field == BLOB_RAW:
+            return bytearray(buf[value[0]:value[1]])
+        elif field == BLOB_ZLIB_DATA:
+            return bytearray(zlib.decompress(bytes(buf[value[0]:value[1]])))
+    raise ValueError('Unsupported blob compression, only raw and zlib are supported')
+
+
+class PrimitiveBlockDecoder(object):
+    '''
+    Decodes one PrimitiveBlock into a list of tuples like:
+
+    (item_type, element_id, lat, lon, [(key, value), ...], deps)
+
+    lat/lon are None for ways and relations.
+    '''
+    def __init__(self, buf, allowed_types, dependencies=False):
+        self.buf = buf
+        self.allowed_types = allowed_types
+        self.dependencies = dependencies
+
+        self.strings = []
+        self.granularity = DEFAULT_GRANULARITY
+        self.lat_offset = 0
+        self.lon_offset = 0
+
+        self.elements = []
+
+    def string(self, i):
+        return self.strings[i].decode('utf-8')
+
+    def tags(self, keys, vals):
+        return [(self.string(k), self.string(v)) for k, v in six.moves.zip(keys, vals)]
+
+    def coordinate(self, offset, value):
+        return 1e-9 * (offset + self.granularity * value)
+
+    def add_element(self, item_type, elem_id, lat, lon, keys, vals, deps):
+        if item_type == NODE:
+            item_type, elem_id = osm_type_and_id(elem_id)
+        if item_type in self.allowed_types:
+            self.elements.append((item_type, elem_id, lat, lon, self.tags(keys, vals), deps))
+
+    def decode(self):
+        buf = self.buf
+        groups = []
+        for field, wire_type, value in iter_fields(buf, 0, len(buf)):
+            if field == PRIMITIVE_BLOCK_STRINGTABLE:
+                self.strings = [bytes(buf[v[0]:v[1]]) for f, w, v in iter_fields(buf, value[0], value[1])
+                                if f == STRINGTABLE_S]
+            elif field == PRIMITIVE_BLOCK_GROUP:
+                groups.append(value)
+            elif field == PRIMITIVE_BLOCK_GRANULARITY:
+                self.granularity = value
+            elif field == PRIMITIVE_BLOCK_LAT_OFFSET:
+                self.lat_offset = signed64(value)
+            elif field == PRIMITIVE_BLOCK_LON_OFFSET:
+                self.lon_offset = signed64(value)
+
+        for start, end in groups:
+            for field, wire_type, value in iter_fields(buf, start, end):
+                if field == GROUP_NODES:
+                    self.decode_node(*value)
+                elif field == GROUP_DENSE:
+                    self.decode_dense_nodes(*value)
+                elif field == GROUP_WAYS and WAY in self.allowed_types:
+                    self.decode_way(*value)
+                elif field == GROUP_RELATIONS and RELATION in self.allowed_types:
+                    self.decode_relation(*value)
+
+        return self.elements
+
+    def decode_node(self, start, end):
+        buf = self.buf
+        elem_id = lat = lon = 0
+        keys = []
+        vals = []
+        for field, wire_type, value in iter_fields(buf, start, end):
+            if field == ELEMENT_ID:
+                elem_id = zigzag(value)
+            elif field == ELEMENT_KEYS:
+                keys = read_packed(buf, wire_type, value)
+            elif field == ELEMENT_VALS:
+                vals = read_packed(buf, wire_type, value)
+            elif field == NODE_LAT:
+                lat = zigzag(value)
+            elif field == NODE_LON:
+                lon = zigzag(value)
+
+        self.add_element(NODE, elem_id, self.coordinate(self.lat_offset, lat),
+                         self.coordinate(self.lon_offset, lon),
+                         keys, vals, None)
+
+    def decode_dense_nodes(self, start, end):
+        buf = self.buf
+        ids = lats = lons = keys_vals = []
+        for field, wire_type, value in iter_fields(buf, start, end):
+            if field == DENSE_ID:
+                ids = delta_decode(read_packed(buf, wire_type, value))
+            elif field == DENSE_LAT:
+                lats = delta_decode(read_packed(buf, wire_type, value))
+            elif field == DENSE_LON:
+                lons = delta_decode(read_packed(buf, wire_type, value))
+            elif field == DENSE_KEYS_VALS:
+                keys_vals = read_packed(buf, wire_type, value)
+
+        # keys_vals is ((key, val)*, 0) for each node, or empty if no node has tags
+        kv = 0
+        num_keys_vals = len(keys_vals)
+        for i, elem_id in enumerate(ids):
+            tag_start = kv
+            while kv < num_keys_vals and keys_vals[kv] != 0:
+                kv += 2
+            tag_end = kv
+            kv += 1
+
+            self.add_element(NODE, elem_id, self.coordinate(self.lat_offset, lats[i]),
+                             self.coordinate(self.lon_offset, lons[i]),
+                             keys_vals[tag_start:tag_end:2], keys_vals[tag_start + 1:tag_end:2],
+                             None)
+
+    def decode_way(self, start, end):
+        buf = self.buf
+        elem_id = 0
+        keys = []
+        vals = []
+        refs = None
+        for field, wire_type, value in iter_fields(buf, start, end):
+            if field == ELEMENT_ID:
+                elem_id = value
+            elif field == ELEMENT_KEYS:
+                keys = read_packed(buf, wire_type, value)
+            elif field == ELEMENT_VALS:
+                vals = read_packed(buf, wire_type, value)
+            elif field == WAY_REFS and self.dependencies:
+                refs = delta_decode(read_packed(buf, wire_type, value))
+
+        if self.dependencies and refs is None:
+            refs = []
+
+        self.add_element(WAY, elem_id, None, None, keys, vals, refs)
+
+    def decode_relation(self, start, end):
+        buf = self.buf
+        elem_id = 0
+        keys = []
+        vals = []
+        roles = []
+        memids = []
+        types = []
+        for field, wire_type, value in iter_fields(buf, start, end):
+            if field == ELEMENT_ID:
+                elem_id = value
+            elif field == ELEMENT_KEYS:
+                keys = read_packed(buf, wire_type, value)
+            elif field == ELEMENT_VALS:
+                vals = read_packed(buf, wire_type, value)
+            elif self.dependencies:
+                if field == RELATION_ROLES_SID:
+                    roles = read_packed(buf, wire_type, value)
+                elif field == RELATION_MEMIDS:
+                    memids = delta_decode(read_packed(buf, wire_type, value))
+                elif field == RELATION_TYPES:
+                    types = read_packed(buf, wire_type, value)
+
+        deps = None
+        if self.dependencies:
+            deps = [(ref, MEMBER_TYPES[member_type], self.string(role))
+                    for ref, member_type, role in six.moves.zip(memids, types, roles)]
+
+        self.add_element(RELATION, elem_id, None, None, keys, vals, deps)
+
+
+def decode_blob(args):
+    blob, allowed_types, dependencies = args
+    return PrimitiveBlockDecoder(blob_data(blob), allowed_types,
+                                 dependencies=dependencies).decode()
+
+
+def decoded_blocks(f, allowed_types, dependencies=False, workers=None):
+    '''
+    Generator of decoded blocks in file order. With more than one worker,
+    blocks are decoded in a process pool with a bounded number in flight
+    so the file is never read far ahead of the consumer.
+    '''
+    blobs = ((blob, allowed_types, dependencies) for blob in read_blobs(f))
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if workers <= 1:
+        for args in blobs:
+            yield decode_blob(args)
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = deque()
+        max_pending = workers * PENDING_BLOCKS_PER_WORKER
+        for args in blobs:
+            pending.append(pool.apply_async(decode_blob, (args,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def parse_pbf(filename, allowed_types=ALL_OSM_TAGS, dependencies=False, workers=None):
+    '''
+    Parse a file in .pbf format iteratively, generating the same tuples as
+    geodata.osm.extract.parse_osm.
+
+    workers: number of decoding processes (defaults to the number of CPUs)
+    '''
+    single_type = len(allowed_types) == 1
+
+    f = open(filename, 'rb')
+
+    for elements in decoded_blocks(f, frozenset(allowed_types), dependencies=dependencies, workers=workers):
+        for item_type, elem_id, lat, lon, tags, deps in elements:
+            attrs = OrderedDict()
+            if lat is not None:
+                attrs['lat'] = '{:.7f}'.format(lat)
+                attrs['lon'] = '{:.7f}'.format(lon)
+            attrs['type'] = item_type
+            attrs['id'] = safe_encode(elem_id)
+
+            for k, v in tags:
+                # Prevent user-defined lat/lon keys from overriding the lat/lon on the node
+                if k not in attrs:
+                    attrs[k] = v
+
+            if dependencies and deps is None:
+                deps = []
+
+            key = elem_id if single_type else '{}:{}'.format(item_type, elem_id)
+            yield key, attrs, deps
+
+    f.close()
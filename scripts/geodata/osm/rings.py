@@ -0,0 +1,135 @@
+'''
+rings.py
+--------
+
+Ring assembly for OSM multipolygons. A relation's outer (or inner) ring is
+stored as an unordered set of ways, each of which may run in either
+direction, and consecutive ways share an end node.
+
+chain_ways links the ways into rings by looking up end nodes in a hash
+table, so each way is visited once regardless of how many ways the
+relation has (coastlines and large countries have thousands).
+ring_coordinates then writes a ring's coordinates into a preallocated
+flat array, copying reversed ways back to front with strided slices rather
+than building reversed lists of tuples.
+'''
+
+import array
+
+from collections import defaultdict, deque
+
+
+def chain_ways(endpoints):
+    '''
+    endpoints: list of (start_node_id, end_node_id) for each way
+
+    Returns a list of (closed, chain) where chain is a list of
+    (way_index, reverse) in ring order. Ways which can't be closed into a
+    ring (missing members, branching at a node) are returned as open chains
+    extended as far as possible in both directions.
+    '''
+    end_nodes = defaultdict(list)
+    for k, (start, end) in enumerate(endpoints):
+        end_nodes[start].append(k)
+        if end != start:
+            end_nodes[end].append(k)
+
+    used = [False] * len(endpoints)
+
+    def next_way(node):
+        # Pop used ways off the node's list as we go so each list
+        # is scanned once in total
+        ways = end_nodes.get(node)
+        while ways:
+            k = ways.pop()
+            if not used[k]:
+                return k
+        return None
+
+    chains = []
+
+    for first in xrange(len(endpoints)):
+        if used[first]:
+            continue
+        used[first] = True
+
+        chain = deque([(first, False)])
+        head, tail = endpoints[first]
+
+        # Extend forward from the tail
+        while tail != head:
+            k = next_way(tail)
+            if k is None:
+                break
+            used[k] = True
+            start, end = endpoints[k]
+            if start == tail:
+                chain.append((k, False))
+                tail = end
+            else:
+                chain.append((k, True))
+                tail = start
+
+        closed = tail == head
+
+        # Dead end, extend backward from the head as well
+        while not closed:
+            k = next_way(head)
+            if k is None:
+                break
+            used[k] = True
+            start, end = endpoints[k]
+            if end == head:
+                chain.appendleft((k, False))
+                head = start
+            else:
+                chain.appendleft((k, True))
+                head = end
+            closed = tail == head
+
+        chains.append((closed, list(chain)))
+
+    return chains
+
+
+def ring_coordinates(chain, way_coordinates, closed=True):
+    '''
+    Flat [x0, y0, x1, y1, ...] array of coordinates for a chain of ways.
+
+    way_coordinates: function from way index to (coords, start, end) where
+                     coords is a flat array of coordinate pairs and the way's
+                     nodes are pairs [start, end)
+
+    The shared node between consecutive ways is written once. The ring is
+    not explicitly closed (the first node isn't repeated at the end), open
+    chains keep their final node.
+    '''
+    ways = [way_coordinates(k) + (reverse,) for k, reverse in chain]
+
+    n = sum((end - start - 1 for coords, start, end, reverse in ways))
+    if not closed and ways:
+        n += 1
+
+    ring = array.array('d', [0.0]) * (2 * n)
+
+    i = 0
+    for coords, start, end, reverse in ways:
+        # Each way contributes all of its nodes but the last in ring order
+        m = 2 * (end - start - 1)
+        if m <= 0:
+            continue
+        if not reverse:
+            ring[i:i + m] = coords[2 * start:2 * (end - 1)]
+        else:
+            # Nodes end - 1 down to start + 1, x and y written separately
+            ring[i:i + m:2] = coords[2 * (end - 1):2 * start:-2]
+            ring[i + 1:i + m:2] = coords[2 * (end - 1) + 1:2 * start + 1:-2]
+        i += m
+
+    if not closed and ways:
+        coords, start, end, reverse = ways[-1]
+        last = start if reverse else end - 1
+        ring[i] = coords[2 * last]
+        ring[i + 1] = coords[2 * last + 1]
+
+    return ring
@@ -4,7 +4,7 @@ import six
 from collections import defaultdict, Counter
 from itertools import izip, islice
 
-from geodata.text.tokenize import tokenize, token_types
+from geodata.text.tokenize import tokenize, tokenize_many, token_types
 from geodata.encoding import safe_encode
 
 
@@ -19,6 +19,9 @@ class FrequentPhraseExtractor(object):
                         token_types.HANGUL_SYLLABLE,
                         token_types.ACRONYM)
 
+    # Number of lines per call to the tokenizer
+    batch_size = 1000
+
     def __init__(self, min_count=5):
         self.min_count = min_count
 
@@ -30,18 +33,35 @@ class FrequentPhraseExtractor(object):
         for t in izip(*(islice(words, i, None) for i in xrange(n))):
             yield t
 
+    def tokenized_lines(self, f):
+        '''Tokenizes the non-empty lines of f in batches'''
+        batch = []
+        for line in f:
+            line = line.rstrip()
+            if not line:
+                continue
+            batch.append(line)
+            if len(batch) >= self.batch_size:
+                for tokens in tokenize_many(batch):
+                    yield tokens
+                batch = []
+
+        if batch:
+            for tokens in tokenize_many(batch):
+                yield tokens
+
     def add_tokens(self, s):
-        for t, c in tokenize(s):
+        self.add_token_list(tokenize(s))
+
+    def add_token_list(self, tokens):
+        for t, c in tokens:
             if c in self.WORD_TOKEN_TYPES:
                 self.vocab[((t.lower(), c), )] += 1
                 self.train_words += 1
 
     def create_vocab(self, f):
-        for line in f:
-            line = line.rstrip()
-            if not line:
-                continue
-            self.add_tokens(line)
+        for tokens in self.tokenized_lines(f):
+            self.add_token_list(tokens)
         self.prune_vocab()
 
     def prune_vocab(self):
@@ -50,9 +70,12 @@ class FrequentPhraseExtractor(object):
                 del self.vocab[k]
 
     def add_ngrams(self, s, n=2):
+        self.add_ngram_tokens(tokenize(s), n=n)
+
+    def add_ngram_tokens(self, tokens, n=2):
         sequences = []
         seq = []
-        for t, c in tokenize(s):
+        for t, c in tokens:
             if c in self.WORD_TOKEN_TYPES:
                 seq.append((t, c))
             elif seq:
@@ -81,11 +104,8 @@ class FrequentPhraseExtractor(object):
 
     def find_ngram_phrases(self, f, n=2):
         self.frequencies = defaultdict(int)
-        for line in f:
-            line = line.rstrip()
-            if not line:
-                continue
-            self.add_ngrams(line, n=n)
+        for tokens in self.tokenized_lines(f):
+            self.add_ngram_tokens(tokens, n=n)
         self.add_frequent_ngrams_to_vocab()
         self.frequencies = defaultdict(int)
 
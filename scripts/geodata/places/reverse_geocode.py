@@ -12,6 +12,7 @@ from geodata.coordinates.conversion import latlon_to_decimal
 from geodata.math.floats import isclose
 from geodata.osm.extract import parse_osm
 from geodata.points.index import PointIndex
+from geodata.points.kdtree import KDTreePointIndex
 from geodata.encoding import safe_decode
 
 
@@ -90,6 +91,11 @@ class PlaceReverseGeocoder(PointIndex):
 
         return index
 
+
+class KDTreePlaceReverseGeocoder(KDTreePointIndex, PlaceReverseGeocoder):
+    pass
+
+
 if __name__ == '__main__':
     # Handle argument parsing here
     parser = argparse.ArgumentParser()
@@ -102,6 +108,16 @@ if __name__ == '__main__':
                         default=PlaceReverseGeocoder.GEOHASH_PRECISION,
                         help='Geohash precision')
 
+    parser.add_argument('--kdtree',
+                        action='store_true',
+                        default=False,
+                        help='Use a KD-tree index instead of geohash cells')
+
+    parser.add_argument('--mmap-properties',
+                        action='store_true',
+                        default=False,
+                        help='Store properties in a memory-mapped store with lazy field decoding instead of JSON in LevelDB')
+
     parser.add_argument('-o', '--out-dir',
                         default=os.getcwd(),
                         help='Output directory')
@@ -109,8 +125,11 @@ if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
 
     args = parser.parse_args()
+    if args.mmap_properties:
+        PointIndex.mmap_properties = True
     if args.osm_places_file:
-        index = PlaceReverseGeocoder.create_from_osm_file(args.osm_places_file, args.out_dir, precision=args.precision)
+        index_class = KDTreePlaceReverseGeocoder if args.kdtree else PlaceReverseGeocoder
+        index = index_class.create_from_osm_file(args.osm_places_file, args.out_dir, precision=args.precision)
     else:
         parser.error('Must specify places file')
 
@@ -2,6 +2,7 @@ import array
 import geohash
 import os
 import math
+import numpy
 import operator
 import six
 import ujson as json
@@ -10,20 +11,40 @@ from collections import defaultdict, OrderedDict
 
 from leveldb import LevelDB
 
-from geodata.distance.haversine import haversine_distance
+from geodata.distance.haversine import haversine_distances
+from geodata.geohash_index import GeohashIndex, mmap_array
+from geodata.instrumentation import Instrumentation, TimedDB
+from geodata.properties_store import PropertiesStore
 
 
 class PointIndex(object):
     include_only_properties = None
     persistent_index = False
     cache_size = 0
+    # Store properties in a memory-mapped store with lazy per-field decoding
+    # instead of a JSON blob per point in LevelDB
+    mmap_properties = False
+    # Record counters and per-stage latency histograms for lookups, see
+    # geodata.instrumentation and stats()
+    instrument = False
+
+    # Looked up on the instance so instrument_lookups can time JSON decoding
+    json_loads = staticmethod(json.loads)
 
     POINTS_DB_DIR = 'points'
+    PROPERTIES_STORE_DIR = 'properties_store'
 
     GEOHASH_PRECISION = 7
     PROPS_FILENAME = 'properties.json'
-    POINTS_FILENAME = 'points.json'
-    INDEX_FILENAME = 'index.json'
+    POINTS_FILENAME = 'points.bin'
+    INDEX_FILENAME = 'index'
+
+    # Saved with the properties so load can tell which backend built an index
+    BACKEND = 'geohash'
+
+    # Pre-binary formats, still readable by load_index/load_points
+    JSON_POINTS_FILENAME = 'points.json'
+    JSON_INDEX_FILENAME = 'index.json'
 
     def __init__(self, index=None, save_dir=None,
                  points=None,
@@ -31,6 +52,7 @@ class PointIndex(object):
                  points_db=None,
                  points_db_path=None,
                  index_path=None,
+                 properties_store=None,
                  include_only_properties=None,
                  precision=GEOHASH_PRECISION):
         if save_dir:
@@ -55,7 +77,8 @@ class PointIndex(object):
             points_path = os.path.join(save_dir or '.', self.POINTS_FILENAME)
         self.points_path = points_path
 
-        if not points:
+        building = points is None
+        if building:
             self.points = array.array('d')
         else:
             self.points = points
@@ -68,15 +91,59 @@ class PointIndex(object):
         else:
             self.points_db = points_db
 
+        if properties_store is not None:
+            self.properties_store = properties_store
+        elif building and self.mmap_properties:
+            self.properties_store = PropertiesStore(os.path.join(save_dir or '.', self.PROPERTIES_STORE_DIR))
+        else:
+            self.properties_store = None
+
         self.precision = precision
 
         self.i = 0
 
+        self._points_view = None
+
+        self.instrumentation = None
+        if self.instrument:
+            self.instrument_lookups()
+
+    def instrument_lookups(self):
+        self.instrumentation = Instrumentation(self.__class__.__name__, counters=self.cache_counters)
+        self.instrumentation.instrument_methods(self, {
+            'candidate_ids': ('candidates', None, True),
+            'candidate_distances': ('distances', None, False),
+            'nearest_n': ('nearest_n', None, True),
+            'get_properties': ('properties', None, False),
+            'json_loads': ('json_loads', None, False),
+        }, periodic=('nearest_points', 'nearest_n_points', 'nearest_point'))
+        self.points_db = TimedDB(self.points_db, self.instrumentation, 'leveldb_get')
+
+    def cache_counters(self):
+        if self.properties_store is None:
+            return {}
+        return {'properties_cache_hits': self.properties_store.cache_hits,
+                'properties_cache_misses': self.properties_store.cache_misses}
+
+    def stats(self):
+        '''
+        Properties cache hit rate, plus counters and per-stage latencies if
+        the index is instrumented
+        '''
+        stats = {}
+        if self.properties_store is not None:
+            stats['properties_cache'] = self.properties_store.cache_stats()
+        if self.instrumentation is not None:
+            stats.update(self.instrumentation.stats())
+        return stats
+
     def index_point(self, lat, lon):
         code = geohash.encode(lat, lon)[:self.precision]
 
         for key in [code] + geohash.neighbors(code):
             self.index[key].append(self.i)
+        # Drop the NumPy view before the array is resized under it
+        self._points_view = None
         self.points.extend([lat, lon])
 
     def add_point(self, lat, lon, properties, cache=False, include_only_properties=None):
@@ -86,7 +153,10 @@ class PointIndex(object):
             properties = {k: v for k, v in properties.iteritems() if k in include_only_properties}
 
         self.index_point(lat, lon)
-        self.points_db.Put(self.properties_key(self.i), json.dumps(properties))
+        if self.properties_store is not None:
+            self.properties_store.add(self.i, properties)
+        else:
+            self.points_db.Put(self.properties_key(self.i), json.dumps(properties))
         self.i += 1
 
     def load_properties(self, filename):
@@ -97,29 +167,43 @@ class PointIndex(object):
     def save_properties(self, out_filename):
         out = open(out_filename, 'w')
         json.dump({'num_points': str(self.i),
-                  'precision': self.precision}, out)
+                  'precision': self.precision,
+                  'backend': self.BACKEND}, out)
 
     def save_index(self):
         if not self.index_path:
             self.index_path = os.path.join(self.save_dir or '.', self.INDEX_FILENAME)
-        json.dump(self.index, open(self.index_path, 'w'))
+        GeohashIndex.from_dict(self.index).save(self.index_path)
 
     @classmethod
     def load_index(cls, d, index_name=None):
-        return json.load(open(os.path.join(d, index_name or cls.INDEX_FILENAME)))
+        index_path = os.path.join(d, index_name or cls.INDEX_FILENAME)
+        if GeohashIndex.exists(index_path):
+            return GeohashIndex.load(index_path)
+        # Legacy JSON index, saved under index_name if one was given
+        if index_name and index_name != cls.INDEX_FILENAME:
+            return json.load(open(index_path))
+        return json.load(open(os.path.join(d, cls.JSON_INDEX_FILENAME)))
 
     def save_points(self):
-        json.dump(self.points, open(self.points_path, 'w'))
+        f = open(self.points_path, 'wb')
+        numpy.asarray(self.points, dtype=numpy.float64).tofile(f)
+        f.close()
 
     @classmethod
     def load_points(cls, d):
-        return array.array('d', json.load(open(os.path.join(d, cls.POINTS_FILENAME))))
+        points_path = os.path.join(d, cls.POINTS_FILENAME)
+        if os.path.exists(points_path):
+            return mmap_array(points_path, numpy.float64)
+        return array.array('d', json.load(open(os.path.join(d, cls.JSON_POINTS_FILENAME))))
 
     def properties_key(self, i):
         return 'props:{}'.format(i)
 
     def get_properties(self, i):
-        return json.loads(self.points_db.Get(self.properties_key(i)))
+        if self.properties_store is not None:
+            return self.properties_store.get(i)
+        return self.json_loads(self.points_db.Get(self.properties_key(i)))
 
     def compact_points_db(self):
         self.points_db.CompactRange('\x00', '\xff')
@@ -128,14 +212,45 @@ class PointIndex(object):
         self.save_index()
         self.save_points()
         self.compact_points_db()
+        if self.properties_store is not None:
+            self.properties_store.save()
         self.save_properties(os.path.join(self.save_dir, self.PROPS_FILENAME))
 
+    @classmethod
+    def saved_backend(cls, d):
+        props_path = os.path.join(d, cls.PROPS_FILENAME)
+        if not os.path.exists(props_path):
+            return PointIndex.BACKEND
+        # Indices saved before the backend was recorded are all geohash
+        return json.load(open(props_path)).get('backend', PointIndex.BACKEND)
+
+    @classmethod
+    def backend_class(cls, backend):
+        '''
+        cls if it uses backend, otherwise its counterpart for that backend,
+        e.g. KDTreePlaceReverseGeocoder for PlaceReverseGeocoder and vice versa
+        '''
+        for c in [cls] + list(cls.__bases__) + cls.__subclasses__():
+            if issubclass(c, PointIndex) and c.BACKEND == backend:
+                return c
+        raise ValueError('No {} backend for {}'.format(backend, cls.__name__))
+
     @classmethod
     def load(cls, d):
+        backend = cls.saved_backend(d)
+        if backend != cls.BACKEND:
+            return cls.backend_class(backend).load(d)
+
         index = cls.load_index(d)
         points = cls.load_points(d)
         points_db = LevelDB(os.path.join(d, cls.POINTS_DB_DIR))
-        point_index = cls(index=index, points=points, points_db=points_db)
+        properties_store_dir = os.path.join(d, cls.PROPERTIES_STORE_DIR)
+        if PropertiesStore.exists(properties_store_dir):
+            properties_store = PropertiesStore.load(properties_store_dir)
+        else:
+            properties_store = None
+        point_index = cls(index=index, points=points, points_db=points_db,
+                          properties_store=properties_store)
         point_index.load_properties(os.path.join(d, cls.PROPS_FILENAME))
         return point_index
 
@@ -147,31 +262,88 @@ class PointIndex(object):
     def __len__(self):
         return self.i
 
-    def get_candidate_points(self, latitude, longitude):
-        code = geohash.encode(latitude, longitude)[:self.precision]
-        candidates = OrderedDict()
+    def points_view(self):
+        '''
+        (num_points, 2) NumPy array of lat, lon sharing memory with self.points
+        '''
+        if self._points_view is None:
+            if len(self.points) == 0:
+                self._points_view = numpy.zeros((0, 2), dtype=numpy.float64)
+            elif isinstance(self.points, numpy.ndarray):
+                # Memory-mapped points from load_points
+                self._points_view = self.points.reshape(-1, 2)
+            else:
+                self._points_view = numpy.frombuffer(self.points, dtype=numpy.float64).reshape(-1, 2)
+        return self._points_view
+
+    def candidate_ids(self, latitude, longitude):
+        return self.cell_candidate_ids(geohash.encode(latitude, longitude)[:self.precision])
+
+    def cell_candidate_ids(self, code):
+        '''
+        Ids of the points in geohash cell code and its neighbors, which are
+        the candidates for any point in the cell
+        '''
+        keys = [code] + geohash.neighbors(code)
+        if isinstance(self.index, GeohashIndex):
+            # Slices of the mapped id array, no intermediate lists
+            ids = numpy.concatenate([self.index.get_array(key) for key in keys]).astype(numpy.int64)
+        else:
+            ids = []
+            for key in keys:
+                ids.extend(self.index.get(key, []))
+            ids = numpy.array(ids, dtype=numpy.int64)
 
-        candidates.update([(k, None) for k in self.index.get(code, [])])
+        if not len(ids):
+            return numpy.zeros(0, dtype=numpy.int64)
 
-        for neighbor in geohash.neighbors(code):
-            candidates.update([(k, None) for k in self.index.get(neighbor, [])])
+        # Deduplicate, keeping the order in which the ids were first seen
+        ids, first_index = numpy.unique(ids, return_index=True)
+        return ids[numpy.argsort(first_index)]
 
-        return candidates.keys()
+    def get_candidate_points(self, latitude, longitude):
+        return self.candidate_ids(latitude, longitude).tolist()
+
+    def candidate_distances(self, latitude, longitude):
+        '''
+        Arrays of candidate ids, latitudes, longitudes and distances (km)
+        '''
+        ids = self.candidate_ids(latitude, longitude)
+        points = self.points_view()[ids]
+        lats = points[:, 0]
+        lons = points[:, 1]
+        return ids, lats, lons, haversine_distances(latitude, longitude, lats, lons)
+
+    def results(self, ids, lats, lons, distances, order=None):
+        if order is not None:
+            ids, lats, lons, distances = ids[order], lats[order], lons[order], distances[order]
+        return zip(ids.tolist(), lats.tolist(), lons.tolist(), distances.tolist())
 
     def point_distances(self, latitude, longitude):
-        candidates = self.get_candidate_points(latitude, longitude)
-
-        return [(i, self.points[i * 2], self.points[i * 2 + 1],
-                 haversine_distance(latitude, longitude,
-                                    self.points[i * 2],
-                                    self.points[i * 2 + 1]))
-                for i in candidates]
+        return self.results(*self.candidate_distances(latitude, longitude))
 
     def all_nearby_points(self, latitude, longitude):
-        distances = self.point_distances(latitude, longitude)
-        if not distances:
+        ids, lats, lons, distances = self.candidate_distances(latitude, longitude)
+        if not len(ids):
             return []
-        return sorted(distances, key=operator.itemgetter(-1))
+        # Stable, so ties keep candidate order as with sorted()
+        return self.results(ids, lats, lons, distances, order=numpy.argsort(distances, kind='mergesort'))
+
+    def nearest_n(self, latitude, longitude, n):
+        ids, lats, lons, distances = self.candidate_distances(latitude, longitude)
+        if not len(ids) or n <= 0:
+            return []
+        return self.select_nearest(ids, lats, lons, distances, n)
+
+    def select_nearest(self, ids, lats, lons, distances, n):
+        if n < len(ids):
+            # Select the n nearest in linear time, then sort only those
+            top = numpy.argpartition(distances, n - 1)[:n]
+            order = top[numpy.lexsort((top, distances[top]))]
+        else:
+            order = numpy.argsort(distances, kind='mergesort')
+
+        return self.results(ids, lats, lons, distances, order=order)
 
     def points_with_properties(self, results):
         return [(self.get_properties(i), lat, lon, distance)
@@ -181,10 +353,51 @@ class PointIndex(object):
         return self.points_with_properties(self.all_nearby_points(latitude, longitude))
 
     def nearest_n_points(self, latitude, longitude, n=2):
-        return self.points_with_properties(self.all_nearby_points(latitude, longitude)[:n])
+        return self.points_with_properties(self.nearest_n(latitude, longitude, n))
+
+    def nearest_n_many(self, latitudes, longitudes, n):
+        '''
+        Batch version of nearest_n. Points in the same geohash cell have the
+        same candidates, so queries are grouped by cell and the distances for
+        each group are computed in one haversine_distances call over a
+        (queries, candidates) array.
+        '''
+        latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+        longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+        results = [[] for i in xrange(len(latitudes))]
+        if n <= 0:
+            return results
+
+        groups = OrderedDict()
+        for j, (lat, lon) in enumerate(zip(latitudes.tolist(), longitudes.tolist())):
+            groups.setdefault(geohash.encode(lat, lon)[:self.precision], []).append(j)
+
+        for code, queries in six.iteritems(groups):
+            ids = self.cell_candidate_ids(code)
+            if not len(ids):
+                continue
+            points = self.points_view()[ids]
+            lats = points[:, 0]
+            lons = points[:, 1]
+
+            queries = numpy.array(queries, dtype=numpy.int64)
+            distances = haversine_distances(latitudes[queries, numpy.newaxis],
+                                            longitudes[queries, numpy.newaxis],
+                                            lats, lons)
+            for j, row in zip(queries.tolist(), distances):
+                results[j] = self.select_nearest(ids, lats, lons, row, n)
+
+        return results
+
+    def nearest_n_points_many(self, latitudes, longitudes, n=2):
+        '''
+        Batch version of nearest_n_points, returns a list of results per point
+        '''
+        return [self.points_with_properties(results)
+                for results in self.nearest_n_many(latitudes, longitudes, n)]
 
     def nearest_point(self, latitude, longitude):
-        distances = self.all_nearby_points(latitude, longitude)
-        if not distances:
+        results = self.nearest_n(latitude, longitude, 1)
+        if not results:
             return None
-        return self.points_with_properties(distances[:1])[0]
+        return self.points_with_properties(results)[0]
@@ -0,0 +1,214 @@
+'''
+geodata.points.kdtree
+---------------------
+
+PointIndex backend using a KD-tree over 3D unit vectors instead of geohash
+cells. Each point is stored once, and since straight-line (chord) distance
+between unit vectors is monotonic in great-circle distance, radius and
+k-nearest-neighbor queries on the tree are exact at any scale, not just
+within the neighbors of a fixed-precision geohash.
+
+The tree is cheap to build relative to parsing the input, so only the
+points are saved and the tree is rebuilt from them on load.
+'''
+
+import math
+import numpy
+
+from scipy.spatial import cKDTree
+
+from geodata.distance.haversine import EARTH_RADIUS_KM, haversine_distances
+from geodata.points.index import PointIndex
+
+
+def unit_vectors(lats, lons):
+    lats = numpy.radians(lats)
+    lons = numpy.radians(lons)
+    cos_lats = numpy.cos(lats)
+    return numpy.column_stack((cos_lats * numpy.cos(lons),
+                               cos_lats * numpy.sin(lons),
+                               numpy.sin(lats)))
+
+
+def chord_length(distance, radius=EARTH_RADIUS_KM):
+    '''
+    Straight-line distance between two points on the unit sphere which are
+    a great-circle distance of distance apart on a sphere of the given radius
+    '''
+    return 2.0 * math.sin(min(distance / (2.0 * radius), math.pi / 2.0))
+
+
+def geohash_cell_degrees(precision):
+    '''
+    (width, height) of a geohash cell in degrees. Geohash bits alternate
+    between longitude and latitude starting with longitude, so cells at odd
+    precisions are square and at even precisions twice as wide as tall.
+    '''
+    bits = 5 * precision
+    return 360.0 / 2 ** ((bits + 1) // 2), 180.0 / 2 ** (bits // 2)
+
+
+class KDTreePointIndex(PointIndex):
+    # PointIndex indexes each point under its geohash cell and the cell's
+    # neighbors and looks up a query's cell and neighbors, so it finds
+    # everything in the 5x5 block of cells around the query, i.e. at least
+    # two cells in every direction. Cells get narrower in km away from the
+    # equator, so by default the search radius is the distance the geohash
+    # backend is guaranteed to cover at the query's latitude.
+    GEOHASH_CELLS = 2
+
+    BACKEND = 'kdtree'
+
+    search_radius = None
+
+    def __init__(self, *args, **kw):
+        radius = kw.pop('radius', None)
+        super(KDTreePointIndex, self).__init__(*args, **kw)
+        if radius is not None:
+            self.search_radius = radius
+        self._tree = None
+
+    def index_point(self, lat, lon):
+        self._tree = None
+        self._points_view = None
+        self.points.extend([lat, lon])
+
+    def save_index(self):
+        # Nothing to save, the tree is rebuilt from the points on load
+        pass
+
+    @classmethod
+    def load_index(cls, d, index_name=None):
+        return None
+
+    def default_radius(self, latitude):
+        '''
+        Search radius in km for a query at latitude, search_radius if set
+        '''
+        if self.search_radius is not None:
+            return self.search_radius
+        width, height = geohash_cell_degrees(self.precision)
+        cells = self.GEOHASH_CELLS
+        # Cell width at the poleward edge of the block, the narrowest part
+        edge_latitude = min(abs(latitude) + cells * height, 90.0)
+        km_per_degree = math.radians(EARTH_RADIUS_KM)
+        return cells * km_per_degree * min(width * math.cos(math.radians(edge_latitude)), height)
+
+    def tree(self):
+        if self._tree is None and len(self.points):
+            points = self.points_view()
+            self._tree = cKDTree(unit_vectors(points[:, 0], points[:, 1]))
+        return self._tree
+
+    def empty_results(self):
+        ids = numpy.zeros(0, dtype=numpy.int64)
+        values = numpy.zeros(0, dtype=numpy.float64)
+        return ids, values, values, values
+
+    def id_distances(self, latitude, longitude, ids):
+        points = self.points_view()[ids]
+        lats = points[:, 0]
+        lons = points[:, 1]
+        return ids, lats, lons, haversine_distances(latitude, longitude, lats, lons)
+
+    def radius_distances(self, latitude, longitude, radius):
+        '''
+        Arrays of ids, latitudes, longitudes and distances (km) for all points
+        within radius km of latitude/longitude, in id order
+        '''
+        tree = self.tree()
+        if tree is None:
+            return self.empty_results()
+
+        v = unit_vectors(latitude, longitude)[0]
+        ids = numpy.array(sorted(tree.query_ball_point(v, chord_length(radius))), dtype=numpy.int64)
+        return self.id_distances(latitude, longitude, ids)
+
+    def candidate_ids(self, latitude, longitude):
+        return self.radius_distances(latitude, longitude, self.default_radius(latitude))[0]
+
+    def candidate_distances(self, latitude, longitude):
+        return self.radius_distances(latitude, longitude, self.default_radius(latitude))
+
+    def points_within_radius(self, latitude, longitude, radius):
+        '''
+        All points within radius km, nearest first, as
+        (properties, lat, lon, distance)
+        '''
+        ids, lats, lons, distances = self.radius_distances(latitude, longitude, radius)
+        if not len(ids):
+            return []
+        results = self.results(ids, lats, lons, distances, order=numpy.argsort(distances, kind='mergesort'))
+        return self.points_with_properties(results)
+
+    def nearest_n(self, latitude, longitude, n, radius=None):
+        '''
+        k-NN query on the tree, limited to points within radius km (the
+        default search radius if None, pass float('inf') for no limit)
+        '''
+        tree = self.tree()
+        if tree is None or n <= 0:
+            return []
+
+        if radius is None:
+            radius = self.default_radius(latitude)
+
+        k = min(n, len(self.points) // 2)
+        v = unit_vectors(latitude, longitude)[0]
+        _, ids = tree.query(v, k=k, distance_upper_bound=chord_length(radius))
+        ids = numpy.atleast_1d(ids)
+        # Missing neighbors are reported with an id of tree.n
+        ids = ids[ids < tree.n].astype(numpy.int64)
+        if not len(ids):
+            return []
+
+        ids, lats, lons, distances = self.id_distances(latitude, longitude, ids)
+        return self.results(ids, lats, lons, distances, order=numpy.lexsort((ids, distances)))
+
+    def nearest_n_many(self, latitudes, longitudes, n, radius=None):
+        '''
+        Batch version of nearest_n, one k-NN query on the tree for all the
+        points and one haversine_distances call over the (queries, k) array
+        of neighbors
+        '''
+        latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+        longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+        tree = self.tree()
+        if tree is None or n <= 0 or not len(latitudes):
+            return [[] for i in xrange(len(latitudes))]
+
+        if radius is None:
+            radii = [self.default_radius(lat) for lat in latitudes.tolist()]
+        else:
+            radii = [radius] * len(latitudes)
+        chords = numpy.array([chord_length(r) for r in radii])
+
+        k = min(n, len(self.points) // 2)
+        # Query with the largest radius, then limit each point to its own
+        chord_distances, ids = tree.query(unit_vectors(latitudes, longitudes), k=k,
+                                          distance_upper_bound=chords.max())
+        chord_distances = chord_distances.reshape(len(latitudes), k)
+        ids = ids.reshape(len(latitudes), k)
+        # Missing neighbors are reported with an id of tree.n
+        found = (ids < tree.n) & (chord_distances < chords[:, numpy.newaxis])
+        ids = numpy.where(found, ids, 0).astype(numpy.int64)
+
+        points = self.points_view()[ids]
+        lats = points[:, :, 0]
+        lons = points[:, :, 1]
+        distances = haversine_distances(latitudes[:, numpy.newaxis], longitudes[:, numpy.newaxis], lats, lons)
+
+        results = []
+        for j in xrange(len(latitudes)):
+            mask = found[j]
+            row_ids, row_distances = ids[j][mask], distances[j][mask]
+            results.append(self.results(row_ids, lats[j][mask], lons[j][mask], row_distances,
+                                        order=numpy.lexsort((row_ids, row_distances))))
+        return results
+
+    def nearest_n_points(self, latitude, longitude, n=2, radius=None):
+        return self.points_with_properties(self.nearest_n(latitude, longitude, n, radius=radius))
+
+    def nearest_n_points_many(self, latitudes, longitudes, n=2, radius=None):
+        return [self.points_with_properties(results)
+                for results in self.nearest_n_many(latitudes, longitudes, n, radius=radius)]
@@ -1,6 +1,7 @@
 import fiona
 import gc
 import geohash
+import numpy
 import os
 import rtree
 import six
@@ -9,15 +10,23 @@ import ujson as json
 from collections import OrderedDict, defaultdict
 from leveldb import LevelDB
 from lru import LRU
-from shapely.geometry import Point, Polygon, MultiPolygon
+from shapely import vectorized
+from shapely.geometry import Point, Polygon, MultiPolygon, box
 from shapely.prepared import prep
 from shapely.geometry.geo import mapping
 
+from geodata.geohash_index import GeohashIndex
+from geodata.instrumentation import Instrumentation, TimedDB
+from geodata.properties_store import PropertiesStore
 from geodata.polygons.area import polygon_bounding_box_area
+from geodata.polygons.store import PolygonStore
+from geodata.polygons.tiles import PolygonTiles
 
 DEFAULT_POLYS_FILENAME = 'polygons.geojson'
 DEFAULT_PROPS_FILENAME = 'properties.json'
 
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
 
 class PolygonIndex(object):
     include_only_properties = None
@@ -26,13 +35,42 @@ class PolygonIndex(object):
     persistent_polygons = False
     cache_size = 0
     fix_invalid_polygons = False
+    # Store persistent polygons as flat memory-mapped arrays instead of GeoJSON in LevelDB
+    mmap_polygons = False
+    # Store properties in a memory-mapped store with lazy per-field decoding
+    # instead of a JSON blob per polygon in LevelDB
+    mmap_properties = False
+    # Record geohash cells which are fully inside or fully outside each polygon
+    # at build time so points falling in them can skip the exact contains test
+    containment_cells = False
+    containment_cell_precision = 5
+    # Clip large polygons into tiles of bounded vertex count at build time,
+    # used by indices which support it (RTreePolygonIndex)
+    tile_polygons = False
+    max_tile_vertices = 500
+    # Record counters and per-stage latency histograms for lookups, see
+    # geodata.instrumentation and stats()
+    instrument = False
+
+    # Looked up on the instance so instrument_lookups can time JSON decoding
+    json_loads = staticmethod(json.loads)
 
     INDEX_FILENAME = None
     POLYGONS_DB_DIR = 'polygons'
+    POLYGON_STORE_DIR = 'polygon_store'
+    INTERIOR_CELLS_DIR = 'interior_cells'
+    EXTERIOR_CELLS_DIR = 'exterior_cells'
+    POLYGON_TILES_DIR = 'polygon_tiles'
+    PROPERTIES_STORE_DIR = 'properties_store'
 
     def __init__(self, index=None, polygons=None, polygons_db=None, save_dir=None,
                  index_filename=None,
                  polygons_db_path=None,
+                 polygon_store=None,
+                 interior_cells=None,
+                 exterior_cells=None,
+                 polygon_tiles=None,
+                 properties_store=None,
                  include_only_properties=None):
         if save_dir:
             self.save_dir = save_dir
@@ -46,8 +84,10 @@ class PolygonIndex(object):
 
         if not index:
             self.create_index(overwrite=True)
+            building = True
         else:
             self.index = index
+            building = False
 
         if include_only_properties and hasattr(include_only_properties, '__contains__'):
             self.include_only_properties = include_only_properties
@@ -75,10 +115,65 @@ class PolygonIndex(object):
         else:
             self.polygons_db = polygons_db
 
+        if polygon_store is not None:
+            self.polygon_store = polygon_store
+        elif building and self.persistent_polygons and self.mmap_polygons:
+            self.polygon_store = PolygonStore(os.path.join(save_dir or '.', self.POLYGON_STORE_DIR))
+        else:
+            self.polygon_store = None
+
+        if properties_store is not None:
+            self.properties_store = properties_store
+        elif building and self.mmap_properties:
+            self.properties_store = PropertiesStore(os.path.join(save_dir or '.', self.PROPERTIES_STORE_DIR))
+        else:
+            self.properties_store = None
+
+        self.build_containment_cells = building and self.containment_cells
+        if interior_cells is not None and exterior_cells is not None:
+            self.interior_cells = interior_cells
+            self.exterior_cells = exterior_cells
+            self.cell_precision = max(interior_cells.key_length, exterior_cells.key_length)
+        elif self.build_containment_cells:
+            self.interior_cells = defaultdict(list)
+            self.exterior_cells = defaultdict(list)
+            self.cell_precision = self.containment_cell_precision
+        else:
+            self.interior_cells = None
+            self.exterior_cells = None
+
+        self.containment_hits = 0
+        self.containment_misses = 0
+
+        self.build_polygon_tiles = building and self.tile_polygons
+        if polygon_tiles is not None:
+            self.polygon_tiles = polygon_tiles
+        elif self.build_polygon_tiles:
+            self.polygon_tiles = PolygonTiles(os.path.join(save_dir or '.', self.POLYGON_TILES_DIR),
+                                              cache_size=self.cache_size or None)
+        else:
+            self.polygon_tiles = None
+
         self.setup()
 
         self.i = 0
 
+        self.instrumentation = None
+        if self.instrument:
+            self.instrument_lookups()
+
+    def instrument_lookups(self):
+        self.instrumentation = Instrumentation(self.__class__.__name__, counters=self.cache_counters)
+        self.instrumentation.instrument_methods(self, {
+            'get_candidate_polygons': ('candidates', None, True),
+            'polygon_contains': ('contains', 0, False),
+            'load_polygon': ('load_polygon', 0, False),
+            'get_properties': ('properties', None, False),
+            'json_loads': ('json_loads', None, False),
+            'known_containment': ('containment_cells', None, False),
+        }, periodic=('point_in_poly', 'points_in_polys'))
+        self.polygons_db = TimedDB(self.polygons_db, self.instrumentation, 'leveldb_get')
+
     def create_index(self, overwrite=False):
         raise NotImplementedError('Children must implement')
 
@@ -118,12 +213,124 @@ class PolygonIndex(object):
             self.polygons[self.i] = prep(poly)
 
         if self.persistent_polygons:
-            self.polygons_db.Put(self.polygon_key(self.i), json.dumps(self.polygon_geojson(poly, properties)))
+            if self.polygon_store is not None:
+                self.polygon_store.add_polygon(self.i, poly)
+            else:
+                self.polygons_db.Put(self.polygon_key(self.i), json.dumps(self.polygon_geojson(poly, properties)))
 
-        self.polygons_db.Put(self.properties_key(self.i), json.dumps(properties))
+        if self.properties_store is not None:
+            self.properties_store.add(self.i, properties)
+        else:
+            self.polygons_db.Put(self.properties_key(self.i), json.dumps(properties))
         self.index_polygon_properties(properties)
+        if self.build_containment_cells:
+            self.index_containment_cells(poly)
+        if self.build_polygon_tiles:
+            self.polygon_tiles.end_polygon()
         self.i += 1
 
+    @classmethod
+    def polygon_cells(cls, poly, precision):
+        '''
+        Classify geohash cells overlapping the polygon's bounding box, coarsest
+        first. Cells fully inside or fully outside the polygon are returned and
+        not subdivided, cells on the boundary are split down to precision.
+
+        Returns (interior cells, exterior cells)
+        '''
+        prepared = prep(poly)
+        min_lon, min_lat, max_lon, max_lat = poly.bounds
+
+        interior = []
+        exterior = []
+
+        prefixes = ['']
+        while prefixes:
+            prefix = prefixes.pop()
+            for c in GEOHASH_BASE32:
+                code = prefix + c
+                b = geohash.bbox(code)
+                if b['e'] < min_lon or b['w'] > max_lon or b['n'] < min_lat or b['s'] > max_lat:
+                    continue
+                cell = box(b['w'], b['s'], b['e'], b['n'])
+                # contains_properly so that no point in the cell can lie on the polygon's boundary
+                if prepared.contains_properly(cell):
+                    interior.append(code)
+                elif not prepared.intersects(cell):
+                    exterior.append(code)
+                elif len(code) < precision:
+                    prefixes.append(code)
+
+        return interior, exterior
+
+    def index_containment_cells(self, poly):
+        interior, exterior = self.polygon_cells(poly, self.cell_precision)
+        for code in interior:
+            self.interior_cells[code].append(self.i)
+        for code in exterior:
+            self.exterior_cells[code].append(self.i)
+
+    def known_containment(self, lat, lon):
+        '''
+        Sets of polygon ids known to contain and known not to contain the
+        point, from the cached cells at every geohash level of the point
+        '''
+        inside = set()
+        outside = set()
+        code = geohash.encode(lat, lon, self.cell_precision)
+        for level in xrange(1, len(code) + 1):
+            prefix = code[:level]
+            inside.update(self.interior_cells.get(prefix, ()))
+            outside.update(self.exterior_cells.get(prefix, ()))
+        return inside, outside
+
+    def containment_cache_stats(self):
+        lookups = self.containment_hits + self.containment_misses
+        return {
+            'hits': self.containment_hits,
+            'misses': self.containment_misses,
+            'hit_rate': float(self.containment_hits) / lookups if lookups else 0.0,
+        }
+
+    def cache_stats(self):
+        '''
+        Hit rate of the polygon LRU cache, None if polygons aren't cached
+        '''
+        if not (self.persistent_polygons and self.cache_size > 0):
+            return None
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'size': len(self.polygons),
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'hit_rate': float(self.cache_hits) / lookups if lookups else 0.0,
+        }
+
+    def cache_counters(self):
+        counters = {}
+        if self.persistent_polygons and self.cache_size > 0:
+            counters.update(cache_hits=self.cache_hits, cache_misses=self.cache_misses)
+        if self.interior_cells is not None:
+            counters.update(containment_hits=self.containment_hits, containment_misses=self.containment_misses)
+        if self.properties_store is not None:
+            counters.update(properties_cache_hits=self.properties_store.cache_hits,
+                            properties_cache_misses=self.properties_store.cache_misses)
+        return counters
+
+    def stats(self):
+        '''
+        Cache hit rates, plus counters and per-stage latencies if the
+        index is instrumented
+        '''
+        stats = {'polygon_cache': self.cache_stats()}
+        if self.interior_cells is not None:
+            stats['containment_cells'] = self.containment_cache_stats()
+        if self.properties_store is not None:
+            stats['properties_cache'] = self.properties_store.cache_stats()
+        if self.instrumentation is not None:
+            stats.update(self.instrumentation.stats())
+        return stats
+
     @classmethod
     def create_from_shapefiles(cls, inputs, output_dir,
                                index_filename=None,
@@ -249,8 +456,20 @@ class PolygonIndex(object):
         self.save_properties(os.path.join(self.save_dir, DEFAULT_PROPS_FILENAME))
         if not self.persistent_polygons:
             self.save_polygons(os.path.join(self.save_dir, DEFAULT_POLYS_FILENAME))
+        elif self.polygon_store is not None:
+            self.polygon_store.save()
+        if self.properties_store is not None:
+            self.properties_store.save()
         self.compact_polygons_db()
         self.save_polygon_properties(self.save_dir)
+        if self.build_containment_cells:
+            self.save_containment_cells(self.save_dir)
+        if self.build_polygon_tiles:
+            self.polygon_tiles.save()
+
+    def save_containment_cells(self, d):
+        GeohashIndex.from_dict(self.interior_cells).save(os.path.join(d, self.INTERIOR_CELLS_DIR))
+        GeohashIndex.from_dict(self.exterior_cells).save(os.path.join(d, self.EXTERIOR_CELLS_DIR))
 
     def load_properties(self, filename):
         properties = json.load(open(filename))
@@ -319,7 +538,35 @@ class PolygonIndex(object):
         else:
             polys = None
         polygons_db = LevelDB(os.path.join(d, polys_db_dir))
-        polygon_index = cls(index=index, polygons=polys, polygons_db=polygons_db, save_dir=d)
+        polygon_store_dir = os.path.join(d, cls.POLYGON_STORE_DIR)
+        if cls.persistent_polygons and PolygonStore.exists(polygon_store_dir):
+            polygon_store = PolygonStore.load(polygon_store_dir)
+        else:
+            polygon_store = None
+        interior_cells_dir = os.path.join(d, cls.INTERIOR_CELLS_DIR)
+        exterior_cells_dir = os.path.join(d, cls.EXTERIOR_CELLS_DIR)
+        if GeohashIndex.exists(interior_cells_dir) and GeohashIndex.exists(exterior_cells_dir):
+            interior_cells = GeohashIndex.load(interior_cells_dir)
+            exterior_cells = GeohashIndex.load(exterior_cells_dir)
+        else:
+            interior_cells = exterior_cells = None
+        properties_store_dir = os.path.join(d, cls.PROPERTIES_STORE_DIR)
+        if PropertiesStore.exists(properties_store_dir):
+            properties_store = PropertiesStore.load(properties_store_dir)
+        else:
+            properties_store = None
+        polygon_tiles_dir = os.path.join(d, cls.POLYGON_TILES_DIR)
+        if PolygonTiles.exists(polygon_tiles_dir):
+            polygon_tiles = PolygonTiles.load(polygon_tiles_dir, cache_size=cls.cache_size or None)
+        else:
+            polygon_tiles = None
+        polygon_index = cls(index=index, polygons=polys, polygons_db=polygons_db,
+                            polygon_store=polygon_store,
+                            interior_cells=interior_cells,
+                            exterior_cells=exterior_cells,
+                            polygon_tiles=polygon_tiles,
+                            properties_store=properties_store,
+                            save_dir=d)
         polygon_index.load_properties(os.path.join(d, properties_filename))
         polygon_index.load_polygon_properties(d)
         return polygon_index
@@ -328,16 +575,23 @@ class PolygonIndex(object):
         raise NotImplementedError('Children must implement')
 
     def get_properties(self, i):
-        return json.loads(self.polygons_db.Get(self.properties_key(i)))
+        if self.properties_store is not None:
+            return self.properties_store.get(i)
+        return self.json_loads(self.polygons_db.Get(self.properties_key(i)))
 
     def get_polygon(self, i):
         return self.polygons[i]
 
+    def load_polygon(self, i):
+        if self.polygon_store is not None:
+            return self.polygon_store.get_polygon(i)
+        data = self.json_loads(self.polygons_db.Get(self.polygon_key(i)))
+        return self.polygon_from_geojson(data)
+
     def get_polygon_cached(self, i):
         poly = self.polygons.get(i, None)
         if poly is None:
-            data = json.loads(self.polygons_db.Get(self.polygon_key(i)))
-            poly = prep(self.polygon_from_geojson(data))
+            poly = prep(self.load_polygon(i))
             self.polygons[i] = poly
             self.cache_misses += 1
         else:
@@ -355,9 +609,23 @@ class PolygonIndex(object):
         containing = None
         if return_all:
             containing = []
+
+        use_cells = self.interior_cells is not None
+        inside = outside = ()
+        if use_cells:
+            inside, outside = self.known_containment(point.y, point.x)
+
         for i in candidates:
-            poly = self.get_polygon(i)
-            contains = poly.contains(point)
+            if i in inside:
+                contains = True
+                self.containment_hits += 1
+            elif i in outside:
+                contains = False
+                self.containment_hits += 1
+            else:
+                if use_cells:
+                    self.containment_misses += 1
+                contains = self.polygon_contains(i, point)
             if contains:
                 properties = self.get_properties(i)
                 if not return_all:
@@ -366,6 +634,13 @@ class PolygonIndex(object):
                     containing.append(properties)
         return containing
 
+    def polygon_contains(self, i, point):
+        if self.polygon_tiles is not None:
+            contains = self.polygon_tiles.contains(i, point)
+            if contains is not None:
+                return contains
+        return self.get_polygon(i).contains(point)
+
     def polygon_key(self, i):
         return 'poly:{}'.format(i)
 
@@ -377,6 +652,78 @@ class PolygonIndex(object):
         point = Point(lon, lat)
         return self.polygons_contain(candidates, point, return_all=return_all)
 
+    def points_in_polys(self, lats, lons, return_all=False):
+        '''
+        Batch version of point_in_poly. Takes arrays of latitudes and longitudes
+        and returns a list with one result per point, in the same format as
+        point_in_poly (properties or None, or a list of properties if return_all).
+
+        Points are grouped by candidate polygon so each polygon is fetched
+        once and tested against all of its points in a single vectorized
+        contains call. Properties are decoded once per polygon per batch, so
+        points in the same polygon share the same properties dict.
+        '''
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        lons = numpy.asarray(lons, dtype=numpy.float64)
+        if lats.shape != lons.shape:
+            raise ValueError('lats and lons must have the same shape')
+
+        point_candidates = []
+        polygon_points = OrderedDict()
+
+        contained = defaultdict(set)
+
+        for j in xrange(len(lats)):
+            candidates = self.get_candidate_polygons(lats[j], lons[j])
+            point_candidates.append(candidates)
+
+            if self.interior_cells is None:
+                for i in candidates:
+                    polygon_points.setdefault(i, []).append(j)
+                continue
+
+            inside, outside = self.known_containment(lats[j], lons[j])
+            for i in candidates:
+                if i in inside:
+                    contained[i].add(j)
+                    self.containment_hits += 1
+                elif i in outside:
+                    self.containment_hits += 1
+                else:
+                    polygon_points.setdefault(i, []).append(j)
+                    self.containment_misses += 1
+
+        for i, point_indices in six.iteritems(polygon_points):
+            if self.polygon_tiles is not None:
+                # Tiles are small, test each point against its own tile(s)
+                contained[i].update([j for j in point_indices if self.polygon_contains(i, Point(lons[j], lats[j]))])
+                continue
+            point_indices = numpy.array(point_indices, dtype=numpy.intp)
+            poly = self.get_polygon(i)
+            mask = vectorized.contains(poly, lons[point_indices], lats[point_indices])
+            contained[i].update(point_indices[mask].tolist())
+
+        del polygon_points
+
+        properties = {}
+
+        results = []
+        for j, candidates in enumerate(point_candidates):
+            containing = [] if return_all else None
+            for i in candidates:
+                if j not in contained[i]:
+                    continue
+                props = properties.get(i)
+                if props is None:
+                    props = properties[i] = self.get_properties(i)
+                if not return_all:
+                    containing = props
+                    break
+                containing.append(props)
+            results.append(containing)
+
+        return results
+
 
 class RTreePolygonIndex(PolygonIndex):
     INDEX_FILENAME = 'rtree'
@@ -385,6 +732,11 @@ class RTreePolygonIndex(PolygonIndex):
         self.index = rtree.index.Index(self.index_path, overwrite=overwrite)
 
     def index_polygon(self, polygon):
+        if self.build_polygon_tiles:
+            # Index each tile's bounding box under the polygon id, get_candidate_polygons deduplicates
+            for tile in self.polygon_tiles.add_tiles(polygon, self.max_tile_vertices):
+                self.index.insert(self.i, tile.bounds)
+            return
         self.index.insert(self.i, polygon.bounds)
 
     def get_candidate_polygons(self, lat, lon):
@@ -410,7 +762,9 @@ class GeohashPolygonIndex(PolygonIndex):
         (2, 1251000.0 * 625000.0),
     ]
 
-    INDEX_FILENAME = 'index.json'
+    INDEX_FILENAME = 'index'
+    # Pre-binary format, still readable by load_index
+    JSON_INDEX_FILENAME = 'index.json'
 
     def create_index(self, overwrite=False):
         self.index = defaultdict(list)
@@ -446,8 +800,14 @@ class GeohashPolygonIndex(PolygonIndex):
     def save_index(self):
         if not self.index_path:
             self.index_path = os.path.join(self.save_dir or '.', self.INDEX_FILENAME)
-        json.dump(self.index, open(self.index_path, 'w'))
+        GeohashIndex.from_dict(self.index).save(self.index_path)
 
     @classmethod
     def load_index(cls, d, index_name=None):
-        return json.load(open(os.path.join(d, index_name or cls.INDEX_FILENAME)))
+        index_path = os.path.join(d, index_name or cls.INDEX_FILENAME)
+        if GeohashIndex.exists(index_path):
+            return GeohashIndex.load(index_path)
+        # Legacy JSON index, saved under index_name if one was given
+        if index_name and index_name != cls.INDEX_FILENAME:
+            return json.load(open(index_path))
+        return json.load(open(os.path.join(d, cls.JSON_INDEX_FILENAME)))
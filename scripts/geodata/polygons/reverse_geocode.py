@@ -37,6 +37,7 @@ from geodata.i18n.word_breaks import ideographic_scripts
 from geodata.names.deduping import NameDeduper
 from geodata.osm.extract import parse_osm, osm_type_and_id, NODE, WAY, RELATION, OSM_NAME_TAGS
 from geodata.osm.admin_boundaries import *
+from geodata.osm.node_locations import SortedNodeLocations, DenseNodeLocations
 from geodata.polygons.index import *
 from geodata.statistics.tf_idf import IDFIndex
 
@@ -318,7 +319,8 @@ class OSMReverseGeocoder(RTreePolygonIndex):
     @classmethod
     def create_from_osm_file(cls, filename, output_dir,
                              index_filename=None,
-                             polys_filename=DEFAULT_POLYS_FILENAME):
+                             polys_filename=DEFAULT_POLYS_FILENAME,
+                             node_locations=None):
         '''
         Given an OSM file (planet or some other bounds) containing relations
         and their dependencies, create an R-tree index for coarse-grained
@@ -327,10 +329,13 @@ class OSMReverseGeocoder(RTreePolygonIndex):
         Note: the input file is expected to have been created using
         osmfilter. Use fetch_osm_address_data.sh for planet or copy the
         admin borders commands if using other bounds.
+
+        node_locations: optional store from geodata.osm.node_locations
+        to keep node coordinates out of RAM on planet-sized inputs.
         '''
         index = cls(save_dir=output_dir, index_filename=index_filename)
 
-        reader = cls.polygon_reader(filename)
+        reader = cls.polygon_reader(filename, node_locations=node_locations)
         polygons = reader.polygons()
 
         logger = logging.getLogger('osm.reverse_geocode')
@@ -418,6 +423,9 @@ class OSMReverseGeocoder(RTreePolygonIndex):
                 poly = index.simplify_polygon(poly)
             index.add_polygon(poly, props)
 
+        if node_locations is not None:
+            node_locations.close()
+
         return index
 
     def setup(self):
@@ -536,6 +544,10 @@ class OSMCountryReverseGeocoder(OSMReverseGeocoder):
         osm_components = self.point_in_poly(lat, lon, return_all=True)
         return self.country_and_languages_from_components(osm_components)
 
+    def countries_and_languages(self, lats, lons):
+        return [self.country_and_languages_from_components(osm_components)
+                for osm_components in self.points_in_polys(lats, lons, return_all=True)]
+
 
 if __name__ == '__main__':
     # Handle argument parsing here
@@ -545,45 +557,118 @@ if __name__ == '__main__':
                         help='Path to quattroshapes dir')
 
     parser.add_argument('-a', '--osm-admin-file',
-                        help='Path to OSM borders file (with dependencies, .osm format)')
+                        help='Path to OSM borders file (with dependencies, .osm or .pbf format)')
 
     parser.add_argument('-s', '--osm-subdivisions-file',
-                        help='Path to OSM subdivisions file (with dependencies, .osm format)')
+                        help='Path to OSM subdivisions file (with dependencies, .osm or .pbf format)')
 
     parser.add_argument('-b', '--osm-building-polygons-file',
-                        help='Path to OSM building polygons file (with dependencies, .osm format)')
+                        help='Path to OSM building polygons file (with dependencies, .osm or .pbf format)')
 
     parser.add_argument('-p', '--osm-postal-code-polygons-file',
-                        help='Path to OSM postal code polygons file (with dependencies, .osm format)')
+                        help='Path to OSM postal code polygons file (with dependencies, .osm or .pbf format)')
 
     parser.add_argument('-r', '--osm-airport-polygons-file',
-                        help='Path to OSM airport polygons file (with dependencies, .osm format)')
+                        help='Path to OSM airport polygons file (with dependencies, .osm or .pbf format)')
 
     parser.add_argument('-c', '--osm-country-polygons-file',
-                        help='Path to OSM country polygons file (with dependencies, .osm format)')
+                        help='Path to OSM country polygons file (with dependencies, .osm or .pbf format)')
 
     parser.add_argument('-o', '--out-dir',
                         default=os.getcwd(),
                         help='Output directory')
 
+    parser.add_argument('--node-locations',
+                        choices=('memory', 'sorted', 'dense'),
+                        default='memory',
+                        help='Where to keep node coordinates while building OSM polygons: in memory (default), '
+                             'a sorted on-disk id/coordinate array (sparse extracts) or a dense memory-mapped '
+                             'file indexed by node id (buildings, planet)')
+
+    parser.add_argument('--node-locations-file',
+                        default=None,
+                        help='Path for the on-disk node locations (default: a temp file in --temp-dir, removed after the build)')
+
+    parser.add_argument('-t', '--temp-dir',
+                        default=tempfile.gettempdir(),
+                        help='Temp directory to use')
+
+    parser.add_argument('--mmap-polygons',
+                        action='store_true',
+                        default=False,
+                        help='Store polygons in a memory-mapped coordinate store instead of GeoJSON in LevelDB')
+
+    parser.add_argument('--containment-cells',
+                        action='store_true',
+                        default=False,
+                        help='Save geohash cells fully inside/outside each polygon to skip exact contains tests at query time')
+
+    parser.add_argument('--containment-cell-precision',
+                        type=int,
+                        default=PolygonIndex.containment_cell_precision,
+                        help='Finest geohash precision for containment cells')
+
+    parser.add_argument('--tile-polygons',
+                        action='store_true',
+                        default=False,
+                        help='Clip large polygons into tiles of bounded vertex count for faster R-tree queries')
+
+    parser.add_argument('--max-tile-vertices',
+                        type=int,
+                        default=PolygonIndex.max_tile_vertices,
+                        help='Maximum number of vertices per polygon tile')
+
+    parser.add_argument('--mmap-properties',
+                        action='store_true',
+                        default=False,
+                        help='Store properties in a memory-mapped store with lazy field decoding instead of JSON in LevelDB')
+
     logging.basicConfig(level=logging.INFO)
 
     args = parser.parse_args()
-    if args.osm_admin_file:
-        index = OSMReverseGeocoder.create_from_osm_file(args.osm_admin_file, args.out_dir)
-    elif args.osm_subdivisions_file:
-        index = OSMSubdivisionReverseGeocoder.create_from_osm_file(args.osm_subdivisions_file, args.out_dir)
-    elif args.osm_building_polygons_file:
-        index = OSMBuildingReverseGeocoder.create_from_osm_file(args.osm_building_polygons_file, args.out_dir)
-    elif args.osm_country_polygons_file:
-        index = OSMCountryReverseGeocoder.create_from_osm_file(args.osm_country_polygons_file, args.out_dir)
-    elif args.osm_postal_code_polygons_file:
-        index = OSMPostalCodeReverseGeocoder.create_from_osm_file(args.osm_postal_code_polygons_file, args.out_dir)
-    elif args.osm_airport_polygons_file:
-        index = OSMAirportReverseGeocoder.create_from_osm_file(args.osm_airport_polygons_file, args.out_dir)
-    elif args.quattroshapes_dir:
-        index = QuattroshapesReverseGeocoder.create_with_quattroshapes(args.quattroshapes_dir, args.out_dir)
-    else:
-        parser.error('Must specify quattroshapes dir or osm admin borders file')
+    if args.mmap_polygons:
+        PolygonIndex.mmap_polygons = True
+    if args.containment_cells:
+        PolygonIndex.containment_cells = True
+        PolygonIndex.containment_cell_precision = args.containment_cell_precision
+    if args.mmap_properties:
+        PolygonIndex.mmap_properties = True
+    if args.tile_polygons:
+        PolygonIndex.tile_polygons = True
+        PolygonIndex.max_tile_vertices = args.max_tile_vertices
+
+    node_locations = None
+    node_locations_dir = None
+    if args.node_locations != 'memory':
+        node_locations_file = args.node_locations_file
+        if node_locations_file is None:
+            node_locations_dir = tempfile.mkdtemp(prefix='node_locations', dir=args.temp_dir)
+            node_locations_file = os.path.join(node_locations_dir, 'node_locations')
+        if args.node_locations == 'sorted':
+            node_locations = SortedNodeLocations(node_locations_file)
+        else:
+            node_locations = DenseNodeLocations(node_locations_file)
+
+    try:
+        if args.osm_admin_file:
+            index = OSMReverseGeocoder.create_from_osm_file(args.osm_admin_file, args.out_dir, node_locations=node_locations)
+        elif args.osm_subdivisions_file:
+            index = OSMSubdivisionReverseGeocoder.create_from_osm_file(args.osm_subdivisions_file, args.out_dir, node_locations=node_locations)
+        elif args.osm_building_polygons_file:
+            index = OSMBuildingReverseGeocoder.create_from_osm_file(args.osm_building_polygons_file, args.out_dir, node_locations=node_locations)
+        elif args.osm_country_polygons_file:
+            index = OSMCountryReverseGeocoder.create_from_osm_file(args.osm_country_polygons_file, args.out_dir, node_locations=node_locations)
+        elif args.osm_postal_code_polygons_file:
+            index = OSMPostalCodeReverseGeocoder.create_from_osm_file(args.osm_postal_code_polygons_file, args.out_dir, node_locations=node_locations)
+        elif args.osm_airport_polygons_file:
+            index = OSMAirportReverseGeocoder.create_from_osm_file(args.osm_airport_polygons_file, args.out_dir, node_locations=node_locations)
+        elif args.quattroshapes_dir:
+            index = QuattroshapesReverseGeocoder.create_with_quattroshapes(args.quattroshapes_dir, args.out_dir)
+        else:
+            parser.error('Must specify quattroshapes dir or osm admin borders file')
+    finally:
+        # The default store is only needed while the polygons are being built
+        if node_locations_dir is not None:
+            shutil.rmtree(node_locations_dir)
 
     index.save()
@@ -0,0 +1,131 @@
+'''
+geodata.polygons.store
+----------------------
+
+Flat, memory-mapped polygon storage. Instead of a GeoJSON blob per polygon,
+all coordinates are stored in one contiguous float64 array with three
+offset arrays on top of it:
+
+    polygons.bin: polygon i -> [parts[i], parts[i + 1]) in parts.bin
+    parts.bin:    part j (exterior + holes) -> [rings[j], rings[j + 1]) in rings.bin
+    rings.bin:    ring k -> [coords[k], coords[k + 1]) points in coords.bin
+    coords.bin:   lon, lat, lon, lat, ...
+
+Geometries are built directly from slices of the mapped buffers, so there
+is no JSON parsing on a cache miss, and since the files are opened read-only
+every process using the same store shares a single copy via the page cache.
+'''
+
+import array
+import numpy
+import os
+
+from shapely.geometry import Polygon, MultiPolygon
+
+from geodata.file_utils import ensure_dir
+
+
+class PolygonStore(object):
+    POLYGONS_FILENAME = 'polygons.bin'
+    PARTS_FILENAME = 'parts.bin'
+    RINGS_FILENAME = 'rings.bin'
+    COORDS_FILENAME = 'coords.bin'
+
+    OFFSET_TYPE = 'l'
+    OFFSET_DTYPE = numpy.int64
+    COORD_TYPE = 'd'
+    COORD_DTYPE = numpy.float64
+
+    def __init__(self, d, polygons=None, parts=None, rings=None, coords=None):
+        self.d = d
+        ensure_dir(d)
+
+        self.read_only = coords is not None
+
+        if not self.read_only:
+            self.polygons = array.array(self.OFFSET_TYPE, [0])
+            self.parts = array.array(self.OFFSET_TYPE, [0])
+            self.rings = array.array(self.OFFSET_TYPE, [0])
+            self.num_coords = 0
+            # Coordinates can be large, stream them to disk as they're added
+            self.coords_file = open(os.path.join(d, self.COORDS_FILENAME), 'wb')
+        else:
+            self.polygons = polygons
+            self.parts = parts
+            self.rings = rings
+            self.coords = coords
+            self.coords_file = None
+
+    def __len__(self):
+        return len(self.polygons) - 1
+
+    def add_ring(self, coords):
+        ring = array.array(self.COORD_TYPE)
+        for c in coords:
+            ring.append(c[0])
+            ring.append(c[1])
+        ring.tofile(self.coords_file)
+        self.num_coords += len(ring) // 2
+        self.rings.append(self.num_coords)
+
+    def add_polygon_part(self, poly):
+        self.add_ring(poly.exterior.coords)
+        for interior in poly.interiors:
+            self.add_ring(interior.coords)
+        self.parts.append(len(self.rings) - 1)
+
+    def add_polygon(self, i, poly):
+        if self.read_only:
+            raise ValueError('Polygon store at {} is read-only'.format(self.d))
+        if i != len(self):
+            raise ValueError('Polygons must be added in order, expected {}, got {}'.format(len(self), i))
+
+        if poly.type == 'Polygon':
+            self.add_polygon_part(poly)
+        elif poly.type == 'MultiPolygon':
+            for p in poly:
+                self.add_polygon_part(p)
+        else:
+            raise ValueError('Unsupported geometry type: {}'.format(poly.type))
+
+        self.polygons.append(len(self.parts) - 1)
+
+    def ring_coords(self, k):
+        return self.coords[self.rings[k] * 2:self.rings[k + 1] * 2].reshape(-1, 2)
+
+    def polygon_part(self, j):
+        start, end = self.parts[j], self.parts[j + 1]
+        return Polygon(self.ring_coords(start), [self.ring_coords(k) for k in xrange(start + 1, end)] or None)
+
+    def get_polygon(self, i):
+        start, end = self.polygons[i], self.polygons[i + 1]
+        if end - start == 1:
+            return self.polygon_part(start)
+        return MultiPolygon([self.polygon_part(j) for j in xrange(start, end)])
+
+    def save(self):
+        self.coords_file.close()
+        for filename, offsets in ((self.POLYGONS_FILENAME, self.polygons),
+                                  (self.PARTS_FILENAME, self.parts),
+                                  (self.RINGS_FILENAME, self.rings)):
+            f = open(os.path.join(self.d, filename), 'wb')
+            numpy.asarray(offsets, dtype=self.OFFSET_DTYPE).tofile(f)
+            f.close()
+
+    @classmethod
+    def exists(cls, d):
+        return os.path.exists(os.path.join(d, cls.POLYGONS_FILENAME))
+
+    @classmethod
+    def mmap_array(cls, filename, dtype):
+        if os.path.getsize(filename) == 0:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(filename, dtype=dtype, mode='r')
+
+    @classmethod
+    def load(cls, d):
+        return cls(d,
+                   polygons=cls.mmap_array(os.path.join(d, cls.POLYGONS_FILENAME), cls.OFFSET_DTYPE),
+                   parts=cls.mmap_array(os.path.join(d, cls.PARTS_FILENAME), cls.OFFSET_DTYPE),
+                   rings=cls.mmap_array(os.path.join(d, cls.RINGS_FILENAME), cls.OFFSET_DTYPE),
+                   coords=cls.mmap_array(os.path.join(d, cls.COORDS_FILENAME), cls.COORD_DTYPE))
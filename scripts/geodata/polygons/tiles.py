@@ -0,0 +1,182 @@
+'''
+geodata.polygons.tiles
+----------------------
+
+Country- and state-scale polygons can have hundreds of thousands of
+vertices and bounding boxes spanning a continent, so every point in the
+bounding box pays for a contains() test against the whole geometry.
+
+At index build time each polygon can instead be split by recursive
+quadrant clipping into tiles of at most max_vertices vertices. The tiles
+are indexed in the R-tree (under the original polygon id) and stored in
+a PolygonStore of their own, with:
+
+    tile_offsets.bin: polygon i -> [offsets[i], offsets[i + 1]) tile ids
+    tile_bounds.bin:  tile t -> min_lon, min_lat, max_lon, max_lat
+
+so a containment test only touches the one or two small tiles whose
+bounding boxes contain the point.
+'''
+
+import array
+import numpy
+import os
+
+from lru import LRU
+from shapely.geometry import box
+from shapely.prepared import prep
+
+from geodata.file_utils import ensure_dir
+from geodata.polygons.store import PolygonStore
+
+
+def num_vertices(poly):
+    if poly.type == 'Polygon':
+        return len(poly.exterior.coords) + sum((len(interior.coords) for interior in poly.interiors))
+    elif poly.type == 'MultiPolygon':
+        return sum((num_vertices(p) for p in poly))
+    return 0
+
+
+def polygonal_parts(geom):
+    '''
+    Polygons in the result of an intersection, which may also contain
+    points or lines where the clip box only touches the polygon
+    '''
+    if geom.is_empty:
+        return []
+    if geom.type == 'Polygon':
+        return [geom]
+    elif geom.type in ('MultiPolygon', 'GeometryCollection'):
+        parts = []
+        for g in geom:
+            parts.extend(polygonal_parts(g))
+        return parts
+    return []
+
+
+def split_polygon(poly, max_vertices, max_depth=16):
+    '''
+    Recursively clip poly into quadrants of its bounding box until each
+    piece has at most max_vertices vertices (or max_depth is reached).
+    Returns a list of Polygons whose union is poly.
+    '''
+    tiles = []
+    stack = [(p, 0) for p in polygonal_parts(poly)]
+    while stack:
+        p, depth = stack.pop()
+        if depth >= max_depth or num_vertices(p) <= max_vertices:
+            tiles.append(p)
+            continue
+
+        min_lon, min_lat, max_lon, max_lat = p.bounds
+        mid_lon = (min_lon + max_lon) / 2.0
+        mid_lat = (min_lat + max_lat) / 2.0
+
+        for quadrant in (box(min_lon, min_lat, mid_lon, mid_lat),
+                         box(mid_lon, min_lat, max_lon, mid_lat),
+                         box(min_lon, mid_lat, mid_lon, max_lat),
+                         box(mid_lon, mid_lat, max_lon, max_lat)):
+            for piece in polygonal_parts(p.intersection(quadrant)):
+                stack.append((piece, depth + 1))
+
+    return tiles
+
+
+class PolygonTiles(object):
+    TILE_OFFSETS_FILENAME = 'tile_offsets.bin'
+    TILE_BOUNDS_FILENAME = 'tile_bounds.bin'
+    TILE_STORE_DIR = 'tiles'
+
+    OFFSET_DTYPE = numpy.int64
+    BOUNDS_DTYPE = numpy.float64
+
+    cache_size = 100000
+
+    def __init__(self, d, tile_store=None, offsets=None, bounds=None, cache_size=None):
+        self.d = d
+        ensure_dir(d)
+
+        self.read_only = tile_store is not None
+
+        if not self.read_only:
+            self.tile_store = PolygonStore(os.path.join(d, self.TILE_STORE_DIR))
+            self.offsets = array.array('l', [0])
+            self.bounds = array.array('d')
+            self.num_tiles = 0
+        else:
+            self.tile_store = tile_store
+            self.offsets = offsets
+            self.bounds = bounds.reshape(-1, 4)
+            self.num_tiles = len(self.bounds)
+
+        self.tiles = LRU(cache_size or self.cache_size)
+
+    def add_tiles(self, poly, max_vertices):
+        '''
+        Split poly (which may be one part of the polygon currently being
+        added) into tiles and store them, returns the tiles
+        '''
+        tiles = split_polygon(poly, max_vertices)
+        for tile in tiles:
+            self.tile_store.add_polygon(self.num_tiles, tile)
+            self.bounds.extend(tile.bounds)
+            self.num_tiles += 1
+        return tiles
+
+    def end_polygon(self):
+        '''
+        Called once per polygon after all of its parts have been tiled
+        '''
+        self.offsets.append(self.num_tiles)
+
+    def get_tile(self, t):
+        tile = self.tiles.get(t, None)
+        if tile is None:
+            tile = prep(self.tile_store.get_polygon(t))
+            self.tiles[t] = tile
+        return tile
+
+    def contains(self, i, point):
+        '''
+        Whether polygon i contains point, testing only the tiles whose
+        bounding boxes contain it. Returns None if undecided, i.e. the point
+        lies on a tile edge, which may be a clip line inside the polygon.
+        '''
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        if start == end:
+            return None
+
+        x, y = point.x, point.y
+        bounds = self.bounds[start:end]
+        candidates = numpy.nonzero((bounds[:, 0] <= x) & (bounds[:, 2] >= x) &
+                                   (bounds[:, 1] <= y) & (bounds[:, 3] >= y))[0]
+
+        for k in candidates:
+            tile = self.get_tile(start + int(k))
+            if tile.contains(point):
+                return True
+            elif tile.intersects(point):
+                return None
+
+        return False
+
+    def save(self):
+        self.tile_store.save()
+        for filename, values, dtype in ((self.TILE_OFFSETS_FILENAME, self.offsets, self.OFFSET_DTYPE),
+                                        (self.TILE_BOUNDS_FILENAME, self.bounds, self.BOUNDS_DTYPE)):
+            f = open(os.path.join(self.d, filename), 'wb')
+            numpy.asarray(values, dtype=dtype).tofile(f)
+            f.close()
+
+    @classmethod
+    def exists(cls, d):
+        return os.path.exists(os.path.join(d, cls.TILE_OFFSETS_FILENAME))
+
+    @classmethod
+    def load(cls, d, cache_size=None):
+        return cls(d,
+                   tile_store=PolygonStore.load(os.path.join(d, cls.TILE_STORE_DIR)),
+                   offsets=PolygonStore.mmap_array(os.path.join(d, cls.TILE_OFFSETS_FILENAME), cls.OFFSET_DTYPE),
+                   bounds=PolygonStore.mmap_array(os.path.join(d, cls.TILE_BOUNDS_FILENAME), cls.BOUNDS_DTYPE),
+                   cache_size=cache_size)
@@ -0,0 +1,200 @@
+'''
+geodata.properties_store
+------------------------
+
+Memory-mapped store for the properties of polygon and point indices, as
+an alternative to one JSON blob per record in LevelDB. Admin polygons
+carry dozens of name:* tags, but most lookups only read a few keys, so
+decoding the whole blob on every point_in_poly is wasted work.
+
+Property keys are interned in a single key table (keys.json) and each
+record is stored as:
+
+    uint32 num_fields
+    num_fields * (uint32 key_id, uint32 value_end)
+    JSON-encoded values, concatenated
+
+in records.bin, with offsets.bin giving record i's byte range. get()
+returns a LazyProperties mapping which only parses the header up front
+and decodes each value the first time it's requested. Recently used
+records are kept in an LRU along with whatever fields have been decoded,
+so high-frequency polygons like countries and states are decoded once.
+
+Since cached records are shared between callers, LazyProperties is
+read-only. Callers which modify properties should modify a copy().
+'''
+
+import array
+import numpy
+import os
+import six
+import struct
+import ujson as json
+
+from collections import Mapping
+from lru import LRU
+
+from geodata.file_utils import ensure_dir
+from geodata.geohash_index import mmap_array
+
+
+class LazyProperties(Mapping):
+    def __init__(self, keys, record):
+        self.record = record
+
+        num_fields = struct.unpack_from('=I', record, 0)[0]
+        header = struct.unpack_from('={}I'.format(num_fields * 2), record, 4)
+        values_start = 4 + num_fields * 8
+
+        self.spans = {}
+        start = values_start
+        for j in xrange(num_fields):
+            end = values_start + header[j * 2 + 1]
+            self.spans[keys[header[j * 2]]] = (start, end)
+            start = end
+
+        self.values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self.values[key]
+        except KeyError:
+            start, end = self.spans[key]
+            value = self.values[key] = json.loads(self.record[start:end])
+            return value
+
+    def __contains__(self, key):
+        return key in self.spans
+
+    def __iter__(self):
+        return iter(self.spans)
+
+    def __len__(self):
+        return len(self.spans)
+
+    def copy(self):
+        return dict(six.iteritems(self))
+
+    def __reduce__(self):
+        # Pickle (e.g. through geodata.service proxies) as a plain dict
+        return (dict, (self.copy(),))
+
+    def __repr__(self):
+        return repr(self.copy())
+
+
+class PropertiesStore(object):
+    KEYS_FILENAME = 'keys.json'
+    OFFSETS_FILENAME = 'offsets.bin'
+    RECORDS_FILENAME = 'records.bin'
+
+    OFFSET_TYPE = 'l'
+    OFFSET_DTYPE = numpy.int64
+
+    cache_size = 10000
+
+    def __init__(self, d, keys=None, offsets=None, records=None, cache_size=None):
+        self.d = d
+        ensure_dir(d)
+
+        self.read_only = records is not None
+
+        if not self.read_only:
+            self.keys = []
+            self.key_ids = {}
+            self.offsets = array.array(self.OFFSET_TYPE, [0])
+            # Opened for reading as well so records can be read back before save()
+            self.records_file = open(os.path.join(d, self.RECORDS_FILENAME), 'w+b')
+        else:
+            self.keys = keys
+            self.key_ids = {k: i for i, k in enumerate(keys)}
+            self.offsets = offsets
+            self.records = records
+            self.records_file = None
+
+        self.cache = LRU(cache_size or self.cache_size)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def key_id(self, key):
+        key_id = self.key_ids.get(key)
+        if key_id is None:
+            key_id = self.key_ids[key] = len(self.keys)
+            self.keys.append(key)
+        return key_id
+
+    def add(self, i, properties):
+        if self.read_only:
+            raise ValueError('Properties store at {} is read-only'.format(self.d))
+        if i != len(self):
+            raise ValueError('Properties must be added in order, expected {}, got {}'.format(len(self), i))
+
+        header = array.array('I', [len(properties)])
+        values = []
+        end = 0
+        for key, value in six.iteritems(properties):
+            value = json.dumps(value)
+            end += len(value)
+            header.extend([self.key_id(key), end])
+            values.append(value)
+
+        record = header.tostring() + ''.join(values)
+        self.records_file.write(record)
+        self.offsets.append(self.offsets[-1] + len(record))
+
+    def get(self, i):
+        properties = self.cache.get(i, None)
+        if properties is not None:
+            self.cache_hits += 1
+            return properties
+
+        self.cache_misses += 1
+        properties = LazyProperties(self.keys, self.record(i))
+        self.cache[i] = properties
+        return properties
+
+    def record(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        if self.read_only:
+            return self.records[start:end].tostring()
+
+        if self.records_file.closed:
+            raise ValueError('Properties store at {} has been saved, use PropertiesStore.load to read it'.format(self.d))
+
+        # Still building, read the record back from the file and
+        # return to the end for the next add
+        self.records_file.seek(start)
+        record = self.records_file.read(end - start)
+        self.records_file.seek(0, os.SEEK_END)
+        return record
+
+    def cache_stats(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'size': len(self.cache),
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'hit_rate': float(self.cache_hits) / lookups if lookups else 0.0,
+        }
+
+    def save(self):
+        self.records_file.close()
+        json.dump(self.keys, open(os.path.join(self.d, self.KEYS_FILENAME), 'w'))
+        f = open(os.path.join(self.d, self.OFFSETS_FILENAME), 'wb')
+        numpy.asarray(self.offsets, dtype=self.OFFSET_DTYPE).tofile(f)
+        f.close()
+
+    @classmethod
+    def exists(cls, d):
+        return os.path.exists(os.path.join(d, cls.KEYS_FILENAME))
+
+    @classmethod
+    def load(cls, d, cache_size=None):
+        return cls(d,
+                   keys=json.load(open(os.path.join(d, cls.KEYS_FILENAME))),
+                   offsets=mmap_array(os.path.join(d, cls.OFFSETS_FILENAME), cls.OFFSET_DTYPE),
+                   records=mmap_array(os.path.join(d, cls.RECORDS_FILENAME), numpy.uint8),
+                   cache_size=cache_size)
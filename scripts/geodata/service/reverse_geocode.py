@@ -0,0 +1,140 @@
+'''
+geodata.service.reverse_geocode
+-------------------------------
+
+Reverse geocoding service for multi-process builds.
+
+LevelDB takes a per-process lock on its directory, so the polygon and point
+indexes can't be opened by several worker processes at once. Instead, the
+indexes are loaded exactly once in a server process and the workers talk to
+them through proxies over a local socket (multiprocessing.managers). The
+proxies expose the same point_in_poly/nearest_points API as the indexes
+themselves, so they can be passed anywhere an index is expected, e.g. to
+AddressComponents or OpenAddressesFormatter.
+
+Usage:
+    service = ReverseGeocodeService({
+        'country_rtree': (OSMCountryReverseGeocoder, country_rtree_dir),
+        'osm_rtree': (OSMReverseGeocoder, rtree_dir),
+        'places_index': (PlaceReverseGeocoder, places_index_dir),
+    })
+    service.start()
+
+    pool = service.pool(processes=8)
+    pool.map(build_shard, shards)
+
+    # Inside build_shard (i.e. in a worker process)
+    country_rtree = worker_reverse_geocoder('country_rtree')
+
+The server handles each client connection in its own thread. Most of the
+work in a lookup (GEOS contains tests, LevelDB reads) happens outside the
+GIL, and the polygon LRU cache is shared by all of the workers.
+'''
+
+import logging
+import multiprocessing
+import six
+
+from multiprocessing.managers import BaseManager
+
+REVERSE_GEOCODER_METHODS = (
+    # Polygon indexes
+    'point_in_poly',
+    'points_in_polys',
+    'country_and_languages',
+    'countries_and_languages',
+    'country_and_languages_from_components',
+    # Point indexes
+    'nearest_points',
+    'nearest_n_points',
+    'nearest_n_points_many',
+    'nearest_point',
+    'all_nearby_points',
+    # Both
+    'get_properties',
+    'clear_cache',
+    'cache_stats',
+    'stats',
+    '__len__',
+)
+
+# Populated in the server process
+server_indexes = {}
+
+# Populated in each worker process
+worker_reverse_geocoders = {}
+
+
+def load_server_indexes(indexes):
+    logger = logging.getLogger('reverse_geocode.service')
+    for name, (cls, d) in six.iteritems(indexes):
+        logger.info('loading {} from {}'.format(name, d))
+        server_indexes[name] = cls.load(d)
+
+
+def get_server_index(name):
+    return server_indexes[name]
+
+
+class ReverseGeocodeManager(BaseManager):
+    pass
+
+ReverseGeocodeManager.register('reverse_geocoder', callable=get_server_index,
+                               exposed=REVERSE_GEOCODER_METHODS)
+
+
+def init_worker(reverse_geocoders, initializer=None, initargs=()):
+    worker_reverse_geocoders.update(reverse_geocoders)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def worker_reverse_geocoder(name):
+    '''
+    Get the proxy for a named index inside a process from ReverseGeocodeService.pool
+    '''
+    return worker_reverse_geocoders.get(name)
+
+
+class ReverseGeocodeService(object):
+    def __init__(self, indexes, address=None, authkey=None):
+        '''
+        indexes is a dict of name => (index class, index directory)
+        '''
+        self.indexes = indexes
+        self.manager = ReverseGeocodeManager(address=address, authkey=authkey)
+        self.started = False
+
+    def start(self):
+        self.manager.start(load_server_indexes, (self.indexes,))
+        self.started = True
+
+    def shutdown(self):
+        if self.started:
+            self.manager.shutdown()
+            self.started = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def reverse_geocoder(self, name):
+        if not self.started:
+            raise RuntimeError('Service must be started before requesting reverse geocoders')
+        if name not in self.indexes:
+            raise KeyError('Unknown index: {}'.format(name))
+        return self.manager.reverse_geocoder(name)
+
+    def reverse_geocoders(self):
+        return {name: self.reverse_geocoder(name) for name in self.indexes}
+
+    def pool(self, processes=None, initializer=None, initargs=()):
+        '''
+        Create a multiprocessing.Pool whose workers are connected to the service.
+        Use worker_reverse_geocoder(name) to get at the indexes from inside a task.
+        '''
+        return multiprocessing.Pool(processes, initializer=init_worker,
+                                    initargs=(self.reverse_geocoders(), initializer, initargs))
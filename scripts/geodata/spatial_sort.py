@@ -0,0 +1,156 @@
+'''
+geodata.spatial_sort
+--------------------
+
+Planet-scale inputs (OSM extracts, OpenAddresses CSVs) are ordered by id
+or however the source happened to write them, so consecutive records can
+be on different continents and the polygon LRU caches in the reverse
+geocoders keep evicting polygons that will be needed again shortly.
+
+spatially_sorted() is an optional pre-pass that reorders records along a
+space-filling curve (Hilbert or geohash/Z-order) so nearby records are
+processed together. The input doesn't have to fit in memory: records are
+sorted in chunks which are spilled to temporary files and then streamed
+back through a k-way merge.
+
+Records without a coordinate are kept (in input order) after all the
+others.
+'''
+
+import heapq
+import os
+import shutil
+import tempfile
+
+import geohash
+from six.moves import cPickle as pickle
+
+HILBERT = 'hilbert'
+GEOHASH = 'geohash'
+
+SPATIAL_ORDERS = (HILBERT, GEOHASH)
+
+DEFAULT_HILBERT_ORDER = 16
+DEFAULT_GEOHASH_PRECISION = 12
+
+DEFAULT_CHUNK_SIZE = 500000
+
+
+def hilbert_key(latitude, longitude, order=DEFAULT_HILBERT_ORDER):
+    '''
+    Distance along a Hilbert curve covering the lat/lon plane, on a grid
+    of 2^order x 2^order cells
+    '''
+    n = 1 << order
+    x = max(0, min(int((longitude + 180.0) / 360.0 * n), n - 1))
+    y = max(0, min(int((latitude + 90.0) / 180.0 * n), n - 1))
+
+    d = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve stays continuous
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        s >>= 1
+    return d
+
+
+def geohash_key(latitude, longitude, precision=DEFAULT_GEOHASH_PRECISION):
+    return geohash.encode(latitude, longitude, precision)
+
+
+def sort_key_function(order):
+    if order == HILBERT:
+        return hilbert_key
+    elif order == GEOHASH:
+        return geohash_key
+    raise ValueError('Unknown spatial order: {}, must be one of {}'.format(order, SPATIAL_ORDERS))
+
+
+def write_chunk(chunk, temp_dir):
+    chunk.sort()
+    fd, filename = tempfile.mkstemp(suffix='.chunk', dir=temp_dir)
+    f = os.fdopen(fd, 'wb')
+    for item in chunk:
+        pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+    f.close()
+    return filename
+
+
+def read_chunk(filename):
+    f = open(filename, 'rb')
+    try:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+    finally:
+        f.close()
+
+
+def spatially_sorted(records, coordinates, order=HILBERT, temp_dir=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Generator over records in space-filling curve order, using an external
+    merge sort for inputs larger than chunk_size.
+
+    coordinates: function from a record to (latitude, longitude), which may
+                 return None or raise ValueError/TypeError/KeyError/IndexError if the
+                 record has no usable coordinate
+    order: HILBERT or GEOHASH
+    '''
+    key_func = sort_key_function(order)
+
+    work_dir = tempfile.mkdtemp(prefix='spatial_sort', dir=temp_dir)
+    chunk_files = []
+    chunk = []
+    missing = None
+
+    try:
+        for i, record in enumerate(records):
+            try:
+                latlon = coordinates(record)
+            except (ValueError, TypeError, KeyError, IndexError):
+                latlon = None
+
+            if latlon is None:
+                if missing is None:
+                    missing = open(os.path.join(work_dir, 'missing'), 'wb')
+                pickle.dump(record, missing, pickle.HIGHEST_PROTOCOL)
+                continue
+
+            # The sequence number keeps the sort stable and means records
+            # themselves are never compared
+            chunk.append((key_func(*latlon), i, record))
+            if len(chunk) >= chunk_size:
+                chunk_files.append(write_chunk(chunk, work_dir))
+                chunk = []
+
+        if not chunk_files:
+            # Fits in memory, no need for a round trip through disk
+            chunk.sort()
+            merged = iter(chunk)
+        else:
+            if chunk:
+                chunk_files.append(write_chunk(chunk, work_dir))
+            chunk = []
+            merged = heapq.merge(*[read_chunk(filename) for filename in chunk_files])
+
+        for key, i, record in merged:
+            yield record
+
+        if missing is not None:
+            missing.close()
+            for record in read_chunk(missing.name):
+                yield record
+    finally:
+        if missing is not None:
+            missing.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
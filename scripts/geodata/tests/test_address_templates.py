@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+'''
+Tests for the compiled address template renderer, which must give the
+same output as rendering with pystache and a "first" lambda, the way
+AddressFormatter rendered templates before they were compiled.
+'''
+import random
+import six
+import subprocess
+import unittest
+
+from geodata.address_formatting.formatter import AddressFormatter
+from geodata.address_formatting.templates import CompiledTemplate, parse_template, FIRST, SECTION, INVERTED_SECTION, VARIABLE, ESCAPED_VARIABLE
+from geodata.benchmarks.baselines import pystache_render
+
+
+def template_keys(parts):
+    keys = set()
+    for part_type, value in parts:
+        if part_type in (VARIABLE, ESCAPED_VARIABLE):
+            keys.add(value)
+        elif part_type == FIRST:
+            keys |= template_keys(value)
+        elif part_type in (SECTION, INVERTED_SECTION):
+            key, section_parts = value
+            keys.add(key)
+            keys |= template_keys(section_parts)
+    return keys
+
+
+TEMPLATES = [
+    # Variables, escaped and not
+    u'{{{road}}} {{house_number}}\n{{ city }} {{& postcode}}',
+    # First sections, including empty alternatives and sections inside
+    u'{{#first}} {{{city}}} || {{{town}}} || {{{village}}} {{/first}}, {{{postcode}}}',
+    u'{{#first}} {{{house}}}, {{{quarter}}} || {{{house}}} {{/first}}\n{{#first}}{{city}}||{{#town}} {{{town}}} {{/town}}||{{^state}}none{{/state}}{{/first}}',
+    # Sections and inverted sections
+    u'{{#house}}{{{house}}}, {{/house}}{{{road}}}\n{{^house_number}}no number{{/house_number}}',
+    u'{{#road}}{{#city}}{{{road}}} in {{{city}}}{{/city}}{{^city}}{{{road}}}{{/city}}{{/road}}',
+    # Standalone section and comment tags consume their line
+    u'{{{house}}}\n{{#road}}\n{{{road}}} {{{house_number}}}\n{{/road}}\n  {{! comment }}  \n{{^postcode}}\r\nno postcode\r\n{{/postcode}}\n{{{city}}}',
+    u'  {{#first}}  \n {{{city}}} || {{{town}}}\n  {{/first}}\n{{{country}}}',
+    # Tags with whitespace inside
+    u'{{{ road }}} {{  city  }} {{# state }}{{{ state }}}{{/ state }}',
+]
+
+COMPONENT_VALUES = [
+    u'Main Street',
+    u'Rue du Faubourg Saint-Honoré',
+    u'Smith & Sons',
+    u'<b>"Quoted"</b>',
+    u'東京都',
+    u'',
+]
+
+
+class TemplateTestCase(unittest.TestCase):
+    def random_components(self, keys, n=20, seed=0):
+        random.seed(seed)
+        keys = sorted(keys)
+        component_sets = [{}, {k: u'Value & <{}>'.format(k) for k in keys}]
+        for i in xrange(n):
+            component_sets.append({k: random.choice(COMPONENT_VALUES) for k in keys if random.random() < 0.5})
+        return component_sets
+
+    def check_template(self, template, component_sets=None):
+        compiled = CompiledTemplate(template)
+        if component_sets is None:
+            component_sets = self.random_components(template_keys(compiled.parts))
+        for components in component_sets:
+            self.assertEqual(compiled.render(components), pystache_render(template, components),
+                             six.u('template: {}, components: {}').format(template, components))
+
+
+class TestCompiledTemplates(TemplateTestCase):
+    def test_templates(self):
+        for template in TEMPLATES:
+            self.check_template(template)
+
+    def test_parse_errors(self):
+        for template in (u'{{#road}}{{{road}}}', u'{{{road}}}{{/road}}', u'{{#road}}{{/city}}', u'{{> partial}}'):
+            self.assertRaises(ValueError, parse_template, template)
+
+
+class TestConfigTemplates(TemplateTestCase):
+    '''
+    Every template in the address-formatting config. Needs the config
+    bundle (see build_config_bundle.py) or network access to clone the repo
+    '''
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.formatter = AddressFormatter()
+        except subprocess.CalledProcessError:
+            raise unittest.SkipTest('No address formatting config bundle and the repo could not be cloned')
+
+    def config_templates(self):
+        formatter = self.formatter
+        templates = set([formatter.category_template, formatter.chain_template, formatter.intersection_template])
+        for key, value in six.iteritems(formatter.country_formats):
+            if hasattr(value, 'items'):
+                for k in ('address_template', 'fallback_template'):
+                    if value.get(k):
+                        templates.add(value[k])
+            elif isinstance(value, six.string_types):
+                templates.add(value)
+        templates.update(formatter.templates_no_name.values())
+        templates.update(formatter.templates_place_only.values())
+        return sorted([t for t in templates if isinstance(t, six.string_types)])
+
+    def test_config_templates(self):
+        templates = self.config_templates()
+        self.assertTrue(templates)
+        for i, template in enumerate(templates):
+            component_sets = self.random_components(template_keys(parse_template(template)), seed=i)
+            self.check_template(template, component_sets)
+
+            # Templates and components tagged the way format_address does
+            tagged_template = self.formatter.tag_template_separators(template)
+            tagged_components = [{k: self.formatter.tagged_tokens(v, k) for k, v in six.iteritems(components)}
+                                 for components in component_sets]
+            self.check_template(tagged_template, tagged_components)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+'''
+Tests for the opt-in lookup instrumentation on polygon and point indices.
+'''
+import shutil
+import tempfile
+import unittest
+
+from shapely.geometry import box
+
+from geodata.instrumentation import LatencyHistogram
+from geodata.points.index import PointIndex
+from geodata.polygons.index import RTreePolygonIndex
+
+
+class InstrumentedPolygonIndex(RTreePolygonIndex):
+    instrument = True
+
+
+class InstrumentedPointIndex(PointIndex):
+    instrument = True
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_histogram(self):
+        histogram = LatencyHistogram()
+        for seconds in (0.0, 5e-7, 1e-6, 1.5e-6, 2e-6, 0.01, 1e9):
+            histogram.add(seconds)
+        # < 1us, [1, 2)us, [2, 4)us, [8192, 16384)us and the last bucket
+        self.assertEqual([(b, n) for b, n in enumerate(histogram.buckets) if n],
+                         [(0, 2), (1, 2), (2, 1), (14, 1), (LatencyHistogram.NUM_BUCKETS - 1, 1)])
+        self.assertEqual(histogram.count, 7)
+        self.assertEqual(histogram.min, 0.0)
+        self.assertEqual(histogram.max, 1e9)
+        self.assertEqual(LatencyHistogram().summary()['p99_ms'], 0.0)
+
+    def test_point_in_poly(self):
+        index = InstrumentedPolygonIndex(save_dir=self.temp_dir)
+        for poly, props in ((box(-74.0, 40.7, -73.9, 40.8), {'name': 'Manhattan'}),
+                            (box(2.2, 48.8, 2.4, 48.9), {'name': 'Paris'})):
+            index.index_polygon(poly)
+            index.add_polygon(poly, props)
+
+        self.assertEqual(index.point_in_poly(40.75, -73.95), {'name': 'Manhattan'})
+        self.assertEqual(index.point_in_poly(48.85, 2.3), {'name': 'Paris'})
+        self.assertEqual(index.point_in_poly(0.0, 0.0), None)
+
+        stats = index.stats()
+        stages = stats['stages']
+        self.assertEqual(stages['point_in_poly']['count'], 3)
+        self.assertEqual(stages['candidates']['count'], 3)
+        self.assertEqual(stages['properties']['count'], 2)
+        self.assertEqual(stats['counters']['candidates_results'], 2)
+        for summary in stages.values():
+            self.assertTrue(summary['max_ms'] >= summary['min_ms'] >= 0.0)
+        self.assertIn('point_in_poly n=3', index.instrumentation.summary_string())
+
+    def test_nearest_points(self):
+        index = InstrumentedPointIndex(save_dir=self.temp_dir)
+        index.add_point(40.75, -73.95, {'name': 'a'})
+        index.add_point(40.7501, -73.9501, {'name': 'b'})
+
+        self.assertEqual([props for props, lat, lon, distance in index.nearest_points(40.75, -73.95)],
+                         [{'name': 'a'}, {'name': 'b'}])
+        self.assertEqual(index.nearest_points(0.0, 0.0), [])
+
+        stats = index.stats()
+        stages = stats['stages']
+        self.assertEqual(stages['nearest_points']['count'], 2)
+        self.assertEqual(stages['candidates']['count'], 2)
+        self.assertEqual(stages['properties']['count'], 2)
+        self.assertEqual(stats['counters']['candidates_results'], 2)
+        self.assertIn('nearest_points n=2', index.instrumentation.summary_string())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+'''
+Tests for OSMIntersectionReader, checking that the single-pass extraction
+produces the same intersections as the two-pass one.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from geodata.osm.intersections import OSMIntersectionReader
+
+OSM_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+ <node id="1" lat="40.7000000" lon="-74.0000000"/>
+ <node id="2" lat="40.7010000" lon="-74.0000000">
+  <tag k="highway" v="traffic_signals"/>
+ </node>
+ <node id="3" lat="40.7020000" lon="-74.0000000"/>
+ <node id="4" lat="40.7010000" lon="-74.0010000"/>
+ <node id="5" lat="40.7010000" lon="-73.9990000"/>
+ <node id="6" lat="40.7020000" lon="-73.9990000"/>
+ <node id="7" lat="40.7030000" lon="-73.9990000"/>
+ <node id="8" lat="40.7040000" lon="-73.9990000"/>
+ <way id="100">
+  <nd ref="1"/>
+  <nd ref="2"/>
+  <nd ref="3"/>
+  <tag k="highway" v="residential"/>
+  <tag k="name" v="Main Street"/>
+ </way>
+ <way id="101">
+  <nd ref="4"/>
+  <nd ref="2"/>
+  <nd ref="5"/>
+  <tag k="highway" v="residential"/>
+  <tag k="name" v="Oak Avenue"/>
+ </way>
+ <way id="102">
+  <nd ref="5"/>
+  <nd ref="6"/>
+  <nd ref="3"/>
+  <nd ref="5"/>
+  <tag k="highway" v="residential"/>
+  <tag k="name" v="Elm Street"/>
+ </way>
+ <way id="103">
+  <nd ref="3"/>
+  <nd ref="6"/>
+  <nd ref="9"/>
+  <tag k="highway" v="residential"/>
+  <tag k="name" v="Main Street"/>
+ </way>
+ <way id="104">
+  <nd ref="7"/>
+  <nd ref="8"/>
+  <tag k="highway" v="service"/>
+  <tag k="name" v="Pine Lane"/>
+ </way>
+</osm>
+'''
+
+
+class TestIntersections(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.osm_filename = os.path.join(self.temp_dir, 'ways.osm')
+        f = open(self.osm_filename, 'w')
+        f.write(OSM_XML)
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def create_intersections(self, name, single_pass=False):
+        db_dir = os.path.join(self.temp_dir, '{}_db'.format(name))
+        outfile = os.path.join(self.temp_dir, '{}.json'.format(name))
+        reader = OSMIntersectionReader(self.osm_filename, db_dir)
+        reader.create_intersections(outfile, single_pass=single_pass)
+        return list(OSMIntersectionReader.read_intersections(outfile)), db_dir
+
+    def test_single_pass(self):
+        expected, _ = self.create_intersections('two_pass')
+        intersections, db_dir = self.create_intersections('single_pass', single_pass=True)
+
+        self.assertEqual(intersections, expected)
+
+        ways = dict([(node_id, sorted([w['name'] for w in ways])) for node_id, node, ways in intersections])
+        self.assertEqual(ways, {
+            '2': ['Main Street', 'Oak Avenue'],
+            # Way 103 has the same name as way 100 so is only included once
+            '3': ['Elm Street', 'Main Street'],
+            '5': ['Elm Street', 'Oak Avenue'],
+            '6': ['Elm Street', 'Main Street'],
+        })
+
+        nodes = dict([(node_id, node) for node_id, node, ways in intersections])
+        self.assertEqual(nodes['2']['highway'], 'traffic_signals')
+        self.assertEqual(nodes['2']['lat'], '40.7010000')
+
+        # Only the LevelDB directories are left behind, not the temporary files
+        self.assertEqual(sorted(os.listdir(db_dir)), ['nodes', 'ways'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+'''
+Round-trip tests for the node location stores used by OSMPolygonReader
+with --node-locations.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from geodata.osm.node_locations import SortedNodeLocations, DenseNodeLocations
+
+# (node_id, lon, lat) in increasing id order, as they appear in OSM files
+NODES = [
+    (1, -73.9857, 40.7484),
+    (2, 2.2945, 48.8584),
+    (17, -0.1246, 51.5007),
+    (1000, 151.2153, -33.8568),
+    (65537, -43.2105, -22.9519),
+    (1234567, 139.7454, 35.6586),
+    (1234568, -180.0, -90.0),
+    (1234570, 180.0, 90.0),
+]
+
+MISSING = [0, 3, 999, 1234569, 2 ** 40]
+
+
+class NodeLocationsTestCase(unittest.TestCase):
+    # DenseNodeLocations stores fixed-point coordinates with 7 decimal places
+    places = 7
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def build(self, store):
+        for node_id, lon, lat in NODES:
+            store.add(node_id, lon, lat)
+        return store
+
+    def assertRoundTrip(self, store):
+        node_ids = [node_id for node_id, lon, lat in NODES]
+        self.assertTrue(store.has_nodes(node_ids))
+
+        coords = store.coordinates(node_ids)
+        self.assertEqual(len(coords), len(NODES))
+        for (node_id, lon, lat), (c_lon, c_lat) in zip(NODES, coords):
+            self.assertAlmostEqual(c_lon, lon, places=self.places)
+            self.assertAlmostEqual(c_lat, lat, places=self.places)
+
+        # Out of order and repeated ids, as in a closed way
+        way = [17, 1000, 2, 17]
+        expected = {node_id: (lon, lat) for node_id, lon, lat in NODES}
+        for node_id, (c_lon, c_lat) in zip(way, store.coordinates(way)):
+            self.assertAlmostEqual(c_lon, expected[node_id][0], places=self.places)
+            self.assertAlmostEqual(c_lat, expected[node_id][1], places=self.places)
+
+        for node_id in MISSING:
+            self.assertFalse(store.has_nodes([node_id]))
+            self.assertFalse(store.has_nodes([1, node_id]))
+
+
+class TestSortedNodeLocations(NodeLocationsTestCase):
+    def test_memory(self):
+        store = self.build(SortedNodeLocations())
+        self.assertRoundTrip(store)
+        self.assertRaises(ValueError, store.add, 2 ** 41, 0.0, 0.0)
+        store.close()
+
+    def test_file(self):
+        path = os.path.join(self.temp_dir, 'node_locations')
+        store = SortedNodeLocations(path)
+        # Flush in several chunks
+        store.chunk_size = 3
+        self.build(store)
+        self.assertRoundTrip(store)
+        store.close()
+
+        self.assertEqual(os.path.getsize(path + SortedNodeLocations.IDS_SUFFIX), len(NODES) * 8)
+        self.assertEqual(os.path.getsize(path + SortedNodeLocations.COORDS_SUFFIX), len(NODES) * 16)
+
+    def test_empty(self):
+        store = SortedNodeLocations(os.path.join(self.temp_dir, 'node_locations'))
+        self.assertFalse(store.has_nodes([1]))
+        store.close()
+
+
+class TestDenseNodeLocations(NodeLocationsTestCase):
+    def test_round_trip(self):
+        store = DenseNodeLocations(os.path.join(self.temp_dir, 'node_locations'))
+        self.build(store)
+        self.assertRoundTrip(store)
+        store.close()
+
+    def test_resize(self):
+        store = DenseNodeLocations(os.path.join(self.temp_dir, 'node_locations'))
+        store.initial_size = 16
+        store.resize(store.initial_size)
+        # Every node after the first few grows the file
+        self.build(store)
+        self.assertTrue(store.size > NODES[-1][0])
+        self.assertRoundTrip(store)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
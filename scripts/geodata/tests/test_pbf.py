@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+'''
+Tests for the .pbf reader in geodata.osm.pbf. The .pbf fixture is encoded
+here from the same elements as a matching .osm file, and parse_osm on the
+.pbf must yield the same ids, tags, coordinates and dependencies as
+parse_osm_xml on the .osm.
+'''
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from collections import OrderedDict
+from xml.sax.saxutils import quoteattr
+
+from geodata.osm.extract import parse_osm, parse_osm_xml, NODE, WAY, RELATION, WAYS_RELATIONS
+from geodata.osm.pbf import parse_pbf
+
+# Non-default granularity and offsets
+GRANULARITY = 1000
+LAT_OFFSET = 700
+LON_OFFSET = -300
+
+
+def nanodegrees(value, offset):
+    return int(round((value * 1e9 - offset) / GRANULARITY))
+
+
+def representable(nodes):
+    '''Nodes with coordinates rounded to what the .pbf can store'''
+    return [(node_id, (nanodegrees(lat, LAT_OFFSET) * GRANULARITY + LAT_OFFSET) * 1e-9,
+             (nanodegrees(lon, LON_OFFSET) * GRANULARITY + LON_OFFSET) * 1e-9, tags)
+            for node_id, lat, lon, tags in nodes]
+
+
+# (id, lat, lon, tags)
+DENSE_NODES = representable([
+    (1, 40.1234567, -73.9876543, []),
+    (2, 40.1234999, -73.9871000, [('addr:housenumber', '12'), ('addr:street', 'Main Street')]),
+    (5, 40.1230001, -73.9860002, []),
+    (9, 40.1100000, -73.9800000, [('name', u'Caf\xe9 M\xfcller'), ('amenity', 'cafe')]),
+    (10, 40.1000003, -73.9000007, []),
+])
+
+# Non-dense nodes, negative coordinates
+NODES = representable([
+    (20, -33.8688197, 151.2092955, [('name', 'Sydney')]),
+    (21, -33.8700001, 151.2000001, []),
+])
+
+# (id, tags, refs), refs aren't increasing so deltas are negative
+WAYS = [
+    (100, [('highway', 'residential'), ('name', 'Main Street')], [1, 2, 5, 2]),
+    (101, [('highway', 'primary')], [10, 9, 5]),
+    (102, [('natural', 'coastline')], [21, 20, 21]),
+]
+
+# (id, tags, [(ref, type, role)])
+RELATIONS = [
+    (1000, [('type', 'multipolygon'), ('boundary', 'administrative'), ('name:ja', u'東京')],
+     [(102, WAY, 'outer'), (101, WAY, 'inner'), (9, NODE, 'label'), (1001, RELATION, 'subarea')]),
+    (1001, [('type', 'boundary')], []),
+]
+
+def varint(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def field_varint(field, n):
+    return varint(field << 3) + varint(n)
+
+
+def field_bytes(field, data):
+    return varint((field << 3) | 2) + varint(len(data)) + data
+
+
+def packed(field, values):
+    return field_bytes(field, b''.join([varint(v) for v in values]))
+
+
+def deltas(values):
+    prev = 0
+    out = []
+    for v in values:
+        out.append(zigzag(v - prev))
+        prev = v
+    return out
+
+
+class StringTable(object):
+    def __init__(self):
+        # Index 0 is reserved as the delimiter in dense nodes
+        self.strings = [b'']
+        self.indices = {}
+
+    def index(self, s):
+        s = s.encode('utf-8') if isinstance(s, unicode) else s
+        if s not in self.indices:
+            self.indices[s] = len(self.strings)
+            self.strings.append(s)
+        return self.indices[s]
+
+    def encode(self):
+        return b''.join([field_bytes(1, s) for s in self.strings])
+
+
+def primitive_block(dense_nodes=(), nodes=(), ways=(), relations=()):
+    strings = StringTable()
+    groups = []
+
+    if dense_nodes:
+        keys_vals = []
+        if any([tags for i, lat, lon, tags in dense_nodes]):
+            for node_id, lat, lon, tags in dense_nodes:
+                for k, v in tags:
+                    keys_vals.extend((strings.index(k), strings.index(v)))
+                keys_vals.append(0)
+        dense = (packed(1, deltas([node_id for node_id, lat, lon, tags in dense_nodes])) +
+                 packed(8, deltas([nanodegrees(lat, LAT_OFFSET) for node_id, lat, lon, tags in dense_nodes])) +
+                 packed(9, deltas([nanodegrees(lon, LON_OFFSET) for node_id, lat, lon, tags in dense_nodes])))
+        if keys_vals:
+            dense += packed(10, keys_vals)
+        groups.append(field_bytes(2, dense))
+
+    for node_id, lat, lon, tags in nodes:
+        node = (field_varint(1, zigzag(node_id)) +
+                packed(2, [strings.index(k) for k, v in tags]) +
+                packed(3, [strings.index(v) for k, v in tags]) +
+                field_varint(8, zigzag(nanodegrees(lat, LAT_OFFSET))) +
+                field_varint(9, zigzag(nanodegrees(lon, LON_OFFSET))))
+        groups.append(field_bytes(1, node))
+
+    if ways:
+        group = b''
+        for way_id, tags, refs in ways:
+            way = (field_varint(1, way_id) +
+                   packed(2, [strings.index(k) for k, v in tags]) +
+                   packed(3, [strings.index(v) for k, v in tags]) +
+                   packed(8, deltas(refs)))
+            group += field_bytes(3, way)
+        groups.append(group)
+
+    if relations:
+        member_types = {NODE: 0, WAY: 1, RELATION: 2}
+        group = b''
+        for relation_id, tags, members in relations:
+            relation = (field_varint(1, relation_id) +
+                        packed(2, [strings.index(k) for k, v in tags]) +
+                        packed(3, [strings.index(v) for k, v in tags]) +
+                        packed(8, [strings.index(role) for ref, member_type, role in members]) +
+                        packed(9, deltas([ref for ref, member_type, role in members])) +
+                        packed(10, [member_types[member_type] for ref, member_type, role in members]))
+            group += field_bytes(4, relation)
+        groups.append(group)
+
+    return (field_bytes(1, strings.encode()) +
+            b''.join([field_bytes(2, g) for g in groups]) +
+            field_varint(17, GRANULARITY) +
+            # Offsets are int64, not sint64, so negative values are 10 bytes
+            field_varint(19, LAT_OFFSET & 0xffffffffffffffff) +
+            field_varint(20, LON_OFFSET & 0xffffffffffffffff))
+
+
+def file_block(blob_type, data, compress=True):
+    if compress:
+        blob = field_varint(2, len(data)) + field_bytes(3, zlib.compress(data))
+    else:
+        blob = field_bytes(1, data)
+    header = field_bytes(1, blob_type) + field_varint(3, len(blob))
+    return struct.pack('!i', len(header)) + header + blob
+
+
+def write_pbf(filename):
+    f = open(filename, 'wb')
+    # OSMHeader blocks are skipped by the reader, its contents don't matter
+    f.write(file_block(b'OSMHeader', b''))
+    f.write(file_block(b'OSMData', primitive_block(dense_nodes=DENSE_NODES[:3])))
+    # Dense nodes without any tags have no keys_vals field, stored uncompressed
+    f.write(file_block(b'OSMData', primitive_block(dense_nodes=[n for n in DENSE_NODES[3:] if not n[-1]]), compress=False))
+    f.write(file_block(b'OSMData', primitive_block(dense_nodes=[n for n in DENSE_NODES[3:] if n[-1]], nodes=NODES)))
+    f.write(file_block(b'OSMData', primitive_block(ways=WAYS)))
+    f.write(file_block(b'OSMData', primitive_block(relations=RELATIONS)))
+    f.close()
+
+
+def xml_tags(tags):
+    return u''.join([u'<tag k={} v={}/>'.format(quoteattr(k), quoteattr(v)) for k, v in tags])
+
+
+def write_osm(filename):
+    lines = [u'<?xml version="1.0" encoding="UTF-8"?>', u'<osm version="0.6">']
+    # Same order as the .pbf
+    all_nodes = DENSE_NODES[:3] + [n for n in DENSE_NODES[3:] if not n[-1]] + [n for n in DENSE_NODES[3:] if n[-1]] + NODES
+    for node_id, lat, lon, tags in all_nodes:
+        lines.append(u'<node id="{}" lat="{:.7f}" lon="{:.7f}">{}</node>'.format(node_id, lat, lon, xml_tags(tags)))
+    for way_id, tags, refs in WAYS:
+        lines.append(u'<way id="{}">{}{}</way>'.format(way_id, u''.join([u'<nd ref="{}"/>'.format(r) for r in refs]),
+                                                       xml_tags(tags)))
+    for relation_id, tags, members in RELATIONS:
+        lines.append(u'<relation id="{}">{}{}</relation>'.format(
+                     relation_id,
+                     u''.join([u'<member type="{}" ref="{}" role="{}"/>'.format(t, r, role) for r, t, role in members]),
+                     xml_tags(tags)))
+    lines.append(u'</osm>')
+
+    f = open(filename, 'w')
+    f.write(u'\n'.join(lines).encode('utf-8'))
+    f.close()
+
+
+class TestPBF(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.pbf_filename = os.path.join(self.temp_dir, 'test.osm.pbf')
+        self.osm_filename = os.path.join(self.temp_dir, 'test.osm')
+        write_pbf(self.pbf_filename)
+        write_osm(self.osm_filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assertSameElements(self, pbf_elements, xml_elements):
+        self.assertEqual([key for key, props, deps in pbf_elements], [key for key, props, deps in xml_elements])
+
+        for (key, pbf_props, pbf_deps), (_, xml_props, xml_deps) in zip(pbf_elements, xml_elements):
+            pbf_props = OrderedDict(pbf_props)
+            xml_props = OrderedDict(xml_props)
+
+            for coord in ('lat', 'lon'):
+                self.assertEqual(coord in pbf_props, coord in xml_props)
+                if coord in pbf_props:
+                    self.assertAlmostEqual(float(pbf_props.pop(coord)), float(xml_props.pop(coord)), places=7)
+
+            self.assertEqual(pbf_props, xml_props, key)
+            self.assertEqual(pbf_deps, xml_deps, key)
+
+    def check_parse(self, **kw):
+        pbf_elements = list(parse_osm(self.pbf_filename, **kw))
+        xml_elements = list(parse_osm_xml(self.osm_filename, **kw))
+        self.assertTrue(pbf_elements)
+        self.assertSameElements(pbf_elements, xml_elements)
+        return pbf_elements
+
+    def test_all_elements(self):
+        elements = self.check_parse()
+        self.assertEqual(len(elements), len(DENSE_NODES) + len(NODES) + len(WAYS) + len(RELATIONS))
+
+    def test_dependencies(self):
+        elements = dict([(key, deps) for key, props, deps in self.check_parse(dependencies=True)])
+        self.assertEqual(elements['way:100'], [1, 2, 5, 2])
+        self.assertEqual(elements['way:102'], [21, 20, 21])
+        self.assertEqual(elements['relation:1000'], [(102, WAY, 'outer'), (101, WAY, 'inner'),
+                                                     (9, NODE, 'label'), (1001, RELATION, 'subarea')])
+        self.assertEqual(elements['relation:1001'], [])
+        self.assertEqual(elements['node:1'], [])
+
+    def test_coordinates(self):
+        elements = dict([(key, props) for key, props, deps in self.check_parse(allowed_types=set([NODE]))])
+        for node_id, lat, lon, tags in DENSE_NODES + NODES:
+            self.assertAlmostEqual(float(elements[node_id]['lat']), lat, places=7)
+            self.assertAlmostEqual(float(elements[node_id]['lon']), lon, places=7)
+
+    def test_tags(self):
+        elements = dict([(key, props) for key, props, deps in self.check_parse()])
+        self.assertEqual(elements['node:9']['name'], u'Caf\xe9 M\xfcller')
+        self.assertEqual(elements['relation:1000']['name:ja'], u'東京')
+        self.assertNotIn('name', elements['node:1'])
+
+    def test_allowed_types(self):
+        for allowed_types in (set([WAY]), set([RELATION]), WAYS_RELATIONS):
+            self.check_parse(allowed_types=allowed_types, dependencies=True)
+
+    def test_workers(self):
+        self.assertSameElements(list(parse_pbf(self.pbf_filename, dependencies=True, workers=2)),
+                                list(parse_pbf(self.pbf_filename, dependencies=True, workers=1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
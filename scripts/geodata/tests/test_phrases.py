@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+'''
+Randomized tests for PhraseFilter.filter and search_substring, comparing
+them to the implementations they replaced on random tries and on the
+address gazetteers.
+'''
+import random
+import unittest
+
+from geodata.address_expansions.gazetteers import street_types_gazetteer, qualifiers_gazetteer, chains_gazetteer, PREFIX_KEY, SUFFIX_KEY
+from geodata.benchmarks.baselines import backtracking_filter
+from geodata.text.phrases import PhraseFilter
+from geodata.text.tokenize import token_types
+
+
+def linear_search_substring(phrase_filter, s):
+    # search_substring before it was changed to a binary search
+    if len(s) == 0:
+        return None, 0
+
+    for i in xrange(len(s) + 1):
+        if not phrase_filter.trie.has_keys_with_prefix(s[:i]):
+            i -= 1
+            break
+    if i > 0:
+        return (phrase_filter.trie.get(s[:i]), i)
+    else:
+        return None, 0
+
+
+FILLER_WORDS = [u'foo', u'bar', u'123', u'n', u'st', u'saint', u'the', u'', u'é']
+
+
+def random_tokens(keys, max_keys=6):
+    '''
+    Tokens made of whole keys, partial keys (leading tokens or characters
+    of a key) and filler words, so matches overlap and fail part way
+    '''
+    words = []
+    for i in xrange(random.randint(0, max_keys)):
+        key_tokens = random.choice(keys).split(u' ')
+        choice = random.random()
+        if choice < 0.4:
+            words.extend(key_tokens)
+        elif choice < 0.6:
+            words.extend(key_tokens[:random.randint(1, len(key_tokens))])
+        elif choice < 0.8:
+            word = random.choice(key_tokens)
+            words.append(word[:random.randint(1, len(word) or 1)])
+        else:
+            words.append(random.choice(FILLER_WORDS))
+    return [(w, token_types.WORD) for w in words]
+
+
+class TestPhraseFilter(unittest.TestCase):
+    def check_filter(self, phrase_filter, keys, iterations=2000):
+        for i in xrange(iterations):
+            tokens = random_tokens(keys)
+            self.assertEqual(list(PhraseFilter.filter(phrase_filter, tokens)),
+                             list(backtracking_filter(phrase_filter, tokens)),
+                             u' '.join([t for t, c in tokens]))
+
+    def check_search_substring(self, phrase_filter, keys, iterations=2000):
+        for i in xrange(iterations):
+            key = random.choice(keys)
+            for s in (key, key[:random.randint(0, len(key))], key + random.choice(FILLER_WORDS),
+                      u''.join(random.choice(FILLER_WORDS) for j in xrange(3))):
+                self.assertEqual(phrase_filter.search_substring(s), linear_search_substring(phrase_filter, s), s)
+
+    def random_phrase_filter(self):
+        alphabet = u'abé '
+        keys = set()
+        for i in xrange(random.randint(1, 50)):
+            key = u''.join(random.choice(alphabet) for j in xrange(random.randint(1, 12))).strip()
+            # Keys are normalized so never have double spaces
+            key = u' '.join(key.split())
+            if key:
+                keys.add(key)
+        keys = sorted(keys)
+        return PhraseFilter([(k, str(j)) for j, k in enumerate(keys)]), keys
+
+    def test_random_tries(self):
+        random.seed(0)
+        for i in xrange(200):
+            phrase_filter, keys = self.random_phrase_filter()
+            self.check_filter(phrase_filter, keys, iterations=50)
+            self.check_search_substring(phrase_filter, keys, iterations=20)
+
+    def test_long_phrase(self):
+        tokens = [(w, token_types.WORD) for w in u'a b c d e f g h i j'.split()]
+        phrase_filter = PhraseFilter([(u'a b c d e f g h', '1'), (u'a b', '2'), (u'c d e f g h i j k', '3'), (u'j', '4')])
+        self.assertEqual(list(phrase_filter.filter(tokens)), [
+            (True, tokens[:8], [u'1']),
+            (False, tokens[8], []),
+            (True, tokens[9:], [u'4']),
+        ])
+        self.assertEqual(list(phrase_filter.filter(tokens)), list(backtracking_filter(phrase_filter, tokens)))
+
+    def gazetteer_keys(self, gazetteer):
+        return [k for k in gazetteer.trie.keys() if not k.startswith((PREFIX_KEY, SUFFIX_KEY))]
+
+    def test_gazetteers(self):
+        random.seed(0)
+        for gazetteer in (street_types_gazetteer, qualifiers_gazetteer, chains_gazetteer):
+            keys = self.gazetteer_keys(gazetteer)
+            self.assertTrue(keys)
+            self.check_filter(gazetteer, keys)
+            self.check_search_substring(gazetteer, keys)
+
+            # Prefix and suffix lookups
+            for key in random.sample(keys, min(len(keys), 500)):
+                for s in (PREFIX_KEY + key, SUFFIX_KEY + key[::-1], PREFIX_KEY + key + u'ville', SUFFIX_KEY + u'ssa' + key[::-1]):
+                    self.assertEqual(gazetteer.search_substring(s), linear_search_substring(gazetteer, s), s)
+
+
+if __name__ == '__main__':
+    unittest.main()
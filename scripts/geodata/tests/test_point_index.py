@@ -0,0 +1,122 @@
+'''
+Tests for PointIndex and KDTreePointIndex lookups, single and batched.
+'''
+import gc
+import random
+import shutil
+import tempfile
+import unittest
+
+from geodata.points.index import PointIndex
+from geodata.points.kdtree import KDTreePointIndex
+from geodata.places.reverse_geocode import PlaceReverseGeocoder, KDTreePlaceReverseGeocoder
+
+
+def random_points(n, lat, lon, spread, seed=0):
+    random.seed(seed)
+    return [(lat + random.uniform(-spread, spread), lon + random.uniform(-spread, spread)) for i in xrange(n)]
+
+
+class TestPointIndex(unittest.TestCase):
+    # Around Manhattan at precision 6, cells are roughly 1km by 0.6km
+    LAT = 40.75
+    LON = -73.98
+    PRECISION = 6
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.points = random_points(2000, self.LAT, self.LON, 0.05)
+        # Includes exact duplicates of indexed points and
+        # queries far away from any of them
+        self.queries = (random_points(200, self.LAT, self.LON, 0.06, seed=1) +
+                        self.points[:10] +
+                        [(-33.86, 151.2), (0.0, 0.0)])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def build_index(self, index_class, **kw):
+        index = index_class(save_dir=tempfile.mkdtemp(dir=self.temp_dir), precision=self.PRECISION, **kw)
+        for i, (lat, lon) in enumerate(self.points):
+            index.add_point(lat, lon, {'id': i})
+        return index
+
+    def check_nearest_n_points_many(self, index):
+        lats = [lat for lat, lon in self.queries]
+        lons = [lon for lat, lon in self.queries]
+        for n in (0, 1, 2, 10, len(self.points) + 1):
+            results = index.nearest_n_points_many(lats, lons, n=n)
+            self.assertEqual(len(results), len(self.queries))
+            for (lat, lon), result in zip(self.queries, results):
+                self.assertEqual(result, index.nearest_n_points(lat, lon, n=n))
+            self.assertTrue(any(results) or n == 0)
+
+        self.assertEqual(index.nearest_n_points_many([], [], n=2), [])
+
+    def test_nearest_n_points_many(self):
+        self.check_nearest_n_points_many(self.build_index(PointIndex))
+
+    def test_kdtree_nearest_n_points_many(self):
+        self.check_nearest_n_points_many(self.build_index(KDTreePointIndex))
+
+    def test_kdtree_default_radius(self):
+        # The default radius shrinks away from the equator with the cell width
+        index = KDTreePointIndex(save_dir=tempfile.mkdtemp(dir=self.temp_dir), precision=self.PRECISION)
+        radii = [index.default_radius(lat) for lat in (0.0, 30.0, 60.0, 80.0, 90.0)]
+        self.assertEqual(radii, sorted(radii, reverse=True))
+        self.assertEqual(index.default_radius(-45.0), index.default_radius(45.0))
+        self.assertTrue(radii[-1] > 0)
+
+        index = KDTreePointIndex(save_dir=tempfile.mkdtemp(dir=self.temp_dir), precision=self.PRECISION, radius=5.0)
+        self.assertEqual(index.default_radius(60.0), 5.0)
+
+    def test_load_backend(self):
+        # Indices record which backend built them, loading through either
+        # class gives back the one which was saved
+        for built_class, load_class in ((KDTreePointIndex, PointIndex),
+                                        (PointIndex, KDTreePointIndex),
+                                        (KDTreePlaceReverseGeocoder, PlaceReverseGeocoder),
+                                        (PlaceReverseGeocoder, KDTreePlaceReverseGeocoder)):
+            index = self.build_index(built_class)
+            d = index.save_dir
+            index.save()
+            expected = index.nearest_n_points(self.LAT, self.LON, n=5)
+            # Release the LevelDB lock
+            del index
+            gc.collect()
+
+            index = load_class.load(d)
+            self.assertIs(type(index), built_class)
+            self.assertEqual(index.nearest_n_points(self.LAT, self.LON, n=5), expected)
+            del index
+            gc.collect()
+
+    def test_backends(self):
+        '''
+        Everything the KD-tree finds within its default radius is also a
+        candidate in the geohash backend, so both give the same nearest
+        points within that radius, at any latitude
+        '''
+        for lat, lon in ((0.5, 10.0), (self.LAT, self.LON), (60.0, 10.0), (70.0, 25.0)):
+            self.points = random_points(2000, lat, lon, 0.03)
+            queries = random_points(200, lat, lon, 0.03, seed=1)
+
+            geohash_index = self.build_index(PointIndex)
+            kdtree_index = self.build_index(KDTreePointIndex)
+
+            for query_lat, query_lon in queries:
+                radius = kdtree_index.default_radius(query_lat)
+
+                ids = kdtree_index.candidate_ids(query_lat, query_lon)
+                self.assertTrue(len(ids))
+                self.assertFalse(set(ids.tolist()) - set(geohash_index.candidate_ids(query_lat, query_lon).tolist()))
+
+                for n in (1, 5, 50):
+                    expected = [(i, distance) for i, _, _, distance in geohash_index.nearest_n(query_lat, query_lon, n)
+                                if distance < radius]
+                    self.assertEqual([(i, distance) for i, _, _, distance in kdtree_index.nearest_n(query_lat, query_lon, n)],
+                                     expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
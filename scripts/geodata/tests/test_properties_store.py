@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+'''
+Tests for the memory-mapped properties store used by the polygon and
+point indices with --mmap-properties.
+'''
+import shutil
+import tempfile
+import unittest
+
+from six.moves import cPickle as pickle
+
+from geodata.properties_store import PropertiesStore, LazyProperties
+
+PROPERTIES = [
+    {'name': 'New York', 'admin_level': 4, 'population': 19453561, 'id': 61320},
+    {'name': u'Zürich', 'name:ja': u'チューリッヒ', 'wikidata': 'Q72'},
+    {},
+    {'name': 'Nested', 'ids': [1, 2, 3], 'bbox': {'lat': 40.5, 'lon': -74.25}, 'empty': '', 'missing': None},
+    {'name': 'Paris', 'admin_level': 8},
+]
+
+
+class TestPropertiesStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def build_store(self, cache_size=None):
+        store = PropertiesStore(self.temp_dir, cache_size=cache_size)
+        for i, props in enumerate(PROPERTIES):
+            store.add(i, props)
+        return store
+
+    def assertProperties(self, store):
+        self.assertEqual(len(store), len(PROPERTIES))
+        for i, props in enumerate(PROPERTIES):
+            self.assertEqual(dict(store.get(i)), props)
+
+    def test_round_trip(self):
+        store = self.build_store()
+        store.save()
+        self.assertTrue(PropertiesStore.exists(self.temp_dir))
+
+        store = PropertiesStore.load(self.temp_dir)
+        self.assertTrue(store.read_only)
+        self.assertProperties(store)
+        self.assertEqual(store.get(1)['name'], u'Zürich')
+        self.assertRaises(ValueError, store.add, len(PROPERTIES), {'name': 'Berlin'})
+
+    def test_get_before_save(self):
+        store = self.build_store(cache_size=1)
+        self.assertProperties(store)
+
+        # Adding after a get still appends to the end of the file
+        store.add(len(PROPERTIES), {'name': 'Berlin'})
+        self.assertEqual(dict(store.get(len(PROPERTIES))), {'name': 'Berlin'})
+        store.save()
+
+        # Records not in the cache can't be read from the closed file
+        self.assertRaises(ValueError, store.get, 0)
+
+        store = PropertiesStore.load(self.temp_dir)
+        self.assertEqual(len(store), len(PROPERTIES) + 1)
+        self.assertEqual(dict(store.get(len(PROPERTIES))), {'name': 'Berlin'})
+        self.assertEqual(dict(store.get(0)), PROPERTIES[0])
+
+    def test_add_out_of_order(self):
+        store = PropertiesStore(self.temp_dir)
+        store.add(0, PROPERTIES[0])
+        self.assertRaises(ValueError, store.add, 2, PROPERTIES[1])
+
+    def test_lazy_decode(self):
+        store = self.build_store()
+        store.save()
+        store = PropertiesStore.load(self.temp_dir)
+
+        props = store.get(0)
+        self.assertIsInstance(props, LazyProperties)
+        self.assertEqual(props.values, {})
+
+        self.assertIn('name', props)
+        self.assertNotIn('name:en', props)
+        self.assertEqual(sorted(props), sorted(PROPERTIES[0]))
+        self.assertEqual(len(props), len(PROPERTIES[0]))
+        # Membership and iteration don't decode anything
+        self.assertEqual(props.values, {})
+
+        self.assertEqual(props['admin_level'], 4)
+        self.assertEqual(props.get('name:en'), None)
+        self.assertEqual(list(props.values), ['admin_level'])
+        self.assertRaises(KeyError, lambda: props['name:en'])
+
+        # Read-only, callers should modify a copy
+        def set_name():
+            props['name'] = 'NYC'
+        self.assertRaises(TypeError, set_name)
+        props_copy = props.copy()
+        self.assertIsInstance(props_copy, dict)
+        props_copy['name'] = 'NYC'
+        self.assertEqual(props['name'], 'New York')
+        self.assertEqual(props_copy, dict(PROPERTIES[0], name='NYC'))
+
+    def test_cache(self):
+        store = self.build_store(cache_size=2)
+        store.save()
+        store = PropertiesStore.load(self.temp_dir, cache_size=2)
+
+        props = store.get(0)
+        props['name']
+        # Cached records keep their decoded values
+        self.assertIs(store.get(0), props)
+        self.assertEqual(list(store.get(0).values), ['name'])
+        self.assertEqual((store.cache_hits, store.cache_misses), (2, 1))
+
+        store.get(1)
+        store.get(0)
+        # Evicts 1, the least recently used
+        store.get(3)
+        self.assertEqual(len(store.cache), 2)
+        self.assertIs(store.get(0), props)
+        self.assertIsNot(store.get(1), None)
+        self.assertEqual((store.cache_hits, store.cache_misses), (4, 4))
+
+        stats = store.cache_stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['hits'], 4)
+        self.assertEqual(stats['misses'], 4)
+        self.assertAlmostEqual(stats['hit_rate'], 0.5)
+
+    def test_pickle(self):
+        store = self.build_store()
+        store.save()
+        store = PropertiesStore.load(self.temp_dir)
+
+        for i, expected in enumerate(PROPERTIES):
+            props = store.get(i)
+            for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+                unpickled = pickle.loads(pickle.dumps(props, protocol))
+                self.assertIs(type(unpickled), dict)
+                self.assertEqual(unpickled, expected)
+
+        self.assertEqual(repr(store.get(2)), '{}')
+
+
+if __name__ == '__main__':
+    unittest.main()
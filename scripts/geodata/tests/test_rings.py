@@ -0,0 +1,220 @@
+'''
+Tests for ring assembly in geodata.osm.rings. Node ids double as
+coordinates (node n is at (n, -n)) so a ring's coordinates can be
+checked directly against its node ids.
+'''
+import array
+import random
+import unittest
+
+from geodata.benchmarks.baselines import scc_create_polygons
+from geodata.benchmarks.fixtures import relation_ways
+from geodata.osm.admin_boundaries import OSMPolygonReader
+from geodata.osm.rings import chain_ways, ring_coordinates
+
+
+class Ways(object):
+    '''
+    Ways stored the way OSMPolygonReader stores them, as one flat
+    coordinate array indexed by way_indptr
+    '''
+    def __init__(self, ways):
+        self.ways = ways
+        self.coords = array.array('d')
+        self.indptr = [0]
+        for nodes in ways:
+            for node_id in nodes:
+                self.coords.extend((node_id, -node_id))
+            self.indptr.append(self.indptr[-1] + len(nodes))
+
+    def endpoints(self):
+        return [(nodes[0], nodes[-1]) for nodes in self.ways]
+
+    def way_coordinates(self, k):
+        return self.coords, self.indptr[k], self.indptr[k + 1]
+
+    def rings(self):
+        return [(closed, chain, self.ring_nodes(chain, closed)) for closed, chain in chain_ways(self.endpoints())]
+
+    def ring_nodes(self, chain, closed):
+        coords = ring_coordinates(chain, self.way_coordinates, closed=closed)
+        nodes = [int(x) for x in coords[::2]]
+        assert [int(-y) for y in coords[1::2]] == nodes
+        return nodes
+
+
+def rotations(nodes):
+    '''All starting points and directions of a ring'''
+    for seq in (nodes, nodes[::-1]):
+        for i in xrange(len(seq)):
+            yield seq[i:] + seq[:i]
+
+
+def split_ring(n, num_ways):
+    '''Ways covering the ring of nodes 1..n, consecutive ways sharing an end node'''
+    breaks = sorted(random.sample(xrange(1, n), num_ways - 1))
+    nodes = range(1, n + 1) + [1]
+    starts = [0] + breaks
+    ends = breaks + [n]
+    return [nodes[s:e + 1] for s, e in zip(starts, ends)]
+
+
+class TestRings(unittest.TestCase):
+    def assertRing(self, ring_nodes, expected):
+        self.assertIn(ring_nodes, list(rotations(expected)))
+
+    def assertChained(self, ways, chain, closed):
+        '''Consecutive ways in the chain share a node, in the stated directions'''
+        oriented = [ways[k][::-1] if reverse else ways[k] for k, reverse in chain]
+        for prev, way in zip(oriented, oriented[1:]):
+            self.assertEqual(prev[-1], way[0])
+        if closed:
+            self.assertEqual(oriented[-1][-1], oriented[0][0])
+
+    def test_ring(self):
+        ways = Ways([[1, 2, 3], [3, 4, 5], [5, 6, 1]])
+        rings = ways.rings()
+        self.assertEqual(len(rings), 1)
+        closed, chain, nodes = rings[0]
+        self.assertTrue(closed)
+        self.assertEqual(chain, [(0, False), (1, False), (2, False)])
+        self.assertEqual(nodes, [1, 2, 3, 4, 5, 6])
+
+    def test_reversed_ways(self):
+        ways = Ways([[1, 2, 3], [5, 4, 3], [5, 6, 1]])
+        rings = ways.rings()
+        self.assertEqual(len(rings), 1)
+        closed, chain, nodes = rings[0]
+        self.assertTrue(closed)
+        self.assertEqual(chain, [(0, False), (1, True), (2, False)])
+        self.assertEqual(nodes, [1, 2, 3, 4, 5, 6])
+
+        # Every way reversed
+        ways = Ways([[3, 2, 1], [5, 4, 3], [1, 6, 5]])
+        closed, chain, nodes = ways.rings()[0]
+        self.assertTrue(closed)
+        self.assertChained(ways.ways, chain, closed)
+        self.assertRing(nodes, [1, 2, 3, 4, 5, 6])
+
+    def test_shuffled(self):
+        random.seed(0)
+        for i in xrange(50):
+            n = random.randint(3, 100)
+            ring = split_ring(n, random.randint(1, n - 1))
+            ring = [nodes[::-1] if random.random() < 0.5 else nodes for nodes in ring]
+            random.shuffle(ring)
+
+            ways = Ways(ring)
+            rings = ways.rings()
+            self.assertEqual(len(rings), 1)
+            closed, chain, nodes = rings[0]
+            self.assertTrue(closed)
+            self.assertEqual(sorted([k for k, reverse in chain]), range(len(ring)))
+            self.assertChained(ring, chain, closed)
+            self.assertRing(nodes, range(1, n + 1))
+
+    def test_multiple_rings(self):
+        ways = Ways([[1, 2, 3], [10, 11, 12], [3, 4, 1], [12, 13, 10]])
+        rings = ways.rings()
+        self.assertEqual(len(rings), 2)
+        self.assertTrue(all([closed for closed, chain, nodes in rings]))
+        self.assertRing(rings[0][2], [1, 2, 3, 4])
+        self.assertRing(rings[1][2], [10, 11, 12, 13])
+
+    def test_single_closed_way(self):
+        ways = Ways([[1, 2, 3, 4, 1]])
+        self.assertEqual(ways.rings(), [(True, [(0, False)], [1, 2, 3, 4])])
+
+    def test_open_chain(self):
+        # The first way is in the middle, so the chain has to be
+        # extended backward from its head as well as forward
+        ways = Ways([[3, 4], [5, 4], [1, 2, 3]])
+        rings = ways.rings()
+        self.assertEqual(len(rings), 1)
+        closed, chain, nodes = rings[0]
+        self.assertFalse(closed)
+        self.assertEqual(chain, [(2, False), (0, False), (1, True)])
+        # Open chains keep their last node
+        self.assertEqual(nodes, [1, 2, 3, 4, 5])
+
+        ways = Ways([[3, 4], [3, 2, 1], [4, 5]])
+        closed, chain, nodes = ways.rings()[0]
+        self.assertFalse(closed)
+        self.assertEqual(chain, [(1, True), (0, False), (2, False)])
+        self.assertEqual(nodes, [1, 2, 3, 4, 5])
+
+    def test_missing_member(self):
+        # Ring 1..6 with the way from 3 to 5 missing
+        ways = Ways([[5, 6, 1], [1, 2, 3]])
+        rings = ways.rings()
+        self.assertEqual(len(rings), 1)
+        closed, chain, nodes = rings[0]
+        self.assertFalse(closed)
+        self.assertEqual(nodes, [5, 6, 1, 2, 3])
+
+    def test_branching(self):
+        # Three ways meet at node 2, and a ring touches the branch at node 4
+        ring = [[1, 2], [2, 3], [2, 4], [4, 5, 6], [6, 7, 4]]
+        ways = Ways(ring)
+        rings = ways.rings()
+
+        # Every way is used exactly once
+        self.assertEqual(sorted([k for closed, chain, nodes in rings for k, reverse in chain]), range(len(ring)))
+
+        for closed, chain, nodes in rings:
+            self.assertChained(ring, chain, closed)
+            oriented = [ring[k][::-1] if reverse else ring[k] for k, reverse in chain]
+            expected = [n for way in oriented for n in way[:-1]]
+            if not closed:
+                expected.append(oriented[-1][-1])
+            self.assertEqual(nodes, expected)
+
+        # Node 2 has an odd number of ways so at least one chain is open
+        self.assertFalse(all([closed for closed, chain, nodes in rings]))
+
+    def test_one_node_way(self):
+        # A one-node way in the middle of a ring adds no coordinates
+        ways = Ways([[1, 2, 3], [3], [3, 4, 1]])
+        rings = ways.rings()
+        self.assertTrue(all([closed for closed, chain, nodes in rings]))
+        self.assertEqual(sorted([k for closed, chain, nodes in rings for k, reverse in chain]), [0, 1, 2])
+        self.assertEqual([nodes for closed, chain, nodes in rings if nodes], [[1, 2, 3, 4]])
+
+        # Whether it's picked up by the chain or left over on its own
+        ways = Ways([[1, 2, 3], [3, 4, 1], [3]])
+        rings = ways.rings()
+        self.assertEqual([nodes for closed, chain, nodes in rings if nodes], [[1, 2, 3, 4]])
+
+        # On its own it's a single closed chain with no coordinates
+        ways = Ways([[7]])
+        self.assertEqual(ways.rings(), [(True, [(0, False)], [])])
+
+        # Or the end of an open chain
+        ways = Ways([[1, 2], [2]])
+        closed, chain, nodes = ways.rings()[0]
+        self.assertFalse(closed)
+        self.assertEqual(nodes, [1, 2])
+
+    def test_scc_baseline(self):
+        # Same rings as the implementation endpoint chaining replaced
+        rand = random.Random(0)
+        reader = OSMPolygonReader(None)
+        for way_id, way_nodes in enumerate(relation_ways(rand, num_ways=200, nodes_per_way=5), 1):
+            reader.way_ids.append(way_id)
+            for node_id, lon, lat in way_nodes:
+                reader.way_deps.append(node_id)
+                reader.way_coords.extend((lon, lat))
+            reader.way_indptr.append(len(reader.way_deps))
+        member_ways = list(reader.way_ids)
+        rand.shuffle(member_ways)
+
+        def ring_keys(polys):
+            return sorted([(len(set(poly)), min(poly)) for poly in polys])
+
+        expected = ring_keys(scc_create_polygons(reader, member_ways))
+        self.assertEqual(len(expected), 11)
+        self.assertEqual(ring_keys(reader.create_polygons(member_ways)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+'''
+Tests for the page table script index which replaced the per-codepoint
+list from get_chars_by_script.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from geodata.i18n import unicode_properties
+from geodata.i18n.unicode_properties import ScriptIndex, NUM_CODEPOINTS
+
+RANGES = [
+    (0x0000, 0x0040, 'Common'),
+    (0x0041, 0x005A, 'Latin'),
+    (0x0061, 0x007A, 'Latin'),
+    (0x0391, 0x03A1, 'Greek'),
+    (0x0400, 0x04FF, 'Cyrillic'),
+    (0x4E00, 0x9FFF, 'Han'),
+    (0x1F600, 0x1F64F, 'Common'),
+    (0x10FFFF, 0x10FFFF, 'Private'),
+]
+
+
+def expected_scripts():
+    scripts = [None] * NUM_CODEPOINTS
+    for start, end, script in RANGES:
+        for i in xrange(start, end + 1):
+            scripts[i] = script
+    return scripts
+
+
+class TestScriptIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = ScriptIndex.from_ranges(RANGES)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assertIndex(self, index):
+        expected = expected_scripts()
+        script_ids = index.script_ids()
+        self.assertEqual(len(script_ids), NUM_CODEPOINTS)
+        for c in xrange(0, NUM_CODEPOINTS, 13):
+            self.assertEqual(index[c], expected[c])
+            self.assertEqual(index.scripts[script_ids[c]], expected[c])
+        for start, end, script in RANGES:
+            for c in (start - 1, start, end, end + 1):
+                if 0 <= c < NUM_CODEPOINTS:
+                    self.assertEqual(index[c], expected[c])
+                    self.assertEqual(index.scripts[script_ids[c]], expected[c])
+
+    def test_from_ranges(self):
+        self.assertIndex(self.index)
+        # Identical pages are shared
+        self.assertTrue(len(self.index.pages) < 100 * ScriptIndex.PAGE_SIZE)
+
+    def test_save_load(self):
+        filename = os.path.join(self.temp_dir, 'scripts_index.bin')
+        self.index.save(filename)
+        self.assertIndex(ScriptIndex.load(filename))
+
+        # Truncated file
+        data = open(filename, 'rb').read()
+        open(filename, 'wb').write(data[:len(data) // 2])
+        self.assertRaises((ValueError, EOFError), ScriptIndex.load, filename)
+
+    def test_shipped_index(self):
+        # A prebuilt index is used as is when Scripts.txt isn't there
+        filename = os.path.join(self.temp_dir, 'scripts_index.bin')
+        self.index.save(filename)
+
+        scripts_file = unicode_properties.LOCAL_SCRIPTS_FILE
+        index_file = unicode_properties.LOCAL_SCRIPT_INDEX_FILE
+        unicode_properties.LOCAL_SCRIPTS_FILE = os.path.join(self.temp_dir, 'Scripts.txt')
+        unicode_properties.LOCAL_SCRIPT_INDEX_FILE = filename
+        try:
+            self.assertIndex(unicode_properties.get_script_index())
+        finally:
+            unicode_properties.LOCAL_SCRIPTS_FILE = scripts_file
+            unicode_properties.LOCAL_SCRIPT_INDEX_FILE = index_file
+
+
+if __name__ == '__main__':
+    unittest.main()
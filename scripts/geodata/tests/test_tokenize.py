@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+'''
+Tests for the batch tokenize_many and normalized_tokens_many entry points,
+which must give the same tokens as calling tokenize and normalized_tokens
+on each string.
+'''
+import unittest
+
+from geodata.names.deduping import NameDeduper
+from geodata.text import _normalize, _tokenize
+from geodata.text.normalize import normalized_tokens, normalized_tokens_many, NORMALIZE_STRING_LOWERCASE, TOKEN_OPTIONS_DROP_PERIODS
+from geodata.text.tokenize import tokenize, tokenize_many
+
+STRINGS = [
+    u'',
+    u' ',
+    u'   \t\n',
+    u'Main St.',
+    u'123 Main St, Apt #4',
+    u'Rue du Faubourg Saint-Honoré',
+    u'Straße 12a',
+    u'東京都渋谷区道玄坂1-2-3',
+    u'Kangaroo Point (NSW)',
+    u'Ελληνικά και русский',
+    u'مدينة الكويت',
+    u'Ñö combining',
+    u'\U0001f600 emoji',
+    u'',
+    'Main St. as bytes',
+    u'Café Müller'.encode('utf-8'),
+]
+
+
+class TestTokenizeMany(unittest.TestCase):
+    def test_tokenize_many(self):
+        for whitespace in (False, True):
+            self.assertEqual(tokenize_many(STRINGS, whitespace=whitespace),
+                             [tokenize(s, whitespace=whitespace) for s in STRINGS])
+
+        # Empty strings and strings with no tokens
+        self.assertEqual(tokenize_many([]), [])
+        self.assertEqual(tokenize_many([u'', u' ', u'']), [[], [], []])
+
+        # Token text comes from UTF-8 byte offsets, non-ASCII tokens must
+        # be sliced at the right place
+        tokens = tokenize_many([u'Café Müller', u'東京都 渋谷区'])
+        self.assertEqual([[t for t, c in string_tokens] for string_tokens in tokens],
+                         [[t for t, c in tokenize(s)] for s in (u'Café Müller', u'東京都 渋谷区')])
+        self.assertIn(u'Müller', [t for t, c in tokens[0]])
+
+    def test_normalized_tokens_many(self):
+        for kw in ({},
+                   {'strip_parentheticals': False},
+                   {'whitespace': True},
+                   {'string_options': NORMALIZE_STRING_LOWERCASE, 'token_options': TOKEN_OPTIONS_DROP_PERIODS}):
+            self.assertEqual(normalized_tokens_many(STRINGS, **kw),
+                             [normalized_tokens(s, **kw) for s in STRINGS])
+
+        self.assertEqual(normalized_tokens_many([]), [])
+        self.assertEqual(normalized_tokens_many([u'', u' ']), [[], []])
+
+    def test_without_batch_extension(self):
+        # Extensions built before the batch functions were added
+        tokenize_many_c = _tokenize.tokenize_many
+        normalized_tokens_many_c = _normalize.normalized_tokens_many
+        del _tokenize.tokenize_many
+        del _normalize.normalized_tokens_many
+        try:
+            self.assertEqual(tokenize_many(STRINGS), [tokenize(s) for s in STRINGS])
+            self.assertEqual(normalized_tokens_many(STRINGS), [normalized_tokens(s) for s in STRINGS])
+        finally:
+            _tokenize.tokenize_many = tokenize_many_c
+            _normalize.normalized_tokens_many = normalized_tokens_many_c
+
+    def test_deduper_tokenize_many(self):
+        self.assertEqual(NameDeduper.tokenize_many(STRINGS), [NameDeduper.tokenize(s) for s in STRINGS])
+
+        class UppercaseDeduper(NameDeduper):
+            @classmethod
+            def tokenize(cls, s):
+                return [(t.upper(), c) for t, c in normalized_tokens(s)]
+
+        # Overriding only tokenize is enough, tokenize_many uses it
+        self.assertEqual(UppercaseDeduper.tokenize_many(STRINGS), [UppercaseDeduper.tokenize(s) for s in STRINGS])
+        self.assertEqual(UppercaseDeduper.content_tokens_many([u'Main St']),
+                         [UppercaseDeduper.content_tokens(u'Main St')])
+
+
+if __name__ == '__main__':
+    unittest.main()
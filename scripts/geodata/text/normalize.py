@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import array
 import six
 
 from geodata.text import _normalize
@@ -74,3 +75,32 @@ def normalized_tokens(s, string_options=DEFAULT_STRING_OPTIONS,
         normalized_tokens = remove_parens(normalized_tokens)
 
     return [(s, token_types.from_id(token_type)) for s, token_type in normalized_tokens]
+
+
+def normalized_tokens_many(strings, string_options=DEFAULT_STRING_OPTIONS,
+                           token_options=DEFAULT_TOKEN_OPTIONS,
+                           strip_parentheticals=True, whitespace=False):
+    '''
+    Batch version of normalized_tokens, normalizes and tokenizes a list of
+    strings in one call to the C extension. Returns a list of token lists.
+    '''
+    if not hasattr(_normalize, 'normalized_tokens_many'):
+        # Extension built before normalized_tokens_many was added
+        return [normalized_tokens(s, string_options=string_options, token_options=token_options,
+                                  strip_parentheticals=strip_parentheticals, whitespace=whitespace)
+                for s in strings]
+
+    strings = [safe_decode(s) for s in strings]
+    token_indices, tokens, types = _normalize.normalized_tokens_many(strings, string_options, token_options, whitespace)
+    token_indices = array.array('I', token_indices)
+    types = array.array('I', types)
+
+    token_type_ids = token_types.registry
+
+    all_tokens = []
+    for i in xrange(len(strings)):
+        string_tokens = [(tokens[j], token_type_ids[types[j]]) for j in xrange(token_indices[i], token_indices[i + 1])]
+        if strip_parentheticals:
+            string_tokens = remove_parens(string_tokens)
+        all_tokens.append(string_tokens)
+    return all_tokens
@@ -1,11 +1,8 @@
 import six
 
-from collections import *
 from marisa_trie import BytesTrie
 from geodata.encoding import safe_encode, safe_decode
 
-SENTINEL = None
-
 
 class PhraseFilter(object):
     def __init__(self, phrases):
@@ -17,59 +14,82 @@ class PhraseFilter(object):
     serialize = staticmethod(safe_encode)
     deserialize = staticmethod(safe_decode)
 
-    def filter(self, tokens):
-        def return_item(item):
-            return False, item, []
+    def search_substring(self, s):
+        '''
+        Longest prefix of s which is a prefix of some key in the trie, returns
+        (trie values or None if it's not a key itself, length of the prefix)
+        '''
+        if len(s) == 0:
+            return None, 0
+
+        # has_keys_with_prefix(s[:i]) is monotone in i, so binary search for the last True
+        lo, hi = -1, len(s)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.trie.has_keys_with_prefix(s[:mid]):
+                lo = mid
+            else:
+                hi = mid - 1
+
+        if lo > 0:
+            return (self.trie.get(s[:lo]), lo)
+        else:
+            return None, 0
 
+    def filter(self, tokens):
+        '''
+        Greedy longest match of token sequences (joined by spaces) against the
+        trie. Yields (True, tokens, values) for phrases and (False, token, [])
+        for tokens not in any phrase.
+
+        The tokens are joined once and each match is found on slices of the
+        joined string: the match is extended a token at a time while the
+        text from the start token is still a prefix of some key, then the
+        token boundaries are checked back from there and the first (longest)
+        one that is itself a key is the match.
+        '''
         if not tokens:
             return
 
-        ent = []
-        ent_tokens = []
-
-        queue = deque(tokens + [(SENTINEL,) * 2])
-        skip_until = 0
-
         trie = self.trie
-
-        while queue:
-            item = queue.popleft()
-            t, c = item
-
-            if t is not SENTINEL and trie.has_keys_with_prefix(u' '.join(ent_tokens + [t])):
-                ent.append(item)
-                ent_tokens.append(item[0])
-            elif ent_tokens:
-                res = trie.get(u' '.join(ent_tokens)) or None
-                if res is not None:
-                    yield (True, ent, map(self.deserialize, res))
-                    queue.appendleft(item)
-                    ent = []
-                    ent_tokens = []
-                elif len(ent_tokens) == 1:
-                    yield return_item(ent[0])
-                    ent = []
-                    ent_tokens = []
-                    queue.appendleft(item)
-                else:
-                    have_phrase = False
-
-                    for i in xrange(len(ent) - 1, 0, -1):
-                        remainder = ent[i:]
-                        res = trie.get(u' '.join([e[0] for e in ent[:i]])) or None
-                        if res is not None:
-                            yield (True, ent[:i], map(self.deserialize, res))
-                            have_phrase = True
-                            break
-
-                    if not have_phrase:
-                        yield return_item(ent[0])
-
-                    todos = list(remainder)
-                    todos.append(item)
-                    queue.extendleft(reversed(todos))
-
-                    ent = []
-                    ent_tokens = []
-            elif t is not SENTINEL:
-                yield return_item(item)
+        num_tokens = len(tokens)
+
+        text = u' '.join([t[0] for t in tokens])
+
+        # End offset of each token in text
+        ends = []
+        offset = -1
+        for t in tokens:
+            offset += len(t[0]) + 1
+            ends.append(offset)
+
+        i = 0
+        while i < num_tokens:
+            item = tokens[i]
+            start = ends[i] - len(item[0])
+
+            if not trie.has_keys_with_prefix(text[start:ends[i]]):
+                yield False, item, []
+                i += 1
+                continue
+
+            # Extend while tokens i through lo are still a key prefix
+            lo = i
+            while lo + 1 < num_tokens and trie.has_keys_with_prefix(text[start:ends[lo + 1]]):
+                lo += 1
+
+            # Longest key ending on a token boundary, scanning back from lo
+            # (usually only a token or two)
+            for j in xrange(lo, i - 1, -1):
+                values = trie.get(text[start:ends[j]])
+                if values is not None:
+                    break
+            else:
+                values = None
+
+            if values is not None:
+                yield (True, list(tokens[i:j + 1]), map(self.deserialize, values))
+                i = j + 1
+            else:
+                yield False, item, []
+                i += 1
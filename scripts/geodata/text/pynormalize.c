@@ -188,10 +188,158 @@ exit_normalized_tokens_decref_unistr:
     return 0;
 }
 
+static PyObject *py_normalized_tokens_many(PyObject *self, PyObject *args)
+{
+    PyObject *arg1;
+    uint64_t string_options = LIBPOSTAL_NORMALIZE_DEFAULT_STRING_OPTIONS;
+    uint64_t token_options = LIBPOSTAL_NORMALIZE_DEFAULT_TOKEN_OPTIONS;
+    uint32_t arg_whitespace = 0;
+
+    PyObject *result = NULL;
+
+    if (!PyArg_ParseTuple(args, "O|KKI:normalized_tokens_many", &arg1, &string_options, &token_options, &arg_whitespace)) {
+        return 0;
+    }
+
+    bool whitespace = arg_whitespace;
+
+    PyObject *seq = PySequence_Fast(arg1, "Parameter must be a sequence of strings");
+    if (seq == NULL) {
+        return 0;
+    }
+
+    Py_ssize_t num_strings = PySequence_Fast_GET_SIZE(seq);
+
+    size_t num_tokens = 0;
+    size_t types_capacity = 64;
+
+    // token_indices[i]:token_indices[i + 1] are the tokens of the ith string
+    uint32_t *token_indices = malloc((num_strings + 1) * sizeof(uint32_t));
+    uint32_t *types = malloc(types_capacity * sizeof(uint32_t));
+
+    PyObject *py_tokens = PyList_New(0);
+
+    if (token_indices == NULL || types == NULL) {
+        PyErr_NoMemory();
+        goto exit_normalized_tokens_many_free;
+    }
+
+    if (py_tokens == NULL) {
+        goto exit_normalized_tokens_many_free;
+    }
+
+    token_indices[0] = 0;
+
+    for (Py_ssize_t i = 0; i < num_strings; i++) {
+        PyObject *unistr = PyUnicode_FromObject(PySequence_Fast_GET_ITEM(seq, i));
+        if (unistr == NULL) {
+            PyErr_SetString(PyExc_TypeError,
+                            "Parameter could not be converted to unicode in scanner");
+            goto exit_normalized_tokens_many_free;
+        }
+
+        #ifdef IS_PY3K
+            char *input = PyUnicode_AsUTF8(unistr);
+        #else
+            PyObject *str = PyUnicode_AsEncodedString(unistr, "utf-8", "strict");
+            if (str == NULL) {
+                PyErr_SetString(PyExc_TypeError,
+                                "Parameter could not be utf-8 encoded");
+                Py_DECREF(unistr);
+                goto exit_normalized_tokens_many_free;
+            }
+
+            char *input = PyBytes_AsString(str);
+        #endif
+
+        size_t string_num_tokens = 0;
+        libpostal_normalized_token_t *normalized_tokens = NULL;
+        if (input != NULL) {
+            normalized_tokens = libpostal_normalized_tokens(input, string_options, token_options, whitespace, &string_num_tokens);
+        }
+
+        #ifndef IS_PY3K
+        Py_XDECREF(str);
+        #endif
+        Py_XDECREF(unistr);
+
+        if (input == NULL) {
+            goto exit_normalized_tokens_many_free;
+        }
+
+        // NULL is returned for strings with no tokens
+        if (normalized_tokens != NULL) {
+            bool error = false;
+
+            for (size_t j = 0; j < string_num_tokens; j++) {
+                libpostal_normalized_token_t normalized_token = normalized_tokens[j];
+
+                if (error) {
+                    free(normalized_token.str);
+                    continue;
+                }
+
+                if (num_tokens >= types_capacity) {
+                    uint32_t *resized = realloc(types, types_capacity * 2 * sizeof(uint32_t));
+                    if (resized == NULL) {
+                        PyErr_NoMemory();
+                        error = true;
+                        free(normalized_token.str);
+                        continue;
+                    }
+                    types = resized;
+                    types_capacity *= 2;
+                }
+
+                char *token_str = normalized_token.str;
+                PyObject *py_token = PyUnicode_DecodeUTF8((const char *)token_str, strlen(token_str), "strict");
+                free(token_str);
+
+                // PyList_Append doesn't steal the reference
+                if (py_token == NULL || PyList_Append(py_tokens, py_token) < 0) {
+                    Py_XDECREF(py_token);
+                    error = true;
+                    continue;
+                }
+                Py_DECREF(py_token);
+
+                types[num_tokens++] = (uint32_t)normalized_token.token.type;
+            }
+            free(normalized_tokens);
+
+            if (error) {
+                goto exit_normalized_tokens_many_free;
+            }
+        }
+
+        token_indices[i + 1] = (uint32_t)num_tokens;
+    }
+
+    PyObject *py_token_indices = PyBytes_FromStringAndSize((const char *)token_indices, (num_strings + 1) * sizeof(uint32_t));
+    PyObject *py_types = PyBytes_FromStringAndSize((const char *)types, num_tokens * sizeof(uint32_t));
+
+    if (py_token_indices == NULL || py_types == NULL) {
+        Py_XDECREF(py_token_indices);
+        Py_XDECREF(py_types);
+        goto exit_normalized_tokens_many_free;
+    }
+
+    // N steals the references
+    result = Py_BuildValue("(NON)", py_token_indices, py_tokens, py_types);
+
+exit_normalized_tokens_many_free:
+    free(token_indices);
+    free(types);
+    Py_XDECREF(py_tokens);
+    Py_DECREF(seq);
+    return result;
+}
+
 
 static PyMethodDef normalize_methods[] = {
     {"normalize_string", (PyCFunction)py_normalize_string, METH_VARARGS, "normalize_string(input, options)"},
     {"normalized_tokens", (PyCFunction)py_normalized_tokens, METH_VARARGS, "normalize_token(input, string_options, token_options, whitespace)"},
+    {"normalized_tokens_many", (PyCFunction)py_normalized_tokens_many, METH_VARARGS, "normalized_tokens_many(inputs, string_options, token_options, whitespace) -> (token_indices, tokens, types) with packed uint32 arrays"},
     {NULL, NULL},
 };
 
@@ -104,8 +104,140 @@ error_decref_unistr:
     return 0;
 }
 
+static bool append_token_array(uint32_t **a, size_t n, size_t *capacity, uint32_t value) {
+    if (n >= *capacity) {
+        size_t new_capacity = *capacity * 2;
+        uint32_t *resized = realloc(*a, new_capacity * sizeof(uint32_t));
+        if (resized == NULL) {
+            return false;
+        }
+        *a = resized;
+        *capacity = new_capacity;
+    }
+    (*a)[n] = value;
+    return true;
+}
+
+static PyObject *py_tokenize_many(PyObject *self, PyObject *args)
+{
+    PyObject *arg1;
+    uint32_t arg_whitespace = 0;
+
+    if (!PyArg_ParseTuple(args, "OI:tokenize_many", &arg1, &arg_whitespace)) {
+        return 0;
+    }
+
+    bool whitespace = arg_whitespace;
+
+    PyObject *seq = PySequence_Fast(arg1, "Parameter must be a sequence of strings");
+    if (seq == NULL) {
+        return 0;
+    }
+
+    Py_ssize_t num_strings = PySequence_Fast_GET_SIZE(seq);
+
+    PyObject *result = NULL;
+
+    size_t num_tokens = 0;
+    size_t offsets_capacity = 64, lengths_capacity = 64, types_capacity = 64;
+
+    // token_indices[i]:token_indices[i + 1] are the tokens of the ith string
+    uint32_t *token_indices = malloc((num_strings + 1) * sizeof(uint32_t));
+    uint32_t *offsets = malloc(offsets_capacity * sizeof(uint32_t));
+    uint32_t *lengths = malloc(lengths_capacity * sizeof(uint32_t));
+    uint32_t *types = malloc(types_capacity * sizeof(uint32_t));
+
+    if (token_indices == NULL || offsets == NULL || lengths == NULL || types == NULL) {
+        PyErr_NoMemory();
+        goto exit_tokenize_many_free;
+    }
+
+    token_indices[0] = 0;
+
+    for (Py_ssize_t i = 0; i < num_strings; i++) {
+        PyObject *unistr = PyUnicode_FromObject(PySequence_Fast_GET_ITEM(seq, i));
+        if (unistr == NULL) {
+            PyErr_SetString(PyExc_TypeError,
+                            "Parameter could not be converted to unicode in scanner");
+            goto exit_tokenize_many_free;
+        }
+
+        #ifdef IS_PY3K
+            char *input = PyUnicode_AsUTF8(unistr);
+        #else
+            PyObject *str = PyUnicode_AsEncodedString(unistr, "utf-8", "strict");
+            if (str == NULL) {
+                PyErr_SetString(PyExc_TypeError,
+                                "Parameter could not be utf-8 encoded");
+                Py_DECREF(unistr);
+                goto exit_tokenize_many_free;
+            }
+
+            char *input = PyBytes_AsString(str);
+        #endif
+
+        size_t string_num_tokens = 0;
+        libpostal_token_t *tokens = NULL;
+        if (input != NULL) {
+            tokens = libpostal_tokenize(input, whitespace, &string_num_tokens);
+        }
+
+        #ifndef IS_PY3K
+        Py_XDECREF(str);
+        #endif
+        Py_XDECREF(unistr);
+
+        if (input == NULL) {
+            goto exit_tokenize_many_free;
+        }
+
+        // NULL is returned for strings with no tokens
+        if (tokens != NULL) {
+            for (size_t j = 0; j < string_num_tokens; j++) {
+                libpostal_token_t token = tokens[j];
+                if (!append_token_array(&offsets, num_tokens, &offsets_capacity, (uint32_t)token.offset) ||
+                    !append_token_array(&lengths, num_tokens, &lengths_capacity, (uint32_t)token.len) ||
+                    !append_token_array(&types, num_tokens, &types_capacity, (uint32_t)token.type)) {
+                    free(tokens);
+                    PyErr_NoMemory();
+                    goto exit_tokenize_many_free;
+                }
+                num_tokens++;
+            }
+            free(tokens);
+        }
+
+        token_indices[i + 1] = (uint32_t)num_tokens;
+    }
+
+    PyObject *py_token_indices = PyBytes_FromStringAndSize((const char *)token_indices, (num_strings + 1) * sizeof(uint32_t));
+    PyObject *py_offsets = PyBytes_FromStringAndSize((const char *)offsets, num_tokens * sizeof(uint32_t));
+    PyObject *py_lengths = PyBytes_FromStringAndSize((const char *)lengths, num_tokens * sizeof(uint32_t));
+    PyObject *py_types = PyBytes_FromStringAndSize((const char *)types, num_tokens * sizeof(uint32_t));
+
+    if (py_token_indices == NULL || py_offsets == NULL || py_lengths == NULL || py_types == NULL) {
+        Py_XDECREF(py_token_indices);
+        Py_XDECREF(py_offsets);
+        Py_XDECREF(py_lengths);
+        Py_XDECREF(py_types);
+        goto exit_tokenize_many_free;
+    }
+
+    // N steals the references
+    result = Py_BuildValue("(NNNN)", py_token_indices, py_offsets, py_lengths, py_types);
+
+exit_tokenize_many_free:
+    free(token_indices);
+    free(offsets);
+    free(lengths);
+    free(types);
+    Py_DECREF(seq);
+    return result;
+}
+
 static PyMethodDef tokenize_methods[] = {
     {"tokenize", (PyCFunction)py_tokenize, METH_VARARGS, "tokenize(text, whitespace)"},
+    {"tokenize_many", (PyCFunction)py_tokenize_many, METH_VARARGS, "tokenize_many(texts, whitespace) -> (token_indices, offsets, lengths, types) as packed uint32 arrays"},
     {NULL, NULL},
 };
 
@@ -1,3 +1,5 @@
+import array
+
 from geodata.encoding import safe_encode, safe_decode
 from geodata.text import _tokenize
 from geodata.text.token_types import token_types
@@ -9,3 +11,30 @@ def tokenize(s, whitespace=False):
     s = safe_encode(s)
     return [(safe_decode(s[start:start + length]), token_types.from_id(token_type))
             for start, length, token_type in _tokenize.tokenize(u, whitespace)]
+
+
+def tokenize_raw(s, whitespace=False):
+    '''(offset, length, token type id) for each token, offsets into the UTF-8 string'''
+    return _tokenize.tokenize(safe_decode(s), whitespace)
+
+
+def tokenize_many(strings, whitespace=False):
+    '''
+    Tokenizes a list of strings in one call to the C extension,
+    returns a list of token lists, same as [tokenize(s) for s in strings]
+    '''
+    if not hasattr(_tokenize, 'tokenize_many'):
+        # Extension built before tokenize_many was added
+        return [tokenize(s, whitespace=whitespace) for s in strings]
+
+    strings = [safe_decode(s) for s in strings]
+    token_indices, offsets, lengths, types = [array.array('I', a) for a in _tokenize.tokenize_many(strings, whitespace)]
+
+    token_type_ids = token_types.registry
+
+    tokens = []
+    for i, u in enumerate(strings):
+        s = safe_encode(u)
+        tokens.append([(safe_decode(s[offsets[j]:offsets[j] + lengths[j]]), token_type_ids[types[j]])
+                       for j in xrange(token_indices[i], token_indices[i + 1])])
+    return tokens